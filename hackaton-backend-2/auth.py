@@ -1,10 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from jose import JWTError, jwt
+from typing import NamedTuple, Optional
 
 import models
 import schemas
+from cache import user_ages
 from database import SessionLocal
 from security import (
     hash_password,
@@ -12,14 +15,17 @@ from security import (
     create_access_token,
     SECRET_KEY,
     ALGORITHM,
+    ACCESS_TOKEN_EXPIRE_MINUTES,
 )
-from repositories import UserRepository
+from repositories import UserRepository, TokenRepository
 
 router = APIRouter(tags=["auth"])
 
 # OAuth2 схема – откуда брать токен
 # Полный путь, т.к. router подключается как prefix="/api/auth"
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
+# Для эндпоинтов, где токен необязателен (каталог)
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login", auto_error=False)
 
 
 def get_db():
@@ -34,10 +40,26 @@ def get_user_repository(db: Session = Depends(get_db)) -> UserRepository:
     return UserRepository(db)
 
 
+def get_token_repository(db: Session = Depends(get_db)) -> TokenRepository:
+    return TokenRepository(db)
+
+
+def issue_tokens(user: models.User, token_repo: TokenRepository, refresh_token: str = None) -> dict:
+    """Ответ с парой токенов: короткий access и долгоживущий refresh"""
+    if refresh_token is None:
+        refresh_token = token_repo.issue(user.id)
+    return {
+        "access_token": create_access_token({"sub": str(user.id)}),
+        "token_type": "bearer",
+        "refresh_token": refresh_token,
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+    }
+
+
 @router.post("/register", response_model=schemas.UserOut, status_code=status.HTTP_201_CREATED)
 def register(user_in: schemas.UserRegister, user_repo: UserRepository = Depends(get_user_repository)):
     # Проверка существующего пользователя по логину
-    existing_user = user_repo.session.query(models.User).filter(models.User.login == user_in.login).first()
+    existing_user = user_repo.get_user_by_login(user_in.login)
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -45,7 +67,7 @@ def register(user_in: schemas.UserRegister, user_repo: UserRepository = Depends(
         )
 
     # Проверка существующего пользователя по email
-    existing_email = user_repo.session.query(models.User).filter(models.User.email == user_in.email).first()
+    existing_email = user_repo.get_user_by_email(user_in.email)
     if existing_email:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -74,8 +96,12 @@ def register(user_in: schemas.UserRegister, user_repo: UserRepository = Depends(
 
 
 @router.post("/login", response_model=schemas.Token)
-def login(user_in: schemas.UserLogin, db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.login == user_in.login).first()
+def login(
+    user_in: schemas.UserLogin,
+    db: Session = Depends(get_db),
+    token_repo: TokenRepository = Depends(get_token_repository),
+):
+    user = UserRepository(db).get_user_by_login(user_in.login)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -88,9 +114,35 @@ def login(user_in: schemas.UserLogin, db: Session = Depends(get_db)):
             detail="Неправильный логин или пароль",
         )
 
-    access_token = create_access_token({"sub": str(user.id)})
+    return issue_tokens(user, token_repo)
+
+
+@router.post("/refresh", response_model=schemas.Token)
+def refresh(body: schemas.RefreshTokenRequest, token_repo: TokenRepository = Depends(get_token_repository)):
+    """
+    Новый access_token по refresh-токену – без проверки пароля (и без bcrypt).
+    Refresh-токен одноразовый: в ответе выдается следующий.
+    """
+    rotated = token_repo.rotate(body.refresh_token)
+    if rotated is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Refresh-токен недействителен или отозван",
+        )
+    user_id, new_refresh_token = rotated
+    user = token_repo.session.get(models.User, user_id)
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Refresh-токен недействителен или отозван",
+        )
+    return issue_tokens(user, token_repo, refresh_token=new_refresh_token)
 
-    return {"access_token": access_token, "token_type": "bearer"}
+
+@router.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+def logout(body: schemas.RefreshTokenRequest, token_repo: TokenRepository = Depends(get_token_repository)):
+    """Выход: отзыв refresh-токена и всей его цепочки"""
+    token_repo.revoke(body.refresh_token)
 
 
 def get_current_user(
@@ -117,8 +169,49 @@ def get_current_user(
         raise credentials_exception
 
     # Ищем пользователя в БД
-    user = db.query(models.User).filter(models.User.id == int(user_id)).first()
+    # По первичному ключу: сначала identity map сессии, затем закешированный запрос загрузки
+    user = db.get(models.User, int(user_id))
     if user is None:
         raise credentials_exception
 
-    return user
\ No newline at end of file
+    return user
+
+
+class Viewer(NamedTuple):
+    """Авторизованный пользователь каталога: только то, что нужно для персонализации"""
+    id: int
+    age: int
+
+
+def get_viewer(
+    token: Optional[str] = Depends(optional_oauth2_scheme),
+    db: Session = Depends(get_db),
+) -> Optional[Viewer]:
+    """
+    Пользователь для персонализации каталога; None – анонимный запрос.
+    id – из токена, возраст – из БД через кеш user_ages (поле age в старых токенах
+    не используется: после правки возраста оно устаревает до конца срока токена).
+    """
+    if token is None:
+        return None
+    try:
+        user_id = int(jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])["sub"])
+    except (JWTError, KeyError, TypeError, ValueError):
+        user_id = None
+    age = None
+    if user_id is not None:
+        age = user_ages.get_or_set(
+            user_id, lambda: db.execute(select(models.User.age).where(models.User.id == user_id)).scalar()
+        )
+    if age is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Не удалось подтвердить учетные данные",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return Viewer(user_id, age)
+
+
+def get_viewer_age(viewer: Optional[Viewer] = Depends(get_viewer)) -> Optional[int]:
+    """Возраст пользователя для фильтрации каталога; None – анонимный запрос"""
+    return viewer.age if viewer is not None else None
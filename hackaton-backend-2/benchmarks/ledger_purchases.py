@@ -0,0 +1,84 @@
+"""
+Бенчмарк журнала баланса: параллельные покупки одного пользователя.
+
+    python -m benchmarks.ledger_purchases --threads 16 --purchases 200
+
+Проверяет, что при конкурентных списаниях баланс не уходит в минус
+и совпадает с суммой журнала, и печатает пропускную способность
+списаний и время чтения баланса до и после сжатия журнала.
+"""
+import argparse
+import threading
+import time
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+
+from repositories import LedgerRepository, UserRepository, to_money
+
+
+def run(threads: int, purchases: int, price: Decimal, budget_share: float):
+    suffix = uuid.uuid4().hex[:8]
+    with UserRepository() as user_repo:
+        user = user_repo.create_user(
+            login=f"bench_{suffix}", email=f"bench_{suffix}@example.com",
+            name="Benchmark", password="-", age=18,
+        )
+        user_id = user.id
+
+    # Денег хватает только на часть покупок – остальные должны быть отклонены
+    total_attempts = threads * purchases
+    affordable = int(total_attempts * budget_share)
+    with LedgerRepository() as ledger:
+        ledger.top_up(user_id, price * affordable)
+
+    accepted = [0] * threads
+    rejected = [0] * threads
+    barrier = threading.Barrier(threads)
+
+    def worker(index: int):
+        barrier.wait()
+        for _ in range(purchases):
+            with LedgerRepository() as ledger:
+                if ledger.debit(user_id, price) is None:
+                    rejected[index] += 1
+                else:
+                    accepted[index] += 1
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    with LedgerRepository() as ledger:
+        read_started = time.perf_counter()
+        balance = ledger.get_balance(user_id)
+        read_tail = time.perf_counter() - read_started
+
+        ledger.compact(lag=timedelta(0))
+        read_started = time.perf_counter()
+        compacted_balance = ledger.get_balance(user_id)
+        read_snapshot = time.perf_counter() - read_started
+
+    expected = to_money(price * affordable - price * sum(accepted))
+    print(f"Потоков: {threads}, попыток: {total_attempts}, по карману: {affordable}")
+    print(f"Принято: {sum(accepted)}, отклонено: {sum(rejected)}")
+    print(f"Списаний в секунду: {total_attempts / elapsed:.0f} (всего {elapsed:.2f} с)")
+    print(f"Баланс: {balance} (ожидается {expected}), после сжатия: {compacted_balance}")
+    print(f"Чтение баланса: по хвосту журнала {read_tail * 1000:.2f} мс, по снимку {read_snapshot * 1000:.2f} мс")
+    ok = balance >= 0 and balance == expected == compacted_balance and sum(accepted) == affordable
+    print("✅ Баланс согласован" if ok else "❌ Баланс рассогласован")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Параллельные покупки одного пользователя")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--purchases", type=int, default=100, help="Покупок на поток")
+    parser.add_argument("--price", type=Decimal, default=Decimal("9.99"))
+    parser.add_argument("--budget-share", type=float, default=0.5, help="Доля покупок, на которую хватает денег")
+    args = parser.parse_args()
+    raise SystemExit(0 if run(args.threads, args.purchases, args.price, args.budget_share) else 1)
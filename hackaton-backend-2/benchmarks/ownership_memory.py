@@ -0,0 +1,52 @@
+"""
+Бенчмарк индекса владения: память и скорость проверки без БД.
+
+    python -m benchmarks.ownership_memory --users 100000 --apps-per-user 40
+
+Заполняет индекс синтетическими библиотеками, печатает память
+в пересчете на миллион пользователей и время проверки владения.
+"""
+import argparse
+import random
+import time
+from array import array
+
+from ownership import OwnershipIndex
+
+
+def run(users: int, apps_per_user: int, catalog_size: int):
+    index = OwnershipIndex(max_users=users, max_age=float("inf"))
+    started = time.perf_counter()
+    for user_id in range(1, users + 1):
+        index._apps[user_id] = array("I", sorted(random.sample(range(1, catalog_size + 1), apps_per_user)))
+        index._loaded_at[user_id] = started
+    print(f"📦 Заполнено за {time.perf_counter() - started:.1f} с")
+
+    usage = index.memory_usage()
+    print(f"📊 Пользователей: {usage['users']}, связей: {usage['owned_apps']}")
+    print(f"📊 Память: {usage['bytes'] / 2**20:.1f} МиБ, "
+          f"на миллион пользователей: {usage['bytes_per_million_users'] / 2**20:.0f} МиБ")
+
+    checks = 200_000
+    user_ids = [random.randint(1, users) for _ in range(checks)]
+    app_ids = [random.randint(1, catalog_size) for _ in range(checks)]
+    started = time.perf_counter()
+    owned = sum(index.owns(user_id, app_id) for user_id, app_id in zip(user_ids, app_ids))
+    elapsed = time.perf_counter() - started
+    print(f"⏱️ Проверка владения: {elapsed / checks * 1e6:.2f} мкс, совпадений: {owned}")
+
+    page = list(range(1, 101))
+    started = time.perf_counter()
+    for user_id in user_ids[:10_000]:
+        index.owned_among(user_id, page)
+    elapsed = time.perf_counter() - started
+    print(f"⏱️ Флаги owned для страницы из {len(page)} приложений: {elapsed / 10_000 * 1e6:.1f} мкс")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Память и скорость индекса владения")
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--apps-per-user", type=int, default=40)
+    parser.add_argument("--catalog-size", type=int, default=50_000)
+    args = parser.parse_args()
+    run(args.users, args.apps_per_user, args.catalog_size)
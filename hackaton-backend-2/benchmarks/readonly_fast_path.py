@@ -0,0 +1,103 @@
+"""
+Бенчмарк чтения списков: ORM-объекты против записей только для чтения.
+
+    python -m benchmarks.readonly_fast_path --rows 100000
+
+Заполняет временную SQLite-базу приложениями и сравнивает путь списка
+каталога: ORM (select(App) -> AppResponse -> JSON) и Core-записи
+(select колонок -> AppRecord -> JSON). Списки скачавших в обоих случаях
+загружаются одним запросом, чтобы сравнивалась только гидратация.
+Печатает время и пик памяти (tracemalloc) на строку.
+"""
+import argparse
+import gc
+import os
+import tempfile
+import time
+import tracemalloc
+
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import sessionmaker
+
+from compression import render_json, render_plain_json
+from database import Base
+from models import App, Category
+from repositories import AppsRepository
+from schemas import AppResponse
+
+
+def populate(session, rows: int):
+    session.execute(insert(Category), [{"id": 1, "name": "bench"}])
+    session.execute(insert(App), [
+        {
+            "name": f"app{i:07d}", "url": f"https://example.com/{i}", "short_descr": "Короткое описание",
+            "full_descr": "Полное описание " * 8, "price": float(i % 500), "downloads": i * 7 % 10000,
+            "rating": 3 + (i % 20) / 10, "age_restriction": (0, 6, 12, 18)[i % 4], "category_id": 1,
+        }
+        for i in range(rows)
+    ])
+    session.commit()
+
+
+def orm_path(session) -> bytes:
+    repo = AppsRepository(session)
+    downloaders = repo.get_downloaders_by_app()
+    apps = session.execute(select(App).where(App.deleted_at.is_(None)).order_by(App.name)).scalars().all()
+    body = b"[" + b",".join(
+        render_json(AppResponse(
+            id=app.id, name=app.name, url=app.url, short_descr=app.short_descr, full_descr=app.full_descr,
+            price=app.price, age_restriction=app.age_restriction, category_id=app.category_id,
+            downloads=app.downloads, rating=app.rating, downloaded_by_users=downloaders.get(app.id, []),
+            version=app.version,
+        ))
+        for app in apps
+    ) + b"]"
+    return body
+
+
+def records_path(session) -> bytes:
+    records = AppsRepository(session).get_all_app_records()
+    return b"[" + b",".join(render_plain_json(record.to_dict()) for record in records) + b"]"
+
+
+def measure(name: str, func, session_factory, rows: int) -> bytes:
+    # Отдельная сессия на прогон: identity map ORM-пути не должен влиять на второй.
+    # Время и память – разными прогонами: tracemalloc сам сильно замедляет код
+    with session_factory() as session:
+        gc.collect()
+        started = time.perf_counter()
+        body = func(session)
+        elapsed = time.perf_counter() - started
+    with session_factory() as session:
+        gc.collect()
+        tracemalloc.start()
+        func(session)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    print(f"  {name:5} {elapsed:6.2f} с  {elapsed / rows * 1e6:6.1f} мкс/строка  "
+          f"пик памяти {peak / 2**20:7.1f} МиБ  {peak / rows:6.0f} Б/строка")
+    return body
+
+
+def run(rows: int, url: str):
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine)
+    with session_factory() as session:
+        populate(session, rows)
+    print(f"📊 Строк: {rows}")
+
+    orm_body = measure("ORM", orm_path, session_factory, rows)
+    records_body = measure("Core", records_path, session_factory, rows)
+    print("✅ Ответы совпадают" if orm_body == records_body else "❌ Ответы различаются")
+    return orm_body == records_body
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ORM-объекты против записей только для чтения")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--url", default=None, help="URL пустой БД (по умолчанию – временная SQLite)")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        ok = run(args.rows, args.url or f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+    raise SystemExit(0 if ok else 1)
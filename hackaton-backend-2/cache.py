@@ -0,0 +1,192 @@
+import copy
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+# Версия содержимого каталога (приложения и категории).
+# Увеличивается после каждой записи, влияющей на ответы каталога,
+# и используется как ключ для всех кешей каталога внутри процесса.
+_catalog_version = 0
+_catalog_lock = threading.Lock()
+_catalog_listeners: List[Callable[[int, bool], None]] = []
+
+
+def get_catalog_version() -> int:
+    """Текущая версия каталога"""
+    return _catalog_version
+
+
+def bump_catalog_version(counters_only: bool = False) -> int:
+    """
+    Инвалидация каталога после записи: увеличиваем версию и оповещаем подписчиков.
+    counters_only – изменились только счетчики скачиваний (покупки): кеши ответов
+    сбрасываются как обычно, а статическим снимкам достаточно редкого обновления.
+    """
+    global _catalog_version
+    with _catalog_lock:
+        _catalog_version += 1
+        version = _catalog_version
+        listeners = list(_catalog_listeners)
+    for listener in listeners:
+        try:
+            listener(version, counters_only)
+        except Exception as e:
+            print(f"❌ Ошибка обработчика инвалидации каталога: {e}")
+    return version
+
+
+def on_catalog_change(listener: Callable[[int, bool], None]) -> Callable[[int, bool], None]:
+    """Регистрация обработчика, вызываемого при каждом изменении каталога: listener(version, counters_only)"""
+    with _catalog_lock:
+        _catalog_listeners.append(listener)
+    return listener
+
+
+class TTLCache:
+    """Небольшой потокобезопасный кеш значений с временем жизни"""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._items: Dict[Hashable, Tuple[float, Any]] = {}
+        self._lock = threading.Lock()
+
+    def get_or_set(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        now = time.monotonic()
+        item = self._items.get(key)
+        if item is not None and item[0] > now:
+            return item[1]
+        value = factory()
+        with self._lock:
+            if len(self._items) >= 1024:
+                # Убираем истекшие записи, чтобы кеш не рос бесконечно
+                for stale in [k for k, (expires, _) in self._items.items() if expires <= now]:
+                    del self._items[stale]
+            self._items[key] = (now + self.ttl, value)
+        return value
+
+    def invalidate(self, key: Optional[Hashable] = None):
+        with self._lock:
+            if key is None:
+                self._items.clear()
+            else:
+                self._items.pop(key, None)
+
+
+# Возраст пользователей для сегментов каталога: правка в этом процессе сбрасывает запись сразу,
+# правка в другом процессе видна не позже чем через USER_AGE_TTL секунд
+USER_AGE_TTL = 5.0
+user_ages = TTLCache(USER_AGE_TTL)
+
+
+class _Flight:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+def _copy_error(error: BaseException) -> BaseException:
+    """Новый экземпляр ошибки того же типа (HTTPException и т.п. обрабатываются как прежде)"""
+    try:
+        return copy.copy(error)
+    except Exception:
+        return RuntimeError(f"Склеенный вызов завершился ошибкой: {error!r}")
+
+
+class SingleFlight:
+    """
+    Склейка одинаковых одновременных запросов: пока вызов по ключу выполняется,
+    остальные вызовы с тем же ключом ждут его и получают тот же результат.
+
+    Ошибка (Exception) первого вызова передается всем ожидавшим – иначе при
+    недоступной БД каждый из них повторил бы тот же запрос. Каждый ожидавший
+    получает свою копию ошибки (from исходной), traceback'и потоков не смешиваются. Если же первый вызов
+    прерван (KeyboardInterrupt, отмена), ожидавшие выполняют вызов заново сами.
+    Результат должен быть безопасен для совместного использования
+    (схемы ответа, а не ORM-объекты, привязанные к сессии первого вызова).
+    """
+
+    # Сколько ключей хранить в счетчике склеек (вытесняются наименее склеиваемые)
+    MAX_TRACKED_KEYS = 1000
+
+    def __init__(self):
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._lock = threading.Lock()
+        self._groups: Dict[str, Dict[str, int]] = {}
+        self._collapsed_by_key: Dict[Hashable, int] = {}
+
+    def do(self, key: Tuple[Hashable, ...], func: Callable[[], Any]) -> Any:
+        """Выполнение func для ключа key (первый элемент ключа – имя группы для метрик)"""
+        retry = False
+        while True:
+            with self._lock:
+                stats = self._group_stats(key[0])
+                if not retry:
+                    stats["calls"] += 1
+                flight = self._flights.get(key)
+                if flight is None:
+                    flight = self._flights[key] = _Flight()
+                    leader = True
+                else:
+                    flight.waiters += 1
+                    leader = False
+
+            if leader:
+                return self._lead(key, flight, func, stats)
+
+            flight.done.wait()
+            if flight.error is None or isinstance(flight.error, Exception):
+                with self._lock:
+                    stats["collapsed"] += 1
+                    self._count_collapsed(key)
+                if flight.error is not None:
+                    raise _copy_error(flight.error) from flight.error
+                return flight.result
+            # Первый вызов прерван – пробуем сами (один из ожидавших станет первым)
+            retry = True
+
+    def _lead(self, key: Hashable, flight: _Flight, func: Callable[[], Any], stats: Dict[str, int]) -> Any:
+        try:
+            flight.result = func()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            if isinstance(e, Exception):
+                stats["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                stats["executions"] += 1
+                del self._flights[key]
+            flight.done.set()
+
+    def _group_stats(self, group: str) -> Dict[str, int]:
+        stats = self._groups.get(group)
+        if stats is None:
+            stats = self._groups[group] = {"calls": 0, "executions": 0, "collapsed": 0, "errors": 0}
+        return stats
+
+    def _count_collapsed(self, key: Hashable):
+        if key not in self._collapsed_by_key and len(self._collapsed_by_key) >= self.MAX_TRACKED_KEYS:
+            rarest = min(self._collapsed_by_key, key=self._collapsed_by_key.get)
+            del self._collapsed_by_key[rarest]
+        self._collapsed_by_key[key] = self._collapsed_by_key.get(key, 0) + 1
+
+    def stats(self, top: int = 20) -> dict:
+        """Метрики: по группам и ключи с наибольшим числом склеенных запросов"""
+        with self._lock:
+            groups = {group: dict(stats) for group, stats in self._groups.items()}
+            hottest = sorted(self._collapsed_by_key.items(), key=lambda item: item[1], reverse=True)[:top]
+            in_flight = len(self._flights)
+        return {
+            "groups": groups,
+            "top_keys": [{"key": ":".join(map(str, key)), "collapsed": count} for key, count in hottest],
+            "in_flight": in_flight,
+        }
+
+
+# Склейка одинаковых чтений горячих эндпоинтов
+read_flights = SingleFlight()
@@ -0,0 +1,233 @@
+import gzip
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # brotli необязателен – без него отдаем только gzip
+    brotli = None
+
+# Ответы меньше порога не сжимаем – выигрыш меньше накладных расходов
+MIN_COMPRESS_SIZE = 1024
+
+# Уровни сжатия: для динамических ответов – быстрые,
+# для предсжатых тел каталога – максимальные (сжимаем один раз на версию)
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+PRECOMPRESSED_GZIP_LEVEL = 9
+PRECOMPRESSED_BROTLI_QUALITY = 11
+
+# Типы, которые уже сжаты или передаются потоком
+EXCLUDED_CONTENT_TYPES = ("text/event-stream", "application/zip", "application/gzip", "application/octet-stream")
+
+
+def supported_encodings() -> Tuple[str, ...]:
+    """Поддерживаемые кодировки в порядке предпочтения"""
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Выбор кодировки по заголовку Accept-Encoding с учетом q-значений"""
+    if not accept_encoding:
+        return None
+
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[token] = q
+
+    best, best_q = None, 0.0
+    for encoding in supported_encodings():
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(body: bytes, encoding: str, precompressed: bool = False) -> bytes:
+    """Сжатие тела ответа выбранной кодировкой"""
+    if encoding == "br":
+        quality = PRECOMPRESSED_BROTLI_QUALITY if precompressed else BROTLI_QUALITY
+        return brotli.compress(body, quality=quality)
+    if encoding == "gzip":
+        level = PRECOMPRESSED_GZIP_LEVEL if precompressed else GZIP_LEVEL
+        return gzip.compress(body, compresslevel=level, mtime=0)
+    return body
+
+
+def render_json(data: Any) -> bytes:
+    """Сериализация в JSON так же, как это делает JSONResponse"""
+    return json.dumps(
+        jsonable_encoder(data),
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def render_plain_json(data: Any) -> bytes:
+    """
+    Сериализация данных, уже состоящих только из JSON-типов (dict/list/str/int/float/bool/None),
+    без прохода jsonable_encoder – для больших списков записей только для чтения
+    """
+    return json.dumps(data, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware: сжимает обычные (не потоковые) ответы gzip/brotli,
+    если клиент это поддерживает и тело больше порога.
+    Ответы с уже выставленным Content-Encoding (предсжатые) пропускаются.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = MIN_COMPRESS_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message: Optional[Message] = None
+        passthrough = False
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal start_message, passthrough
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                content_type = headers.get("content-type", "").partition(";")[0].strip().lower()
+                if (
+                    "content-encoding" in headers
+                    or message["status"] in (204, 206, 304)
+                    or content_type in EXCLUDED_CONTENT_TYPES
+                ):
+                    passthrough = True
+                    await send(message)
+                else:
+                    start_message = message
+                return
+
+            if passthrough or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            if start_message is None:
+                # Тело уже начали отдавать потоком без сжатия
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            initial, start_message = start_message, None
+            headers = MutableHeaders(raw=initial["headers"])
+            if "accept-encoding" not in headers.get("vary", "").lower():
+                headers.add_vary_header("Accept-Encoding")
+
+            # Потоковые ответы (more_body) не буферизуем – отдаем как есть
+            if message.get("more_body", False) or len(body) < self.minimum_size:
+                await send(initial)
+                await send(message)
+                return
+
+            compressed = compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(compressed))
+            await send(initial)
+            await send({"type": "http.response.body", "body": compressed, "more_body": False})
+
+        await self.app(scope, receive, send_wrapper)
+
+
+class _PrecompressedEntry:
+    __slots__ = ("version", "created", "body", "encoded", "lock")
+
+    def __init__(self, version: int, body: bytes):
+        self.version = version
+        self.created = time.monotonic()
+        self.body = body
+        self.encoded: Dict[str, bytes] = {}
+        self.lock = threading.Lock()
+
+    def get(self, encoding: Optional[str]) -> bytes:
+        if encoding is None or len(self.body) < MIN_COMPRESS_SIZE:
+            return self.body
+        data = self.encoded.get(encoding)
+        if data is None:
+            with self.lock:
+                data = self.encoded.get(encoding)
+                if data is None:
+                    data = compress(self.body, encoding, precompressed=True)
+                    self.encoded[encoding] = data
+        return data
+
+
+class PrecompressedStore:
+    """
+    Хранилище предсжатых тел кешируемых ответов.
+    Тело строится и сжимается один раз на версию содержимого,
+    max_age ограничивает устаревание, если запись сделал другой процесс.
+    """
+
+    def __init__(self, max_age: float = 5.0, max_entries: int = 512):
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self._entries: Dict[str, _PrecompressedEntry] = {}
+        self._lock = threading.Lock()
+
+    def get_entry(self, key: str, version: int, build: Callable[[], bytes]) -> _PrecompressedEntry:
+        """Получение записи, построение тела при промахе"""
+        entry = self._entries.get(key)
+        if entry is not None and entry.version == version and time.monotonic() - entry.created < self.max_age:
+            return entry
+
+        entry = _PrecompressedEntry(version, build())
+        with self._lock:
+            if len(self._entries) >= self.max_entries and key not in self._entries:
+                # Вытесняем самую старую запись
+                oldest = min(self._entries, key=lambda k: self._entries[k].created)
+                del self._entries[oldest]
+            self._entries[key] = entry
+        return entry
+
+    def respond(
+        self, request: Request, key: str, version: int, build: Callable[[], bytes], vary: Tuple[str, ...] = ()
+    ) -> Response:
+        """JSON-ответ из хранилища в кодировке, согласованной с клиентом"""
+        entry = self.get_entry(key, version, build)
+        encoding = choose_encoding(request.headers.get("accept-encoding"))
+        body = entry.get(encoding)
+        headers = {"Vary": ", ".join(("Accept-Encoding",) + tuple(vary))}
+        if body is not entry.body:
+            headers["Content-Encoding"] = encoding
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Общее хранилище ответов каталога
+catalog_store = PrecompressedStore()
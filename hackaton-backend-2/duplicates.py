@@ -0,0 +1,364 @@
+"""
+Поиск почти одинаковых отзывов (спам-кампании) на MinHash/LSH.
+
+Текст нормализуется и режется на символьные шинглы длины SHINGLE_SIZE
+(полиномиальный хеш кодов символов); подпись отзыва – минимумы NUM_PERM
+хеш-функций multiply-shift ((a * h + b) mod 2**64) >> 32. Доля совпавших позиций подписей двух
+отзывов оценивает сходство Жаккара их шинглов.
+
+LSH: подпись делится на BANDS полос по ROWS значений, отзывы с одинаковой
+полосой попадают в одну корзину. Кандидаты – отзывы из общих корзин
+(для сходства SIMILARITY_THRESHOLD вероятность не найти пару < 0.1 %);
+каждый кандидат проверяется по полной подписи. Один индекс на весь
+каталог: дубликаты в том же приложении и по всему каталогу считаются
+отдельно.
+
+Подписи лежат в плоском array('I') по слотам. Проверка нового отзыва –
+несколько десятков хеш-операций и поиск в BANDS словарях; массовое
+построение из таблицы reports считает подписи порциями векторно (numpy,
+если установлен; без него – тот же результат циклом).
+
+Отзывы других процессов подтягиваются по id фоновым потоком раз в
+SYNC_INTERVAL (проверка в запросе к БД не обращается), удаленные в этом
+процессе помечаются сразу, а раз в REBUILD_INTERVAL индекс
+перестраивается целиком в том же потоке.
+"""
+import operator
+import re
+import sys
+import threading
+import time
+from array import array
+from random import Random
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence
+
+from sqlalchemy import select
+
+from database import SessionLocal
+from models import Report
+
+try:
+    import numpy as np
+except ImportError:  # numpy необязателен – без него подписи считаются циклом
+    np = None
+
+SHINGLE_SIZE = 5
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+MASK64 = (1 << 64) - 1
+# Отзывы короче этого числа шинглов не проверяются (одинаковые "Отлично!" – не спам)
+MIN_SHINGLES = 8
+SIMILARITY_THRESHOLD = 0.8
+# Отказ, если похожих отзывов уже столько в приложении или во всем каталоге
+REJECT_IN_APP = 3
+REJECT_GLOBAL = 20
+# Проверяется не больше стольких кандидатов (при кампании из тысяч копий решение ясно раньше)
+MAX_CANDIDATES = 200
+SYNC_INTERVAL = 5.0
+REBUILD_INTERVAL = 3600.0
+BUILD_BATCH_SIZE = 500
+
+# Удаленный отзыв (слот остается до перестройки)
+DEAD = 0
+
+# Фиксированное зерно: подписи не зависят от процесса и перезапуска
+_random = Random(0x5EED)
+_PERMUTATIONS = [(_random.getrandbits(64) | 1, _random.getrandbits(64)) for _ in range(NUM_PERM)]
+if np is not None:
+    _A = np.array([a for a, _ in _PERMUTATIONS], dtype=np.uint64)
+    _B = np.array([b for _, b in _PERMUTATIONS], dtype=np.uint64)
+# Основание полиномиального хеша шинглов (простое FNV-1)
+SHINGLE_BASE = 1099511628211
+_POWERS = [pow(SHINGLE_BASE, SHINGLE_SIZE - 1 - j, 1 << 64) for j in range(SHINGLE_SIZE)]
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+def normalize(text: str) -> str:
+    """Нижний регистр, знаки препинания и повторные пробелы убираются"""
+    return _NON_WORD.sub(" ", text.lower()).strip()
+
+
+def _codes(text: str) -> bytes:
+    """Коды символов нормализованного текста (UTF-32: ровно 4 байта на символ)"""
+    return normalize(text).encode("utf-32-le")
+
+
+def shingle_hashes(codes: bytes) -> List[int]:
+    """
+    Полиномиальные хеши символьных шинглов: sum(c[i + j] * BASE ** (SHINGLE_SIZE - 1 - j)) mod 2**64.
+    Повторы шинглов не убираются – минимум от них не меняется
+    """
+    chars = array("I", codes)
+    return [
+        sum(map(operator.mul, chars[i:i + SHINGLE_SIZE], _POWERS)) & MASK64
+        for i in range(len(chars) - SHINGLE_SIZE + 1)
+    ]
+
+
+def signatures(texts: Sequence[str]) -> List[Optional[array]]:
+    """
+    MinHash-подписи порции текстов (None – меньше MIN_SHINGLES шинглов).
+    С numpy и хеши шинглов, и минимумы считаются матричными операциями на всю порцию.
+    """
+    encoded = [_codes(text) for text in texts]
+    result: List[Optional[array]] = [None] * len(texts)
+    selected = [i for i, codes in enumerate(encoded) if len(codes) // 4 - SHINGLE_SIZE + 1 >= MIN_SHINGLES]
+    if not selected:
+        return result
+    if np is None:
+        for i in selected:
+            hashes = shingle_hashes(encoded[i])
+            result[i] = array("I", (min((a * h + b) & MASK64 for h in hashes) >> 32 for a, b in _PERMUTATIONS))
+        return result
+
+    lengths = np.array([len(encoded[i]) // 4 for i in selected], dtype=np.int64)
+    counts = lengths - SHINGLE_SIZE + 1
+    chars = np.frombuffer(b"".join(encoded[i] for i in selected), dtype=np.uint32).astype(np.uint64)
+    # Хеш шингла в каждой позиции склеенных текстов (переполнение uint64 – и есть mod 2**64)
+    positions = len(chars) - SHINGLE_SIZE + 1
+    rolling = np.zeros(positions, dtype=np.uint64)
+    for j, power in enumerate(_POWERS):
+        rolling += chars[j:j + positions] * np.uint64(power)
+    # Только шинглы, не пересекающие границу текстов
+    starts = np.cumsum(lengths) - lengths
+    offsets = np.cumsum(counts) - counts
+    hashes = rolling[np.repeat(starts - offsets, counts) + np.arange(counts.sum())]
+    # Матрица (функция, шингл): минимум по тексту идет вдоль непрерывных строк
+    values = _A[:, None] * hashes + _B[:, None]
+    minima = (np.minimum.reduceat(values, offsets, axis=1) >> np.uint64(32)).astype(np.uint32)
+    for i, column in zip(selected, np.ascontiguousarray(minima.T)):
+        result[i] = array("I", column.tobytes())
+    return result
+
+
+def signature(text: str) -> Optional[array]:
+    """MinHash-подпись одного текста"""
+    return signatures([text])[0]
+
+
+class DuplicateCheck(NamedTuple):
+    signature: Optional[array]  # None – текст слишком короткий, не проверялся
+    # ID похожих отзывов (самые похожие первыми) в том же приложении и в остальных
+    similar_in_app: List[int]
+    similar_elsewhere: List[int]
+    best_match: Optional[int]
+
+    @property
+    def similar_total(self) -> int:
+        return len(self.similar_in_app) + len(self.similar_elsewhere)
+
+    @property
+    def rejected(self) -> bool:
+        return len(self.similar_in_app) >= REJECT_IN_APP or self.similar_total >= REJECT_GLOBAL
+
+
+class ReportDuplicateIndex:
+    """MinHash-подписи отзывов и LSH-корзины по полосам"""
+
+    def __init__(self):
+        self._slots: Dict[int, int] = {}
+        self._report_ids = array("I")
+        self._app_ids = array("I")
+        self._signatures = array("I")
+        self._bands: List[Dict[int, object]] = [{} for _ in range(BANDS)]
+        # Память ключей корзин и массивов-корзин, ключей _slots – считается при вставке
+        self._bucket_bytes = 0
+        self._slot_key_bytes = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.last_report_id = 0
+        self.synced_at = 0.0
+        self.built_at: Optional[float] = None
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    # ---------- построение ----------
+
+    @staticmethod
+    def _band_keys(sig: array) -> List[int]:
+        raw = sig.tobytes()
+        width = ROWS * sig.itemsize
+        return [hash(raw[band * width:(band + 1) * width]) for band in range(BANDS)]
+
+    def _insert(self, report_id: int, app_id: int, sig: array):
+        if report_id in self._slots:
+            return
+        slot = self._slots[report_id] = len(self._report_ids)
+        self._slot_key_bytes += sys.getsizeof(report_id)
+        self._report_ids.append(report_id)
+        self._app_ids.append(app_id)
+        self._signatures.extend(sig)
+        for band, key in zip(self._bands, self._band_keys(sig)):
+            bucket = band.get(key)
+            if bucket is None:
+                band[key] = slot
+                self._bucket_bytes += sys.getsizeof(key)
+            elif isinstance(bucket, int):
+                # Корзина из одного отзыва хранится числом – таких большинство
+                bucket = band[key] = array("I", (bucket, slot))
+                self._bucket_bytes += sys.getsizeof(bucket)
+            else:
+                size = sys.getsizeof(bucket)
+                bucket.append(slot)
+                self._bucket_bytes += sys.getsizeof(bucket) - size
+        self.last_report_id = max(self.last_report_id, report_id)
+
+    def _index_rows(self, rows: Iterable) -> int:
+        """Порция строк (id, app_id, text): подписи векторно, затем вставка под блокировкой"""
+        sigs = signatures([text for _, _, text in rows])
+        indexed = 0
+        with self._lock:
+            for (report_id, app_id, _), sig in zip(rows, sigs):
+                if sig is not None:
+                    self._insert(report_id, app_id, sig)
+                    indexed += 1
+        return indexed
+
+    def _read_reports(self, after_id: int):
+        """Отзывы с id > after_id порциями по BUILD_BATCH_SIZE"""
+        with SessionLocal() as session:
+            while True:
+                rows = session.execute(
+                    select(Report.id, Report.app_id, Report.text)
+                    .where(Report.id > after_id)
+                    .order_by(Report.id)
+                    .limit(BUILD_BATCH_SIZE)
+                ).all()
+                if not rows:
+                    return
+                yield rows
+                after_id = rows[-1][0]
+
+    def load(self):
+        """Полная перестройка из таблицы reports; проверки тем временем идут по старому индексу"""
+        started = time.monotonic()
+        fresh = ReportDuplicateIndex()
+        indexed = sum(fresh._index_rows(rows) for rows in fresh._read_reports(0))
+        with self._lock:
+            self._slots, self._report_ids, self._app_ids = fresh._slots, fresh._report_ids, fresh._app_ids
+            self._signatures, self._bands = fresh._signatures, fresh._bands
+            self._bucket_bytes, self._slot_key_bytes = fresh._bucket_bytes, fresh._slot_key_bytes
+            self.last_report_id = max(self.last_report_id, fresh.last_report_id)
+            self.synced_at = self.built_at = time.monotonic()
+        # Отзывы, добавленные во время перестройки
+        self.sync(force=True)
+        print(f"🧹 Индекс дубликатов отзывов построен: {indexed} отзывов, {time.monotonic() - started:.2f} с")
+
+    def sync(self, force: bool = False):
+        """Подтягивание отзывов, добавленных другими процессами (по id)"""
+        if not force and time.monotonic() - self.synced_at < SYNC_INTERVAL:
+            return
+        self.synced_at = time.monotonic()
+        for rows in self._read_reports(self.last_report_id):
+            self._index_rows(rows)
+            with self._lock:
+                self.last_report_id = max(self.last_report_id, rows[-1][0])
+
+    def add(self, report_id: int, app_id: int, sig: Optional[array]):
+        """Новый отзыв этого процесса (подпись уже посчитана в check)"""
+        if sig is None:
+            return
+        with self._lock:
+            self._insert(report_id, app_id, sig)
+
+    def remove(self, report_ids: Iterable[int]):
+        """Удаленные отзывы больше не считаются дубликатами"""
+        with self._lock:
+            for report_id in report_ids:
+                slot = self._slots.get(report_id)
+                if slot is not None:
+                    self._app_ids[slot] = DEAD
+
+    # ---------- проверка ----------
+
+    def _candidates(self, keys: List[int]):
+        for band, key in zip(self._bands, keys):
+            bucket = band.get(key)
+            if bucket is None:
+                continue
+            if isinstance(bucket, int):
+                yield bucket
+            else:
+                yield from bucket
+
+    def check(self, app_id: int, text: str) -> DuplicateCheck:
+        """Похожие отзывы для нового текста: в том же приложении и по всему каталогу"""
+        sig = signature(text)
+        if sig is None:
+            return DuplicateCheck(None, [], [], None)
+        keys = self._band_keys(sig)
+        matches = []
+        with self._lock:
+            seen = set()
+            in_app = 0
+            # Корзины обходятся лениво: у кампании из тысяч копий решение ясно после первых совпадений
+            for slot in self._candidates(keys):
+                if slot in seen or self._app_ids[slot] == DEAD:
+                    continue
+                if len(seen) >= MAX_CANDIDATES or in_app >= REJECT_IN_APP or len(matches) >= REJECT_GLOBAL:
+                    break
+                seen.add(slot)
+                offset = slot * NUM_PERM
+                equal = sum(map(operator.eq, sig, self._signatures[offset:offset + NUM_PERM]))
+                if equal >= SIMILARITY_THRESHOLD * NUM_PERM:
+                    same_app = self._app_ids[slot] == app_id
+                    in_app += same_app
+                    matches.append((equal, same_app, self._report_ids[slot]))
+        matches.sort(reverse=True)
+        return DuplicateCheck(
+            sig,
+            [report_id for _, same_app, report_id in matches if same_app],
+            [report_id for _, same_app, report_id in matches if not same_app],
+            matches[0][2] if matches else None,
+        )
+
+    # ---------- обслуживание ----------
+
+    def start(self):
+        """Построение, подтягивание новых отзывов и периодическая полная перестройка (удаления из других процессов) в фоне"""
+        self.load()
+        self._stop.clear()
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="report-duplicates", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(SYNC_INTERVAL):
+            try:
+                if self.built_at is None or time.monotonic() - self.built_at >= REBUILD_INTERVAL:
+                    self.load()
+                else:
+                    self.sync(force=True)
+            except Exception as e:
+                print(f"❌ Ошибка обновления индекса дубликатов: {e}")
+
+    def memory_usage(self) -> dict:
+        """Память массивов подписей и LSH-корзин (счетчики ведутся при вставке – без обхода корзин)"""
+        with self._lock:
+            reports = len(self._slots)
+            arrays = sum(
+                sys.getsizeof(a) for a in (self._report_ids, self._app_ids, self._signatures)
+            )
+            buckets = sum(sys.getsizeof(band) for band in self._bands) + self._bucket_bytes
+            slots = sys.getsizeof(self._slots) + self._slot_key_bytes
+        total = arrays + buckets + slots
+        return {
+            "reports": reports,
+            "signature_bytes": arrays,
+            "bucket_bytes": buckets,
+            "bytes": total,
+            "bytes_per_report": round(total / reports) if reports else 0,
+        }
+
+
+# Индекс дубликатов отзывов процесса
+report_duplicates = ReportDuplicateIndex()
@@ -0,0 +1,168 @@
+import asyncio
+import itertools
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# Типы событий ленты изменений
+APP_CREATED = "app_created"
+APP_UPDATED = "app_updated"
+APP_DELETED = "app_deleted"
+APP_DOWNLOADED = "app_downloaded"
+REPORT_CREATED = "report_created"
+
+EVENT_TYPES = (APP_CREATED, APP_UPDATED, APP_DELETED, APP_DOWNLOADED, REPORT_CREATED)
+
+# Окно склейки: события одного типа по одному приложению, пришедшие
+# в течение окна, доставляются подписчику одним событием с полем count
+COALESCE_INTERVAL = 1.0
+
+
+class ChangeEvent:
+    __slots__ = ("id", "type", "app_id", "category_id", "data", "count", "timestamp")
+
+    def __init__(self, id: int, type: str, app_id: Optional[int], category_id: Optional[int], data: dict):
+        self.id = id
+        self.type = type
+        self.app_id = app_id
+        self.category_id = category_id
+        self.data = data
+        self.count = 1
+        self.timestamp = time.time()
+
+    def to_sse(self) -> str:
+        payload = {
+            "type": self.type,
+            "app_id": self.app_id,
+            "category_id": self.category_id,
+            "count": self.count,
+            "timestamp": self.timestamp,
+            **self.data,
+        }
+        return f"id: {self.id}\nevent: {self.type}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+class Subscription:
+    """
+    Подписка на ленту. Хранит не очередь, а последние события по ключу
+    (тип, приложение), поэтому память ограничена числом приложений,
+    а всплеск скачиваний популярного приложения не заваливает клиента.
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        app_ids: Optional[Set[int]] = None,
+        category_ids: Optional[Set[int]] = None,
+        event_types: Optional[Set[str]] = None,
+    ):
+        self.loop = loop
+        self.app_ids = app_ids or None
+        self.category_ids = category_ids or None
+        self.event_types = event_types or None
+        self._pending: "OrderedDict[Tuple[str, Optional[int]], ChangeEvent]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._wakeup = asyncio.Event()
+        self.delivered = 0
+        self.coalesced = 0
+
+    def matches(self, event: ChangeEvent) -> bool:
+        if self.event_types is not None and event.type not in self.event_types:
+            return False
+        if self.app_ids is not None and event.app_id not in self.app_ids:
+            return False
+        if self.category_ids is not None and event.category_id not in self.category_ids:
+            return False
+        return True
+
+    def offer(self, event: ChangeEvent):
+        """Вызывается из любого потока"""
+        key = (event.type, event.app_id)
+        with self._lock:
+            previous = self._pending.get(key)
+            if previous is not None:
+                # Склеиваем: остается последнее состояние, count суммируется
+                merged = ChangeEvent(event.id, event.type, event.app_id, event.category_id, event.data)
+                merged.count = previous.count + 1
+                self._pending[key] = merged
+                self.coalesced += 1
+            else:
+                self._pending[key] = event
+        self.loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def next_batch(self, timeout: float) -> List[ChangeEvent]:
+        """Ожидание событий; пустой список – таймаут (время отправить keep-alive)"""
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        # Даем всплеску накопиться, чтобы отдать его одним событием
+        await asyncio.sleep(COALESCE_INTERVAL)
+        with self._lock:
+            self._wakeup.clear()
+            batch = list(self._pending.values())
+            self._pending.clear()
+        self.delivered += len(batch)
+        return batch
+
+
+class EventBroadcaster:
+    """Внутрипроцессная рассылка событий изменений каталога подписчикам"""
+
+    def __init__(self):
+        self._subscribers: List[Subscription] = []
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.published = 0
+
+    def subscribe(
+        self,
+        app_ids: Optional[Iterable[int]] = None,
+        category_ids: Optional[Iterable[int]] = None,
+        event_types: Optional[Iterable[str]] = None,
+    ) -> Subscription:
+        subscription = Subscription(
+            asyncio.get_running_loop(),
+            set(app_ids) if app_ids else None,
+            set(category_ids) if category_ids else None,
+            set(event_types) if event_types else None,
+        )
+        with self._lock:
+            self._subscribers.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            if subscription in self._subscribers:
+                self._subscribers.remove(subscription)
+
+    def publish(self, event_type: str, app_id: Optional[int] = None, category_id: Optional[int] = None, **data):
+        """Публикация события из пути записи (безопасно вызывать из любого потока)"""
+        with self._lock:
+            self.published += 1
+            if not self._subscribers:
+                return
+            subscribers = list(self._subscribers)
+            event = ChangeEvent(next(self._ids), event_type, app_id, category_id, data)
+        for subscription in subscribers:
+            if subscription.matches(event):
+                try:
+                    subscription.offer(event)
+                except RuntimeError:
+                    # Цикл событий подписчика уже закрыт
+                    self.unsubscribe(subscription)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            subscribers = list(self._subscribers)
+        return {
+            "subscribers": len(subscribers),
+            "published": self.published,
+            "delivered": sum(s.delivered for s in subscribers),
+            "coalesced": sum(s.coalesced for s in subscribers),
+        }
+
+
+broadcaster = EventBroadcaster()
@@ -0,0 +1,367 @@
+"""
+Фоновые задачи: тяжелые пересчеты и выгрузки выполняются вне обработчиков запросов.
+
+Задачи хранятся в таблице jobs, поэтому переживают перезапуск и видны
+всем процессам. Пул потоков забирает задачи по приоритету; захват
+выполняется условным UPDATE, так что при нескольких процессах задача
+выполняется ровно одним из них. Неудачные попытки повторяются
+с экспоненциальной задержкой.
+"""
+import threading
+import time
+import traceback
+from datetime import timedelta
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import func, select, update
+
+from cache import bump_catalog_version
+from database import SessionLocal, collect_table_stats, engine, get_current_time
+from models import App, Job, Report
+from migrations import ensure_download_partitions
+from repositories import AppsRepository, DownloadStatsRepository, LedgerRepository, PURGE_BATCH_SIZE
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+JOB_WORKERS = 2
+POLL_INTERVAL = 2.0
+RETRY_BASE_DELAY = 5.0
+RETRY_MAX_DELAY = 600.0
+# Задача в статусе running дольше этого времени считается потерянной (процесс упал)
+STALE_JOB_TIMEOUT = timedelta(minutes=30)
+# Обновлять прогресс в БД не чаще раза в секунду
+PROGRESS_MIN_INTERVAL = 1.0
+
+JobHandler = Callable[["JobContext", dict], Optional[dict]]
+_handlers: Dict[str, JobHandler] = {}
+# Периодические задачи: вид -> интервал в секундах
+_periodic: Dict[str, float] = {}
+
+
+def job_handler(kind: str):
+    """Регистрация обработчика задач заданного вида"""
+    def decorator(func: JobHandler) -> JobHandler:
+        _handlers[kind] = func
+        return func
+    return decorator
+
+
+def periodic_job(kind: str, interval: float):
+    """Регистрация обработчика, который ставится в очередь раз в interval секунд"""
+    def decorator(func: JobHandler) -> JobHandler:
+        _handlers[kind] = func
+        _periodic[kind] = interval
+        return func
+    return decorator
+
+
+def registered_kinds() -> List[str]:
+    return sorted(_handlers)
+
+
+class JobContext:
+    """Передается обработчику: отчет о прогрессе и проверка остановки"""
+
+    def __init__(self, job_id: int, stop_event: threading.Event):
+        self.job_id = job_id
+        self._stop_event = stop_event
+        self._last_report = 0.0
+
+    @property
+    def stopping(self) -> bool:
+        return self._stop_event.is_set()
+
+    def progress(self, fraction: float, message: Optional[str] = None, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._last_report < PROGRESS_MIN_INTERVAL:
+            return
+        self._last_report = now
+        with SessionLocal() as session:
+            session.execute(
+                update(Job)
+                .where(Job.id == self.job_id)
+                .values(progress=max(0.0, min(1.0, fraction)), message=message[:200] if message else None)
+            )
+            session.commit()
+
+
+def enqueue(kind: str, params: Optional[dict] = None, priority: int = 0, max_attempts: int = 3, session=None) -> Job:
+    """Постановка задачи в очередь"""
+    if kind not in _handlers:
+        raise ValueError(f"Неизвестный вид задачи: {kind}")
+    own_session = session is None
+    session = session or SessionLocal()
+    try:
+        job = Job(kind=kind, params=params or {}, priority=priority, max_attempts=max_attempts, run_after=get_current_time())
+        session.add(job)
+        session.commit()
+        session.refresh(job)
+    finally:
+        if own_session:
+            session.close()
+    runner.wake_up()
+    return job
+
+
+def enqueue_once(kind: str, params: Optional[dict] = None, priority: int = 0, max_attempts: int = 3, session=None) -> Job:
+    """Постановка задачи, если задача этого вида еще не ждет в очереди и не выполняется; иначе – уже поставленная"""
+    own_session = session is None
+    session = session or SessionLocal()
+    try:
+        pending = session.execute(
+            select(Job).where(Job.kind == kind, Job.status.in_((QUEUED, RUNNING))).order_by(Job.id).limit(1)
+        ).scalar_one_or_none()
+        if pending is not None:
+            return pending
+        return enqueue(kind, params, priority=priority, max_attempts=max_attempts, session=session)
+    finally:
+        if own_session:
+            session.close()
+
+
+def retry_delay(attempts: int) -> float:
+    """Экспоненциальная задержка перед повтором"""
+    return min(RETRY_BASE_DELAY * (2 ** max(attempts - 1, 0)), RETRY_MAX_DELAY)
+
+
+class JobRunner:
+    """Пул потоков, выполняющих задачи из таблицы jobs"""
+
+    def __init__(self, workers: int = JOB_WORKERS):
+        self.workers = workers
+        self._threads: List[threading.Thread] = []
+        self._stop_event = threading.Event()
+        self._wakeup = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return any(thread.is_alive() for thread in self._threads)
+
+    def start(self):
+        if self.running:
+            return
+        self._stop_event.clear()
+        self.recover_stale()
+        self._threads = [
+            threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        if _periodic:
+            self._threads.append(threading.Thread(target=self._schedule, name="job-scheduler", daemon=True))
+        for thread in self._threads:
+            thread.start()
+        print(f"⚙️ Запущено обработчиков фоновых задач: {self.workers}")
+
+    def stop(self, timeout: float = 10.0):
+        """Остановка: новые задачи не берутся, текущие получают время завершиться"""
+        self._stop_event.set()
+        self._wakeup.set()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        self._threads = []
+
+    def wake_up(self):
+        self._wakeup.set()
+
+    def recover_stale(self):
+        """Возврат в очередь задач, зависших в running после падения процесса"""
+        with SessionLocal() as session:
+            result = session.execute(
+                update(Job)
+                .where(Job.status == RUNNING, Job.started_at < get_current_time() - STALE_JOB_TIMEOUT)
+                .values(status=QUEUED, run_after=get_current_time())
+            )
+            session.commit()
+            if result.rowcount:
+                print(f"♻️ Возвращено в очередь зависших задач: {result.rowcount}")
+
+    def _schedule(self):
+        """Постановка периодических задач, если такая задача еще не в очереди"""
+        next_run = {kind: time.monotonic() + interval for kind, interval in _periodic.items()}
+        while not self._stop_event.wait(1.0):
+            now = time.monotonic()
+            for kind, interval in _periodic.items():
+                if now < next_run[kind]:
+                    continue
+                next_run[kind] = now + interval
+                try:
+                    enqueue_once(kind, priority=-10, max_attempts=1)
+                except Exception as e:
+                    print(f"❌ Ошибка постановки периодической задачи {kind}: {e}")
+
+    def _claim(self) -> Optional[int]:
+        """Захват следующей задачи: выбор по приоритету и условный UPDATE"""
+        with SessionLocal() as session:
+            candidates = session.execute(
+                select(Job.id)
+                .where(Job.status == QUEUED, Job.run_after <= get_current_time())
+                .order_by(Job.priority.desc(), Job.id)
+                .limit(self.workers)
+            ).scalars().all()
+            for job_id in candidates:
+                result = session.execute(
+                    update(Job)
+                    .where(Job.id == job_id, Job.status == QUEUED)
+                    .values(status=RUNNING, started_at=get_current_time(), attempts=Job.attempts + 1)
+                )
+                session.commit()
+                if result.rowcount == 1:
+                    return job_id
+        return None
+
+    def _work(self):
+        while not self._stop_event.is_set():
+            try:
+                job_id = self._claim()
+            except Exception as e:
+                print(f"❌ Ошибка выбора фоновой задачи: {e}")
+                job_id = None
+            if job_id is None:
+                self._wakeup.wait(POLL_INTERVAL)
+                self._wakeup.clear()
+                continue
+            self._execute(job_id)
+
+    def _execute(self, job_id: int):
+        with SessionLocal() as session:
+            job = session.get(Job, job_id)
+            kind, params, attempts, max_attempts = job.kind, dict(job.params or {}), job.attempts, job.max_attempts
+
+        handler = _handlers.get(kind)
+        context = JobContext(job_id, self._stop_event)
+        started = time.monotonic()
+        try:
+            if handler is None:
+                raise LookupError(f"Нет обработчика для задачи {kind}")
+            result = handler(context, params)
+        except InterruptedError as e:
+            # Остановка процесса – не ошибка задачи: она возвращается в очередь, попытка не засчитывается
+            self._finish(job_id, {
+                "status": QUEUED,
+                "run_after": get_current_time(),
+                "attempts": Job.attempts - 1,
+                "error": None,
+            })
+            print(f"⏸️ Задача {job_id} ({kind}) прервана остановкой и возвращена в очередь: {e}")
+            return
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            values = {"error": error[:1000], "finished_at": get_current_time()}
+            if attempts < max_attempts and handler is not None:
+                delay = retry_delay(attempts)
+                values.update(status=QUEUED, run_after=get_current_time() + timedelta(seconds=delay))
+                print(f"⚠️ Задача {job_id} ({kind}) упала, повтор через {delay:.0f} с: {error}")
+            else:
+                values.update(status=FAILED)
+                print(f"❌ Задача {job_id} ({kind}) завершилась ошибкой: {error}")
+                traceback.print_exc()
+            self._finish(job_id, values)
+            return
+
+        self._finish(job_id, {
+            "status": SUCCEEDED,
+            "result": result,
+            "progress": 1.0,
+            "error": None,
+            "finished_at": get_current_time(),
+        })
+        print(f"✅ Задача {job_id} ({kind}) выполнена за {time.monotonic() - started:.1f} с")
+
+    @staticmethod
+    def _finish(job_id: int, values: dict):
+        with SessionLocal() as session:
+            session.execute(update(Job).where(Job.id == job_id).values(**values))
+            session.commit()
+
+
+runner = JobRunner()
+
+
+# ========== ВСТРОЕННЫЕ ЗАДАЧИ ==========
+
+@job_handler("table_stats")
+def table_stats_job(context: JobContext, params: dict) -> dict:
+    """Точное количество записей по таблицам"""
+    return {"tables": collect_table_stats()}
+
+
+@job_handler("recompute_ratings")
+def recompute_ratings_job(context: JobContext, params: dict) -> dict:
+    """Пересчет рейтингов приложений по отзывам, порциями по batch_size приложений"""
+    batch_size = int(params.get("batch_size", 500))
+    updated = processed = 0
+    last_id = 0
+    with SessionLocal() as session:
+        total = session.execute(select(func.count(App.id))).scalar() or 0
+
+    while True:
+        if context.stopping:
+            # Задача вернется в очередь и продолжится после перезапуска
+            raise InterruptedError("Процесс останавливается")
+        # Каждая порция – короткая транзакция, соединение не удерживается минутами
+        with SessionLocal() as session:
+            app_ids = session.execute(
+                select(App.id).where(App.id > last_id).order_by(App.id).limit(batch_size)
+            ).scalars().all()
+            if not app_ids:
+                break
+            averages = session.execute(
+                select(Report.app_id, func.avg(Report.rating))
+                .where(Report.app_id.in_(app_ids), Report.rating.is_not(None))
+                .group_by(Report.app_id)
+            ).all()
+            for app_id, average in averages:
+                session.execute(update(App).where(App.id == app_id).values(rating=round(float(average), 2)))
+            session.commit()
+        updated += len(averages)
+        processed += len(app_ids)
+        last_id = app_ids[-1]
+        context.progress(processed / total if total else 1.0, f"Обработано приложений: {processed}")
+
+    if updated:
+        bump_catalog_version()
+    return {"updated": updated, "apps_total": total}
+
+
+@periodic_job("compact_balances", interval=300)
+def compact_balances_job(context: JobContext, params: dict) -> dict:
+    """Сжатие журнала баланса в снимки, чтобы чтение баланса оставалось O(1)"""
+    with LedgerRepository() as ledger:
+        return {"snapshots_updated": ledger.compact()}
+
+
+@periodic_job("rollup_downloads", interval=60)
+def rollup_downloads_job(context: JobContext, params: dict) -> dict:
+    """Свертка журнала скачиваний в почасовые и посуточные агрегаты статистики"""
+    with DownloadStatsRepository() as stats_repo:
+        return {"events_rolled_up": stats_repo.rollup()}
+
+
+@periodic_job("download_partitions", interval=86400)
+def download_partitions_job(context: JobContext, params: dict) -> dict:
+    """Месячные секции журнала скачиваний на следующие месяцы"""
+    with engine.begin() as conn:
+        return {"partitions_created": ensure_download_partitions(conn)}
+
+
+@periodic_job("purge_deleted_apps", interval=600)
+def purge_deleted_apps_job(context: JobContext, params: dict) -> dict:
+    """Порционное удаление строк мягко удаленных приложений (связи, отзывы, сами приложения)"""
+    batch_size = int(params.get("batch_size", PURGE_BATCH_SIZE))
+    deleted = 0
+    with AppsRepository() as app_repo:
+        total = app_repo.count_pending_purge()
+        while True:
+            if context.stopping:
+                # Оставшееся дочистит следующий запуск
+                raise InterruptedError("Процесс останавливается")
+            count = app_repo.purge_deleted(batch_size)
+            if not count:
+                break
+            deleted += count
+            context.progress(deleted / total if total else 1.0, f"Удалено строк: {deleted}")
+    return {"rows_deleted": deleted}
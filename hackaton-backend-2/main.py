@@ -1,39 +1,96 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from fastapi.openapi.docs import get_swagger_ui_html, get_redoc_html
 from contextlib import asynccontextmanager
-from typing import List
-from datetime import datetime
+from typing import List, Literal, Optional, Set, Union
+from datetime import datetime, timedelta
+import re
+from bisect import bisect_right
 import uvicorn
 from auth import router as auth_router
-from database import create_tables, SessionLocal, engine, check_database_connection
-from repositories import UserRepository, AppsRepository, ReportRepository, CategoryRepository
+from database import MOSCOW_TZ, SessionLocal, engine, get_current_time, warm_up_pool, collect_estimated_stats, statement_cache_stats
+from repositories import (
+    UserRepository, AppsRepository, ReportRepository, CategoryRepository, LedgerRepository, AppRecord, VersionConflict, to_money,
+    DownloadStatsRepository, MAX_STATS_POINTS, STATS_STEPS, truncate_bucket, DuplicateReport, CheckoutError,
+)
 from schemas import (
     UserCreate, UserResponse, UserUpdate, 
-    AppCreate, AppResponse, AppUpdate,
-    ReportCreate, ReportResponse,
-    CategoryCreate, CategoryResponse, CategoryUpdate,
-    UserWithDetailsResponse, AppWithDetailsResponse
+    AppCreate, AppResponse, AppUpdate, AppCatalogResponse, AppFacets, AppSuggestion, CatalogAppResponse, TrendingApp,
+    AppPackageResponse,
+    ReportCreate, ReportResponse, ReportSummaryResponse, AppDownloadStatsResponse,
+    CategoryCreate, CategoryResponse, CategoryUpdate, CategoryStatsResponse,
+    UserWithDetailsResponse, AppWithDetailsResponse,
+    JobCreate, JobResponse,
+    BalanceTopUp, BalanceResponse, BalanceEntryResponse, CheckoutRequest, CheckoutResponse,
+    AdminStatsResponse
 )
-from sqlalchemy import text
+from sqlalchemy import select, text
+from sqlalchemy.orm.exc import StaleDataError
 from security import hash_password
-from auth import get_current_user
+from auth import Viewer, get_current_user, get_viewer, get_viewer_age
+from cache import get_catalog_version, TTLCache, read_flights
+from compression import CompressionMiddleware, catalog_store, render_json, render_plain_json
+from migrations import check_schema_version
+from readiness import readiness
+from events import broadcaster, EVENT_TYPES
+from suggest import suggest_index
+from trending import trending_index
+from duplicates import report_duplicates
+from ownership import ownership_index
+from snapshots import catalog_snapshots
+from packages import MAX_PACKAGE_SIZE, ChecksumMismatch, PackageTooLarge, package_store
+import jobs
 import models
 
+STARTUP_STEPS = ("schema", "pool", "cache")
+
+def stop_background_tasks():
+    """Остановка фоновых потоков процесса"""
+    catalog_snapshots.stop()
+    suggest_index.stop()
+    trending_index.stop()
+    report_duplicates.stop()
+    jobs.runner.stop()
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup code
-    create_tables()
-    if check_database_connection():
-        print("🚀 Сервер запущен и готов принимать запросы!")
-        print("📊 База данных инициализирована")
-        print("🌐 API доступно по адресу: http://localhost:8000/api")
-        print("📚 Документация: http://localhost:8000/api/docs")
-        print("📖 ReDoc: http://localhost:8000/api/redoc")
-    else:
-        print("❌ Сервер запущен, но есть проблемы с БД")
+    # Startup code: только сверка версии схемы, миграции запускаются через `python migrations.py upgrade`
+    readiness.reset(*STARTUP_STEPS)
+    try:
+        current, expected = check_schema_version()
+        if current != expected:
+            readiness.fail("schema", f"версия схемы {current}, ожидается {expected}")
+            print(f"❌ Версия схемы БД {current}, ожидается {expected}. Запустите: python migrations.py upgrade")
+        else:
+            readiness.complete("schema")
+            warm_up_pool()
+            readiness.complete("pool")
+            preload_catalog_cache()
+            suggest_index.start()
+            trending_index.start()
+            report_duplicates.start()
+            readiness.complete("cache")
+            catalog_snapshots.start(render_catalog_snapshot)
+            jobs.runner.start()
+    except Exception as e:
+        readiness.fail("startup", str(e))
+        print(f"❌ Ошибка при старте: {e}")
+
+    if not readiness.is_ready:
+        # Неготовый процесс не остается жить: ошибка lifespan завершает воркер с кодом 3,
+        # мастер server.py перезапускает его, а после серии неудачных стартов останавливается
+        stop_background_tasks()
+        raise RuntimeError(f"Сервер не готов принимать трафик: {readiness.as_dict()['error']}")
+    print("🚀 Сервер запущен и готов принимать запросы!")
+    print("🌐 API доступно по адресу: http://localhost:8000/api")
+    print("📚 Документация: http://localhost:8000/api/docs")
+    print("📖 ReDoc: http://localhost:8000/api/redoc")
     yield
     # Shutdown code
+    readiness.drain()
+    stop_background_tasks()
     print("🛑 Сервер останавливается")
 
 # Создаем FastAPI приложение с префиксом /api
@@ -57,6 +114,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Сжатие ответов gzip/brotli (с порогом по размеру)
+app.add_middleware(CompressionMiddleware)
+
 # Dependency для получения сессии БД
 from auth import get_db
 
@@ -72,6 +132,51 @@ def get_report_repository(db = Depends(get_db)):
 def get_category_repository(db = Depends(get_db)):
     return CategoryRepository(db)
 
+def get_ledger_repository(db = Depends(get_db)):
+    return LedgerRepository(db)
+
+def get_download_stats_repository(db = Depends(get_db)):
+    return DownloadStatsRepository(db)
+
+# ========== ОПТИМИСТИЧНАЯ БЛОКИРОВКА ==========
+
+VERSION_CONFLICT_DETAIL = "Запись изменена другим запросом – перечитайте ее и повторите правку"
+
+def version_etag(version: int) -> str:
+    return f'"{version}"'
+
+def get_expected_version(if_match: Optional[str], body_version: Optional[int]) -> Optional[int]:
+    """
+    Ожидаемая версия строки для PUT: из If-Match ("3", W/"3" или 3) или из поля version тела.
+    None – правка без проверки (If-Match: * или версия не передана).
+    """
+    header_version = None
+    if if_match is not None and if_match.strip() != "*":
+        tag = if_match.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        tag = tag.strip('"')
+        if not tag.isdigit():
+            raise HTTPException(status_code=400, detail="If-Match должен содержать версию записи")
+        header_version = int(tag)
+    if header_version is not None and body_version is not None and header_version != body_version:
+        raise HTTPException(status_code=400, detail="Версии в If-Match и в теле запроса различаются")
+    return header_version if header_version is not None else body_version
+
+@app.exception_handler(VersionConflict)
+async def version_conflict_handler(request: Request, exc: VersionConflict):
+    """409 с текущей версией: клиент перечитывает запись и повторяет правку"""
+    return JSONResponse(
+        status_code=409,
+        content={"detail": str(exc), "current_version": exc.current_version},
+        headers={"ETag": version_etag(exc.current_version)},
+    )
+
+@app.exception_handler(StaleDataError)
+async def stale_data_handler(request: Request, exc: StaleDataError):
+    """Правка через ORM-объект, который успели изменить (version_id_col)"""
+    return JSONResponse(status_code=409, content={"detail": VERSION_CONFLICT_DETAIL})
+
 # Кастомные эндпоинты для документации с префиксом /api
 @app.get("/api/docs", include_in_schema=False)
 async def custom_swagger_ui_html():
@@ -90,18 +195,22 @@ async def redoc_html():
     )
 
 @app.get("/api/users/me", response_model=UserResponse)
-def get_me(current_user: models.User = Depends(get_current_user)):
+def get_me(
+    current_user: models.User = Depends(get_current_user),
+    user_repo: UserRepository = Depends(get_user_repository)
+):
     return UserResponse(
         id=current_user.id,
         login=current_user.login,
         email=current_user.email,
         name=current_user.name,
         age=current_user.age,
-        balance=current_user.balance,
+        balance=user_repo.get_balance(current_user.id),
         count_inputs=current_user.count_inputs,
         created_at=current_user.created_at,
         updated_at=current_user.updated_at,
         downloaded_apps=[app.id for app in current_user.downloaded_apps],
+        version=current_user.version,
     )
 
 # Root endpoint с редиректом на документацию API
@@ -152,6 +261,19 @@ def health_check():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
+@app.get("/api/health/live")
+def liveness_check():
+    """Процесс жив (без обращения к БД)"""
+    return {"status": "alive", "timestamp": datetime.now().isoformat()}
+
+@app.get("/api/health/ready")
+def readiness_check():
+    """Готовность принимать трафик: схема проверена, пул прогрет, кеши загружены"""
+    state = readiness.as_dict()
+    if not state["ready"]:
+        return JSONResponse(status_code=503, content=state)
+    return state
+
 # ========== USER ENDPOINTS ==========
 
 @app.post("/api/users", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
@@ -175,11 +297,12 @@ def create_user(
             email=new_user.email,
             name=new_user.name,
             age=new_user.age,
-            balance=new_user.balance,
+            balance=user_repo.get_balance(new_user.id),
             count_inputs=new_user.count_inputs,
             created_at=new_user.created_at,
             updated_at=new_user.updated_at,
-            downloaded_apps=[app.id for app in new_user.downloaded_apps]
+            downloaded_apps=[app.id for app in new_user.downloaded_apps],
+            version=new_user.version
         )
     except Exception as e:
         print(f"❌ Ошибка создания пользователя: {str(e)}")
@@ -190,23 +313,10 @@ def create_user(
 
 @app.get("/api/users", response_model=List[UserResponse])
 def get_all_users(user_repo: UserRepository = Depends(get_user_repository)):
-    """Получение всех пользователей"""
-    users = user_repo.get_all_users()
+    """Получение всех пользователей (записи только для чтения, без ORM-объектов и повторной валидации)"""
+    users = user_repo.get_all_user_records()
     print(f"📊 Запрос всех пользователей. Найдено: {len(users)}")
-    return [
-        UserResponse(
-            id=user.id,
-            login=user.login,
-            email=user.email,
-            name=user.name,
-            age=user.age,
-            balance=user.balance,
-            count_inputs=user.count_inputs,
-            created_at=user.created_at,
-            updated_at=user.updated_at,
-            downloaded_apps=[app.id for app in user.downloaded_apps]
-        ) for user in users
-    ]
+    return Response(content=render_plain_json([user.to_dict() for user in users]), media_type="application/json")
 
 @app.get("/api/users/{user_id}", response_model=UserResponse)
 def get_user(
@@ -224,11 +334,12 @@ def get_user(
         email=user.email,
         name=user.name,
         age=user.age,
-        balance=user.balance,
+        balance=user_repo.get_balance(user.id),
         count_inputs=user.count_inputs,
         created_at=user.created_at,
         updated_at=user.updated_at,
-        downloaded_apps=[app.id for app in user.downloaded_apps]
+        downloaded_apps=[app.id for app in user.downloaded_apps],
+        version=user.version
     )
 
 @app.get("/api/users/{user_id}/details", response_model=UserWithDetailsResponse)
@@ -256,7 +367,8 @@ def get_user_with_details(
                 category_id=app.category_id,
                 downloads=app.downloads,
                 rating=app.rating,
-                downloaded_by_users=[user.id for user in app.downloaded_by_users]
+                downloaded_by_users=[user.id for user in app.downloaded_by_users],
+                version=app.version
             )
         )
     
@@ -266,11 +378,12 @@ def get_user_with_details(
         email=user.email,
         name=user.name,
         age=user.age,
-        balance=user.balance,
+        balance=user_repo.get_balance(user.id),
         count_inputs=user.count_inputs,
         created_at=user.created_at,
         updated_at=user.updated_at,
         downloaded_apps=[app.id for app in user.downloaded_apps],
+        version=user.version,
         downloaded_apps_details=downloaded_apps_details
     )
 
@@ -278,25 +391,19 @@ def get_user_with_details(
 def update_user(
     user_id: int,
     user_update: UserUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None, description="Версия записи; при несовпадении – 409"),
     user_repo: UserRepository = Depends(get_user_repository)
 ):
-    """Обновление данных пользователя"""
-    user = user_repo.update_user(user_id, **user_update.dict(exclude_unset=True))
+    """Обновление данных пользователя (с If-Match или version в теле – только если запись не изменилась)"""
+    fields = user_update.dict(exclude_unset=True)
+    expected_version = get_expected_version(if_match, fields.pop("version", None))
+    user = user_repo.update_user(user_id, expected_version=expected_version, **fields)
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
     print(f"✏️ Обновлен пользователь ID: {user_id} - {user.name}")
-    return UserResponse(
-        id=user.id,
-        login=user.login,
-        email=user.email,
-        name=user.name,
-        age=user.age,
-        balance=user.balance,
-        count_inputs=user.count_inputs,
-        created_at=user.created_at,
-        updated_at=user.updated_at,
-        downloaded_apps=[app.id for app in user.downloaded_apps]
-    )
+    response.headers["ETag"] = version_etag(user.version)
+    return UserResponse(**user.to_dict())
 
 @app.delete("/api/users/{user_id}")
 def delete_user(
@@ -310,6 +417,44 @@ def delete_user(
     print(f"🗑️ Удален пользователь ID: {user_id}")
     return {"message": "Пользователь успешно удален"}
 
+# ========== BALANCE ENDPOINTS ==========
+
+@app.get("/api/users/{user_id}/balance", response_model=BalanceResponse)
+def get_user_balance(
+    user_id: int,
+    user_repo: UserRepository = Depends(get_user_repository),
+    ledger_repo: LedgerRepository = Depends(get_ledger_repository)
+):
+    """Текущий баланс пользователя"""
+    if not user_repo.get_user_by_id(user_id):
+        raise HTTPException(status_code=404, detail="Пользователь не найден")
+    return BalanceResponse(user_id=user_id, balance=ledger_repo.get_balance(user_id))
+
+@app.post("/api/users/{user_id}/balance/topup", response_model=BalanceResponse)
+def top_up_balance(
+    user_id: int,
+    top_up: BalanceTopUp,
+    user_repo: UserRepository = Depends(get_user_repository),
+    ledger_repo: LedgerRepository = Depends(get_ledger_repository)
+):
+    """Пополнение баланса пользователя"""
+    if not user_repo.get_user_by_id(user_id):
+        raise HTTPException(status_code=404, detail="Пользователь не найден")
+    ledger_repo.top_up(user_id, top_up.amount)
+    balance = ledger_repo.get_balance(user_id)
+    print(f"💰 Пополнение баланса пользователя ID: {user_id} на {top_up.amount}. Баланс: {balance}")
+    return BalanceResponse(user_id=user_id, balance=balance)
+
+@app.get("/api/users/{user_id}/balance/history", response_model=List[BalanceEntryResponse])
+def get_balance_history(
+    user_id: int,
+    limit: int = Query(50, ge=1, le=500),
+    before_id: Optional[int] = Query(None, ge=1, description="ID записи, с которой продолжить (постранично)"),
+    ledger_repo: LedgerRepository = Depends(get_ledger_repository)
+):
+    """История операций по балансу (новые первыми)"""
+    return ledger_repo.get_entries(user_id, limit=limit, before_id=before_id)
+
 # ========== CATEGORY ENDPOINTS ==========
 
 @app.post("/api/categories", response_model=CategoryResponse, status_code=status.HTTP_201_CREATED)
@@ -329,36 +474,71 @@ def create_category(
             detail=f"Ошибка при создании категории: {str(e)}"
         )
 
-@app.get("/api/categories", response_model=List[CategoryResponse])
-def get_all_categories(category_repo: CategoryRepository = Depends(get_category_repository)):
-    """Получение всех категорий"""
-    categories = category_repo.get_all_categories()
-    print(f"📊 Запрос всех категорий. Найдено: {len(categories)}")
-    return categories
+def get_category_stats(category_repo: CategoryRepository, max_age: Optional[int] = None) -> List[dict]:
+    """Категории с агрегатами; пересчитываются один раз на версию каталога (записи приложений и категорий)"""
+    return catalog_values.get_or_set(
+        ("category_stats", get_catalog_version(), max_age),
+        lambda: category_repo.get_category_stats(max_age),
+    )
+
+@app.get("/api/categories", response_model=List[CategoryStatsResponse])
+def get_all_categories(
+    request: Request,
+    viewer_age: Optional[int] = Depends(get_viewer_age),
+    category_repo: CategoryRepository = Depends(get_category_repository),
+    app_repo: AppsRepository = Depends(get_app_repository)
+):
+    """
+    Получение всех категорий с количеством приложений, суммой скачиваний и средним рейтингом.
+    С токеном агрегаты считаются только по приложениям, разрешенным по возрасту.
+    """
+    if viewer_age is None:
+        snapshot = catalog_snapshots.respond(request, "categories.json")
+        if snapshot is not None:
+            return snapshot
+    max_age = get_age_segment(viewer_age, app_repo) if viewer_age is not None else None
+
+    def build() -> bytes:
+        categories = get_category_stats(category_repo, max_age)
+        print(f"📊 Запрос всех категорий. Найдено: {len(categories)}")
+        return render_json(categories)
+
+    key = "categories" if max_age is None else f"categories:age:{max_age}"
+    return catalog_store.respond(request, key, get_catalog_version(), build, vary=("Authorization",))
 
-@app.get("/api/categories/{category_id}", response_model=CategoryResponse)
+@app.get("/api/categories/{category_id}", response_model=CategoryStatsResponse)
 def get_category(
     category_id: int,
-    category_repo: CategoryRepository = Depends(get_category_repository)
+    viewer_age: Optional[int] = Depends(get_viewer_age),
+    category_repo: CategoryRepository = Depends(get_category_repository),
+    app_repo: AppsRepository = Depends(get_app_repository)
 ):
-    """Получение категории по ID"""
-    category = category_repo.get_category_by_id(category_id)
+    """Получение категории по ID с агрегатами по приложениям"""
+    max_age = get_age_segment(viewer_age, app_repo) if viewer_age is not None else None
+    category = next(
+        (item for item in get_category_stats(category_repo, max_age) if item["id"] == category_id), None
+    )
     if not category:
         raise HTTPException(status_code=404, detail="Категория не найдена")
-    print(f"📄 Запрос категории ID: {category_id} - {category.name}")
+    print(f"📄 Запрос категории ID: {category_id} - {category['name']}")
     return category
 
 @app.put("/api/categories/{category_id}", response_model=CategoryResponse)
 def update_category(
     category_id: int,
     category_update: CategoryUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None, description="Версия записи; при несовпадении – 409"),
     category_repo: CategoryRepository = Depends(get_category_repository)
 ):
-    """Обновление данных категории"""
-    category = category_repo.update_category(category_id, **category_update.dict(exclude_unset=True))
+    """Обновление данных категории (с If-Match или version в теле – только если запись не изменилась)"""
+    fields = category_update.dict(exclude_unset=True)
+    expected_version = get_expected_version(if_match, fields.pop("version", None))
+    category = category_repo.update_category(category_id, expected_version=expected_version, **fields)
     if not category:
         raise HTTPException(status_code=404, detail="Категория не найдена")
-    print(f"✏️ Обновлена категория ID: {category_id} - {category.name}")
+    print(f"✏️ Обновлена категория ID: {category_id} - {category['name']}")
+    response.headers["ETag"] = version_etag(category["version"])
     return category
 
 @app.delete("/api/categories/{category_id}")
@@ -366,8 +546,11 @@ def delete_category(
     category_id: int,
     category_repo: CategoryRepository = Depends(get_category_repository)
 ):
-    """Удаление категории"""
-    success = category_repo.delete_category(category_id)
+    """Удаление категории (только пустой)"""
+    try:
+        success = category_repo.delete_category(category_id)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     if not success:
         raise HTTPException(status_code=404, detail="Категория не найдена")
     print(f"🗑️ Удалена категория ID: {category_id}")
@@ -378,9 +561,10 @@ def delete_category(
 @app.post("/api/apps", response_model=AppResponse, status_code=status.HTTP_201_CREATED)
 def create_app(
     app: AppCreate,
+    viewer: Optional[Viewer] = Depends(get_viewer),
     app_repo: AppsRepository = Depends(get_app_repository)
 ):
-    """Создание нового приложения"""
+    """Создание нового приложения; с токеном пользователь становится издателем и может загружать пакет"""
     try:
         new_app = app_repo.create_app(
             name=app.name,
@@ -389,7 +573,8 @@ def create_app(
             short_descr=app.short_descr,
             full_descr=app.full_descr,
             category_id=app.category_id,
-            age_restriction=app.age_restriction
+            age_restriction=app.age_restriction,
+            publisher_id=viewer.id if viewer is not None else None
         )
         print(f"✅ Создано приложение: {new_app.name} (ID: {new_app.id})")
         return AppResponse(
@@ -403,7 +588,8 @@ def create_app(
             category_id=new_app.category_id,
             downloads=new_app.downloads,
             rating=new_app.rating,
-            downloaded_by_users=[user.id for user in new_app.downloaded_by_users]
+            downloaded_by_users=[user.id for user in new_app.downloaded_by_users],
+            version=new_app.version
         )
     except Exception as e:
         print(f"❌ Ошибка создания приложения: {str(e)}")
@@ -412,37 +598,8 @@ def create_app(
             detail=f"Ошибка при создании приложения: {str(e)}"
         )
 
-@app.get("/api/apps", response_model=List[AppResponse])
-def get_all_apps(app_repo: AppsRepository = Depends(get_app_repository)):
-    """Получение всех приложений"""
-    apps = app_repo.get_all_apps()
-    print(f"📱 Запрос всех приложений. Найдено: {len(apps)}")
-    return [
-        AppResponse(
-            id=app.id,
-            name=app.name,
-            url=app.url,
-            short_descr=app.short_descr,
-            full_descr=app.full_descr,
-            price=app.price,
-            age_restriction=app.age_restriction,
-            category_id=app.category_id,
-            downloads=app.downloads,
-            rating=app.rating,
-            downloaded_by_users=[user.id for user in app.downloaded_by_users]
-        ) for app in apps
-    ]
-
-@app.get("/api/apps/{app_id}", response_model=AppResponse)
-def get_app(
-    app_id: int,
-    app_repo: AppsRepository = Depends(get_app_repository)
-):
-    """Получение приложения по ID"""
-    app = app_repo.get_app_by_id(app_id)
-    if not app:
-        raise HTTPException(status_code=404, detail="Приложение не найдено")
-    print(f"📄 Запрос приложения ID: {app_id} - {app.name}")
+def app_to_response(app) -> AppResponse:
+    """Приложение каталога в схему ответа"""
     return AppResponse(
         id=app.id,
         name=app.name,
@@ -454,57 +611,275 @@ def get_app(
         category_id=app.category_id,
         downloads=app.downloads,
         rating=app.rating,
-        downloaded_by_users=[user.id for user in app.downloaded_by_users]
+        downloaded_by_users=[user.id for user in app.downloaded_by_users],
+        version=app.version
     )
 
-@app.get("/api/categories/{category_id}/apps", response_model=List[AppResponse])
-def get_apps_by_category(
-    category_id: int,
+def render_app_item(app) -> bytes:
+    """JSON приложения каталога: из записи только для чтения или из ORM-объекта"""
+    if isinstance(app, AppRecord):
+        return render_plain_json(app.to_dict())
+    return render_json(app_to_response(app))
+
+def build_apps_body(apps) -> bytes:
+    """Сериализация списка приложений каталога"""
+    return b"[" + b",".join(render_app_item(app) for app in apps) + b"]"
+
+class CatalogPage:
+    """
+    Ответ каталога, разложенный на JSON-фрагменты приложений.
+    Общее тело собирается из них без повторной сериализации,
+    для авторизованного пользователя в каждый фрагмент дописывается флаг owned.
+    """
+    __slots__ = ("app_ids", "items", "head", "tail")
+
+    def __init__(self, apps, head: bytes = b"[", tail: bytes = b"]"):
+        self.app_ids = [app.id for app in apps]
+        self.items = [render_app_item(app) for app in apps]
+        self.head = head
+        self.tail = tail
+
+    def render(self, owned: Optional[Set[int]] = None) -> bytes:
+        if owned is None:
+            return self.head + b",".join(self.items) + self.tail
+        return self.head + b",".join(
+            item[:-1] + (b',"owned":true}' if app_id in owned else b',"owned":false}')
+            for app_id, item in zip(self.app_ids, self.items)
+        ) + self.tail
+
+# Разобранные страницы каталога по (ключ, версия каталога)
+catalog_pages = TTLCache(ttl=5.0)
+
+def respond_catalog(request: Request, key: str, viewer: Optional[Viewer], build_page) -> Response:
+    """
+    Ответ каталога: анонимным – общее предсжатое тело;
+    пользователю – с флагом owned по индексу владения.
+    """
+    version = get_catalog_version()
+    get_page = lambda: catalog_pages.get_or_set((key, version), build_page)
+    vary = ("Authorization",)
+    if viewer is None:
+        return catalog_store.respond(request, key, version, lambda: get_page().render(), vary=vary)
+
+    page = get_page()
+    owned = ownership_index.owned_among(viewer.id, page.app_ids)
+    if not owned:
+        # Ничего со страницы не куплено – общее для таких пользователей тело с owned=false
+        return catalog_store.respond(request, key + "|viewer", version, lambda: page.render(set()), vary=vary)
+    return Response(
+        content=page.render(owned), media_type="application/json",
+        headers={"Vary": ", ".join(("Accept-Encoding",) + vary)},
+    )
+
+def catalog_cache_key(filters: dict, sort: str = "name", descending: bool = False,
+                      limit: Optional[int] = None, offset: int = 0, facets: bool = False) -> str:
+    """Ключ ответа каталога в хранилище предсжатых тел"""
+    if not filters and sort == "name" and not descending and limit is None and not offset and not facets:
+        return "apps"
+    params = {**filters, "sort": sort, "desc": descending, "limit": limit, "offset": offset, "facets": facets}
+    return "apps?" + "&".join(f"{name}={value}" for name, value in sorted(params.items()))
+
+# Значения, производные от каталога (пороги возрастных сегментов), кешируются по версии
+catalog_values = TTLCache(ttl=5.0)
+
+def get_age_thresholds(app_repo: AppsRepository) -> List[int]:
+    """Различные возрастные ограничения приложений каталога (по возрастанию)"""
+    return catalog_values.get_or_set(("age_thresholds", get_catalog_version()), app_repo.get_age_restrictions)
+
+def get_age_segment(age: int, app_repo: AppsRepository) -> int:
+    """
+    Возрастной сегмент пользователя: наибольшее ограничение каталога, не превышающее его возраст.
+    Все пользователи сегмента видят один и тот же набор приложений и получают общий кешированный ответ.
+    """
+    thresholds = get_age_thresholds(app_repo)
+    index = bisect_right(thresholds, age) - 1
+    return thresholds[index] if index >= 0 else -1
+
+def preload_catalog_cache():
+    """Предзагрузка горячих ответов каталога при старте процесса: общий список и возрастные сегменты"""
+    version = get_catalog_version()
+    with AppsRepository() as app_repo:
+        catalog_store.get_entry("apps", version, lambda: build_apps_body(app_repo.get_all_app_records()))
+        for threshold in get_age_thresholds(app_repo):
+            catalog_store.get_entry(
+                catalog_cache_key({"max_age": threshold}), version,
+                lambda: build_apps_body(app_repo.search_apps(max_age=threshold)),
+            )
+
+def render_catalog_snapshot():
+    """
+    Файлы статического снимка публичного каталога (те же тела, что у динамических ответов):
+    apps.json, apps/{id}.json, categories.json, categories/{id}/apps.json
+    """
+    with AppsRepository() as app_repo:
+        apps = app_repo.get_all_app_records()
+        categories = CategoryRepository(app_repo.session).get_category_stats()
+
+    items = {app.id: render_app_item(app) for app in apps}
+    yield "apps.json", b"[" + b",".join(items[app.id] for app in apps) + b"]"
+    for app_id, body in items.items():
+        yield f"apps/{app_id}.json", body
+    yield "categories.json", render_json(categories)
+    for category in categories:
+        # apps уже отсортированы по названию, как и в get_apps_by_category
+        body = b",".join(items[app.id] for app in apps if app.category_id == category["id"])
+        yield f"categories/{category['id']}/apps.json", b"[" + body + b"]"
+
+@app.get("/api/apps", response_model=Union[List[CatalogAppResponse], AppCatalogResponse])
+def get_all_apps(
+    request: Request,
+    category_id: Optional[int] = Query(None, description="Категория"),
+    min_price: Optional[float] = Query(None, ge=0, description="Минимальная цена"),
+    max_price: Optional[float] = Query(None, ge=0, description="Максимальная цена"),
+    free: Optional[bool] = Query(None, description="true – только бесплатные, false – только платные"),
+    max_age: Optional[int] = Query(None, ge=0, description="Максимальное возрастное ограничение"),
+    min_rating: Optional[float] = Query(None, ge=0, le=5, description="Минимальный рейтинг"),
+    sort: Literal["name", "downloads", "rating", "price"] = Query("name", description="Поле сортировки"),
+    order: Optional[Literal["asc", "desc"]] = Query(None, description="Порядок (по умолчанию: name – asc, остальные – desc)"),
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+    facets: bool = Query(False, description="Вернуть {items, total, facets} вместо списка"),
+    viewer: Optional[Viewer] = Depends(get_viewer),
+    app_repo: AppsRepository = Depends(get_app_repository)
+):
+    """
+    Получение приложений каталога с фильтрами, сортировкой и фасетами.
+    С токеном возвращаются только приложения, разрешенные по возрасту пользователя,
+    и у каждого – флаг owned (приложение уже скачано).
+    """
+    filters = {
+        "category_id": category_id,
+        "min_price": min_price,
+        "max_price": max_price,
+        "free": free,
+        "max_age": max_age,
+        "min_rating": min_rating,
+    }
+    if viewer is None and not request.query_params:
+        snapshot = catalog_snapshots.respond(request, "apps.json")
+        if snapshot is not None:
+            return snapshot
+    filters = {key: value for key, value in filters.items() if value is not None}
+    if viewer is not None:
+        segment = get_age_segment(viewer.age, app_repo)
+        filters["max_age"] = min(filters.get("max_age", segment), segment)
+    descending = (order or ("asc" if sort == "name" else "desc")) == "desc"
+    key = catalog_cache_key(filters, sort, descending, limit, offset, facets)
+    is_default = key == "apps"
+
+    def build_page() -> CatalogPage:
+        if is_default:
+            apps = app_repo.get_all_app_records()
+        else:
+            apps = app_repo.search_apps(sort=sort, descending=descending, limit=limit, offset=offset, **filters)
+        print(f"📱 Запрос приложений каталога. Найдено: {len(apps)}")
+        if not facets:
+            return CatalogPage(apps)
+        # Тот же JSON, что и у AppCatalogResponse: {"items": [...], "total": ..., "facets": {...}}
+        total = app_repo.count_apps(**filters)
+        return CatalogPage(
+            apps,
+            head=b'{"items":[',
+            tail=b'],"total":' + render_json(total) + b',"facets":'
+                 + render_json(AppFacets(**app_repo.get_app_facets(**filters))) + b"}",
+        )
+
+    # Тело строится и сжимается один раз на версию каталога и набор параметров (включая возрастной сегмент)
+    return respond_catalog(request, key, viewer, build_page)
+
+@app.get("/api/apps/suggest", response_model=List[AppSuggestion])
+def suggest_apps(
+    prefix: str = Query(..., min_length=1, max_length=100, description="Начало названия"),
+    limit: int = Query(10, ge=1, le=50),
+    viewer_age: Optional[int] = Depends(get_viewer_age),
+):
+    """
+    Подсказки по названию при вводе: поиск по префиксу названия или слова в нем,
+    при нехватке результатов – нечеткий поиск по триграммам. Сортировка по скачиваниям.
+    """
+    return suggest_index.suggest(prefix, limit, max_age=viewer_age)
+
+@app.get("/api/apps/trending", response_model=List[TrendingApp])
+def get_trending_apps(
+    category_id: Optional[int] = Query(None, description="Тренды одной категории"),
+    limit: int = Query(20, ge=1, le=100),
+    viewer_age: Optional[int] = Depends(get_viewer_age),
     app_repo: AppsRepository = Depends(get_app_repository)
 ):
-    """Получение приложений по категории"""
-    apps = app_repo.get_apps_by_category(category_id)
-    print(f"📱 Запрос приложений категории ID: {category_id}. Найдено: {len(apps)}")
+    """
+    Приложения, которые скачивают и обсуждают сейчас: счет из недавних скачиваний и отзывов,
+    затухающий вдвое каждые несколько часов (в отличие от общего счетчика downloads)
+    """
+    top = trending_index.top(limit, category_id=category_id, max_age=viewer_age)
+    cards = app_repo.get_app_cards(app_id for app_id, _ in top)
     return [
-        AppResponse(
-            id=app.id,
-            name=app.name,
-            url=app.url,
-            short_descr=app.short_descr,
-            full_descr=app.full_descr,
-            price=app.price,
-            age_restriction=app.age_restriction,
-            category_id=app.category_id,
-            downloads=app.downloads,
-            rating=app.rating,
-            downloaded_by_users=[user.id for user in app.downloaded_by_users]
-        ) for app in apps
+        TrendingApp(**cards[app_id], score=round(score, 4))
+        for app_id, score in top if app_id in cards
     ]
 
+@app.get("/api/apps/{app_id}", response_model=AppResponse)
+def get_app(
+    app_id: int,
+    request: Request,
+    app_repo: AppsRepository = Depends(get_app_repository)
+):
+    """Получение приложения по ID (одновременные одинаковые запросы выполняют один запрос к БД)"""
+    snapshot = catalog_snapshots.respond(request, f"apps/{app_id}.json")
+    if snapshot is not None:
+        return snapshot
+
+    def load() -> Optional[AppResponse]:
+        app = app_repo.get_app_by_id(app_id)
+        return app_to_response(app) if app else None
+
+    response = read_flights.do(("app", app_id), load)
+    if response is None:
+        raise HTTPException(status_code=404, detail="Приложение не найдено")
+    print(f"📄 Запрос приложения ID: {app_id} - {response.name}")
+    return response
+
+@app.get("/api/categories/{category_id}/apps", response_model=List[CatalogAppResponse])
+def get_apps_by_category(
+    category_id: int,
+    request: Request,
+    viewer: Optional[Viewer] = Depends(get_viewer),
+    app_repo: AppsRepository = Depends(get_app_repository)
+):
+    """Получение приложений по категории (с токеном – только разрешенные по возрасту, с флагом owned)"""
+    if viewer is None:
+        snapshot = catalog_snapshots.respond(request, f"categories/{category_id}/apps.json")
+        if snapshot is not None:
+            return snapshot
+    max_age = get_age_segment(viewer.age, app_repo) if viewer is not None else None
+
+    def build_page() -> CatalogPage:
+        if max_age is None:
+            apps = app_repo.get_apps_by_category(category_id)
+        else:
+            apps = app_repo.search_apps(category_id=category_id, max_age=max_age)
+        print(f"📱 Запрос приложений категории ID: {category_id}. Найдено: {len(apps)}")
+        return CatalogPage(apps)
+
+    key = f"category:{category_id}:apps" if max_age is None else f"category:{category_id}:apps:age:{max_age}"
+    return respond_catalog(request, key, viewer, build_page)
+
 @app.put("/api/apps/{app_id}", response_model=AppResponse)
 def update_app(
     app_id: int,
     app_update: AppUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None, description="Версия записи; при несовпадении – 409"),
     app_repo: AppsRepository = Depends(get_app_repository)
 ):
-    """Обновление данных приложения"""
-    app = app_repo.update_app(app_id, **app_update.dict(exclude_unset=True))
+    """Обновление данных приложения (с If-Match или version в теле – только если запись не изменилась)"""
+    fields = app_update.dict(exclude_unset=True)
+    expected_version = get_expected_version(if_match, fields.pop("version", None))
+    app = app_repo.update_app(app_id, expected_version=expected_version, **fields)
     if not app:
         raise HTTPException(status_code=404, detail="Приложение не найдено")
     print(f"✏️ Обновлено приложение ID: {app_id} - {app.name}")
-    return AppResponse(
-        id=app.id,
-        name=app.name,
-        url=app.url,
-        short_descr=app.short_descr,
-        full_descr=app.full_descr,
-        price=app.price,
-        age_restriction=app.age_restriction,
-        category_id=app.category_id,
-        downloads=app.downloads,
-        rating=app.rating,
-        downloaded_by_users=[user.id for user in app.downloaded_by_users]
-    )
+    response.headers["ETag"] = version_etag(app.version)
+    return AppResponse(**app.to_dict())
 
 @app.delete("/api/apps/{app_id}")
 def delete_app(
@@ -515,6 +890,8 @@ def delete_app(
     success = app_repo.delete_app(app_id)
     if not success:
         raise HTTPException(status_code=404, detail="Приложение не найдено")
+    # Связанные строки удаляются фоновой задачей порциями
+    jobs.enqueue_once("purge_deleted_apps", priority=5, session=app_repo.session)
     print(f"🗑️ Удалено приложение ID: {app_id}")
     return {"message": "Приложение успешно удалено"}
 
@@ -525,6 +902,7 @@ def get_users_downloaded_app(
 ):
     """Получение пользователей, скачавших приложение"""
     users = app_repo.get_users_downloaded_app(app_id)
+    balances = LedgerRepository(app_repo.session).get_balances(user.id for user in users)
     print(f"👥 Запрос пользователей приложения ID: {app_id}. Найдено: {len(users)}")
     return [
         UserResponse(
@@ -533,14 +911,99 @@ def get_users_downloaded_app(
             email=user.email,
             name=user.name,
             age=user.age,
-            balance=user.balance,
+            balance=balances[user.id],
             count_inputs=user.count_inputs,
             created_at=user.created_at,
             updated_at=user.updated_at,
-            downloaded_apps=[app.id for app in user.downloaded_apps]
+            downloaded_apps=[app.id for app in user.downloaded_apps],
+            version=user.version
         ) for user in users
     ]
 
+# ========== PACKAGE ENDPOINTS ==========
+
+SHA256_PATTERN = re.compile(r"[0-9a-fA-F]{64}")
+
+@app.put("/api/apps/{app_id}/package", response_model=AppPackageResponse, status_code=status.HTTP_201_CREATED)
+async def upload_app_package(
+    app_id: int,
+    request: Request,
+    filename: Optional[str] = Query(None, min_length=1, max_length=200, description="Имя файла при скачивании"),
+    x_checksum_sha256: Optional[str] = Header(None, description="SHA-256 пакета (hex) для проверки целостности"),
+    current_user: models.User = Depends(get_current_user),
+):
+    """
+    Загрузка пакета приложения: тело запроса – сам файл (не multipart).
+    Пишется на диск потоком с подсчетом SHA-256, память не зависит от размера.
+    Повторная загрузка заменяет пакет. Загружает только издатель приложения или администратор.
+    """
+    if x_checksum_sha256 is not None and not SHA256_PATTERN.fullmatch(x_checksum_sha256):
+        raise HTTPException(status_code=400, detail="X-Checksum-SHA256 должен содержать 64 hex-символа")
+    content_length = request.headers.get("content-length")
+    if content_length is not None and content_length.isdigit() and int(content_length) > MAX_PACKAGE_SIZE:
+        raise HTTPException(status_code=413, detail=f"Пакет больше {MAX_PACKAGE_SIZE} байт")
+    content_type = request.headers.get("content-type") or "application/octet-stream"
+    if len(content_type) > 100:
+        content_type = "application/octet-stream"
+
+    user_id, is_admin = current_user.id, current_user.is_admin
+
+    def find_app() -> Optional[tuple]:
+        with AppsRepository() as app_repo:
+            app = app_repo.get_app_by_id(app_id)
+            return (app.name, app.publisher_id) if app else None
+
+    # Проверяем приложение и права до чтения тела – не принимаем гигабайты впустую
+    found = await run_in_threadpool(find_app)
+    if found is None:
+        raise HTTPException(status_code=404, detail="Приложение не найдено")
+    app_name, publisher_id = found
+    if not is_admin and publisher_id != user_id:
+        raise HTTPException(status_code=403, detail="Загружать пакет может только издатель приложения")
+    try:
+        stored = await package_store.save_stream(app_id, request.stream(), x_checksum_sha256)
+    except PackageTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ChecksumMismatch as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    def publish():
+        with AppsRepository() as app_repo:
+            package, previous = app_repo.publish_package(
+                app_id, stored.sha256, stored.size, filename or f"{app_name}.pkg", content_type
+            )
+            return (AppPackageResponse.model_validate(package) if package else None), previous
+
+    package, previous = await run_in_threadpool(publish)
+    if package is None:
+        # Приложение удалили во время загрузки – файлы уберет очистка удаленных приложений
+        raise HTTPException(status_code=404, detail="Приложение не найдено")
+    if previous is not None and previous != stored.sha256:
+        package_store.remove(app_id, previous)
+    print(f"📦 Загружен пакет приложения ID: {app_id}: {stored.size} байт, sha256 {stored.sha256}")
+    return package
+
+@app.api_route("/api/apps/{app_id}/package", methods=["GET", "HEAD"], response_class=FileResponse)
+def download_app_package(
+    app_id: int,
+    request: Request,
+    current_user: models.User = Depends(get_current_user),
+    app_repo: AppsRepository = Depends(get_app_repository)
+):
+    """
+    Скачивание пакета – только для пользователей, купивших приложение (download_app).
+    Поддерживаются Range/If-Range (докачка), If-None-Match и HEAD; ETag – SHA-256 пакета.
+    """
+    package = app_repo.get_package(app_id)
+    if package is None:
+        raise HTTPException(status_code=404, detail="Пакет приложения не загружен")
+    if not ownership_index.owns(current_user.id, app_id, confirm=True):
+        raise HTTPException(status_code=403, detail="Приложение не приобретено")
+    response = package_store.respond(request, app_id, package.sha256, package.filename, package.content_type)
+    if response is None:
+        raise HTTPException(status_code=404, detail="Файл пакета не найден")
+    return response
+
 # ========== REPORT ENDPOINTS ==========
 
 @app.post("/api/reports", response_model=ReportResponse, status_code=status.HTTP_201_CREATED)
@@ -558,6 +1021,17 @@ def create_report(
         )
         print(f"✅ Создан отчет ID: {new_report.id} для пользователя {report.user_id} и приложения {report.app_id}")
         return new_report
+    except DuplicateReport as e:
+        print(f"🚫 Отклонен повторяющийся отзыв пользователя {report.user_id} для приложения {report.app_id}")
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail={
+                "message": str(e),
+                "duplicate_of": e.duplicate_of,
+                "similar_in_app": e.similar_in_app,
+                "similar_total": e.similar_total,
+            },
+        )
     except Exception as e:
         print(f"❌ Ошибка создания отчета: {str(e)}")
         raise HTTPException(
@@ -585,13 +1059,212 @@ def get_user_reports(
 @app.get("/api/apps/{app_id}/reports", response_model=List[ReportResponse])
 def get_app_reports(
     app_id: int,
+    limit: Optional[int] = Query(None, ge=1, le=100, description="Размер страницы"),
+    after_id: Optional[int] = Query(None, ge=0, description="ID последнего отчета предыдущей страницы"),
     report_repo: ReportRepository = Depends(get_report_repository)
 ):
-    """Получение всех отчетов для приложения"""
-    reports = report_repo.get_reports_by_app(app_id)
+    """Получение отчетов для приложения (постранично при указании limit)"""
+    reports = read_flights.do(
+        ("app_reports", app_id, limit, after_id),
+        lambda: [
+            ReportResponse.model_validate(report)
+            for report in report_repo.get_reports_by_app(app_id, limit=limit, after_id=after_id)
+        ],
+    )
     print(f"📄 Запрос отчетов приложения ID: {app_id}. Найдено: {len(reports)}")
     return reports
 
+@app.get("/api/apps/{app_id}/reports/summary", response_model=ReportSummaryResponse)
+def get_app_reports_summary(
+    app_id: int,
+    latest: int = Query(5, ge=0, le=50, description="Сколько последних отзывов вернуть"),
+    report_repo: ReportRepository = Depends(get_report_repository)
+):
+    """Сводка по отзывам приложения: количество, средняя оценка, гистограмма звезд, последние отзывы"""
+    summary = read_flights.do(
+        ("app_reports_summary", app_id, latest),
+        lambda: ReportSummaryResponse.model_validate(report_repo.get_report_summary(app_id, latest=latest)),
+    )
+    print(f"📊 Сводка отзывов приложения ID: {app_id}. Всего: {summary.count}")
+    return summary
+
+# Период статистики по умолчанию
+DEFAULT_STATS_PERIODS = {"hour": timedelta(hours=48), "day": timedelta(days=30)}
+
+def to_local_time(moment: datetime) -> datetime:
+    """Время запроса в зоне хранения (московское, без tzinfo)"""
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(MOSCOW_TZ).replace(tzinfo=None)
+    return moment
+
+@app.get("/api/apps/{app_id}/stats", response_model=AppDownloadStatsResponse)
+def get_app_download_stats(
+    app_id: int,
+    start: Optional[datetime] = Query(None, alias="from", description="Начало периода"),
+    end: Optional[datetime] = Query(None, alias="to", description="Конец периода (интервал с ним включается)"),
+    granularity: Literal["hour", "day"] = Query("day", description="Шаг: час или сутки"),
+    app_repo: AppsRepository = Depends(get_app_repository),
+    stats_repo: DownloadStatsRepository = Depends(get_download_stats_repository)
+):
+    """Скачивания, покупки и выручка приложения по часам или суткам (из агрегатов, без сканирования журнала)"""
+    if not app_repo.get_app_by_id(app_id):
+        raise HTTPException(status_code=404, detail="Приложение не найдено")
+    
+    step = STATS_STEPS[granularity]
+    end = truncate_bucket(to_local_time(end or get_current_time()), granularity) + step
+    start = truncate_bucket(to_local_time(start) if start else end - DEFAULT_STATS_PERIODS[granularity], granularity)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="Начало периода должно быть раньше конца")
+    if (end - start) / step > MAX_STATS_POINTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Слишком длинный период: не больше {MAX_STATS_POINTS} точек, укрупните шаг или сократите период",
+        )
+    
+    points = stats_repo.get_stats(app_id, start, end, granularity)
+    print(f"📈 Статистика скачиваний приложения ID: {app_id}, точек: {len(points)} ({granularity})")
+    return AppDownloadStatsResponse(
+        app_id=app_id,
+        granularity=granularity,
+        start=MOSCOW_TZ.localize(start),
+        end=MOSCOW_TZ.localize(end),
+        downloads=sum(point["downloads"] for point in points),
+        purchases=sum(point["purchases"] for point in points),
+        revenue=float(to_money(sum(point["revenue"] for point in points))),
+        points=points,
+    )
+
+# ========== JOB ENDPOINTS ==========
+
+@app.post("/api/jobs", response_model=JobResponse, status_code=status.HTTP_202_ACCEPTED)
+def create_job(job_in: JobCreate, db = Depends(get_db)):
+    """Постановка фоновой задачи в очередь"""
+    try:
+        job = jobs.enqueue(job_in.kind, job_in.params, priority=job_in.priority, max_attempts=job_in.max_attempts, session=db)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"{e}. Доступные: {', '.join(jobs.registered_kinds())}")
+    print(f"⚙️ Поставлена задача ID: {job.id} ({job.kind}), приоритет {job.priority}")
+    return job
+
+@app.get("/api/jobs", response_model=List[JobResponse])
+def get_jobs(
+    status_filter: Optional[str] = Query(None, alias="status"),
+    limit: int = Query(50, ge=1, le=500),
+    db = Depends(get_db)
+):
+    """Список последних фоновых задач"""
+    stmt = select(models.Job).order_by(models.Job.id.desc()).limit(limit)
+    if status_filter:
+        stmt = stmt.where(models.Job.status == status_filter)
+    return list(db.execute(stmt).scalars().all())
+
+@app.get("/api/jobs/{job_id}", response_model=JobResponse)
+def get_job(job_id: int, db = Depends(get_db)):
+    """Статус и прогресс фоновой задачи"""
+    job = db.get(models.Job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    return job
+
+# ========== ADMIN ENDPOINTS ==========
+
+# Статистика БД кешируется между вызовами
+ADMIN_STATS_TTL_SECONDS = 30
+admin_stats_cache = TTLCache(ttl=ADMIN_STATS_TTL_SECONDS)
+
+def collect_admin_estimates() -> Optional[dict]:
+    """Оценки PostgreSQL с моментом сбора; None – другая СУБД"""
+    stats = collect_estimated_stats()
+    return {**stats, "generated_at": datetime.now()} if stats is not None else None
+
+@app.get("/api/admin/stats", response_model=AdminStatsResponse)
+def get_admin_stats(
+    exact: bool = Query(False, description="Запустить точный подсчет строк фоновой задачей"),
+    db = Depends(get_db)
+):
+    """
+    Статистика таблиц по оценкам PostgreSQL (pg_class.reltuples, pg_stat_*):
+    размеры таблиц и индексов, использование индексов, доля мертвых строк.
+    Точные COUNT(*) – только фоновой задачей table_stats по запросу.
+    """
+    stats = admin_stats_cache.get_or_set("estimated", collect_admin_estimates)
+    if stats is None:
+        raise HTTPException(status_code=501, detail="Статистика доступна только для PostgreSQL")
+
+    last_exact = db.execute(
+        select(models.Job)
+        .where(models.Job.kind == "table_stats", models.Job.status == jobs.SUCCEEDED)
+        .order_by(models.Job.id.desc())
+        .limit(1)
+    ).scalar_one_or_none()
+
+    exact_job_id = None
+    if exact:
+        exact_job_id = db.execute(
+            select(models.Job.id)
+            .where(models.Job.kind == "table_stats", models.Job.status.in_((jobs.QUEUED, jobs.RUNNING)))
+            .limit(1)
+        ).scalar()
+        if exact_job_id is None:
+            exact_job_id = jobs.enqueue("table_stats", priority=-5, session=db).id
+            print(f"⚙️ Поставлен точный подсчет строк, задача ID: {exact_job_id}")
+
+    return AdminStatsResponse(
+        **stats,
+        exact_counts=(last_exact.result or {}).get("tables") if last_exact else None,
+        exact_counts_at=last_exact.finished_at if last_exact else None,
+        exact_job_id=exact_job_id,
+        ownership_index=ownership_index.memory_usage(),
+        report_duplicates=report_duplicates.memory_usage(),
+        read_coalescing=read_flights.stats(),
+        statement_cache=statement_cache_stats.snapshot(),
+    )
+
+# ========== CHANGE FEED ==========
+
+# Интервал keep-alive комментариев, чтобы прокси не закрывали соединение
+EVENTS_KEEPALIVE_SECONDS = 15
+
+@app.get("/api/events")
+async def stream_events(
+    request: Request,
+    app_id: Optional[List[int]] = Query(None, description="Только события этих приложений (например, приложений разработчика)"),
+    category_id: Optional[List[int]] = Query(None, description="Только события приложений этих категорий"),
+    type: Optional[List[str]] = Query(None, description=f"Типы событий: {', '.join(EVENT_TYPES)}"),
+):
+    """
+    Лента изменений каталога (Server-Sent Events) вместо опроса /api/apps.
+    События одного типа по одному приложению склеиваются (поле count).
+    Фильтр по категории применяется к событиям приложений.
+    """
+    unknown = set(type or []) - set(EVENT_TYPES)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Неизвестные типы событий: {', '.join(sorted(unknown))}")
+
+    subscription = broadcaster.subscribe(app_ids=app_id, category_ids=category_id, event_types=type)
+    print(f"📡 Новый подписчик ленты изменений. Всего: {broadcaster.stats()['subscribers']}")
+
+    async def event_stream():
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                batch = await subscription.next_batch(EVENTS_KEEPALIVE_SECONDS)
+                if not batch:
+                    yield ": keep-alive\n\n"
+                    continue
+                for event in batch:
+                    yield event.to_sse()
+        finally:
+            broadcaster.unsubscribe(subscription)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+CHECKOUT_ERROR_STATUS = {"not_found": 404, "insufficient_funds": 400, "conflict": 409}
+
 # Бизнес-эндпоинт
 @app.post("/api/users/{user_id}/download_app/{app_id}")
 def download_app(
@@ -607,28 +1280,42 @@ def download_app(
     if not user or not app:
         raise HTTPException(status_code=404, detail="Пользователь или приложение не найдены")
     
-    if app.price > user.balance:
-        raise HTTPException(status_code=400, detail="Недостаточно средств")
-    
-    # Проверяем, не скачано ли приложение уже
-    if app in user.downloaded_apps:
+    # Положительный ответ индекса владения надежен – повторное скачивание без блокировки баланса.
+    # Отрицательный – только подсказка: решает первичный ключ связи в транзакции списания
+    if ownership_index.owns(user_id, app_id):
         return {"message": "Приложение уже скачано"}
     
-    # Обновляем баланс пользователя
-    user_repo.update_user(user_id, balance=user.balance - app.price)
-    
-    # Увеличиваем счетчик загрузок
-    app_repo.update_app(app_id, downloads=app.downloads + 1)
-    
-    # Добавляем приложение в список скачанных пользователем
-    user_repo.add_downloaded_app(user_id, app_id)
-    
-    # Увеличиваем счетчик входов пользователя
-    user_repo.update_user(user_id, count_inputs=user.count_inputs + 1)
+    # Проверка владения, списание, связь, счетчики и событие статистики – одной транзакцией
+    # под блокировкой баланса (тот же путь, что у покупки набора приложений)
+    try:
+        result = user_repo.checkout(user_id, [app_id])
+    except CheckoutError as e:
+        raise HTTPException(status_code=CHECKOUT_ERROR_STATUS[e.reason], detail=str(e))
+    if not result["purchased"]:
+        return {"message": "Приложение уже скачано"}
     
     print(f"📥 Пользователь {user.name} скачал приложение {app.name}")
     return {"message": f"Приложение {app.name} успешно скачано"}
 
+@app.post("/api/users/{user_id}/checkout", response_model=CheckoutResponse)
+def checkout(
+    user_id: int,
+    order: CheckoutRequest,
+    user_repo: UserRepository = Depends(get_user_repository)
+):
+    """Покупка набора приложений одной транзакцией: либо куплены все, либо ничего"""
+    try:
+        result = user_repo.checkout(user_id, order.app_ids)
+    except CheckoutError as e:
+        detail = {"message": str(e)}
+        if e.app_ids is not None:
+            detail["app_ids"] = e.app_ids
+        if e.required is not None:
+            detail.update(required=str(e.required), balance=str(e.balance))
+        raise HTTPException(status_code=CHECKOUT_ERROR_STATUS[e.reason], detail=detail)
+    print(f"🛒 Пользователь ID: {user_id} купил приложения {result['purchased']} на сумму {result['total']}")
+    return CheckoutResponse(user_id=user_id, **result)
+
 if __name__ == "__main__":
-    # Правильный запуск с поддержкой reload
+    # Запуск для разработки с поддержкой reload; production – python server.py
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
@@ -0,0 +1,266 @@
+"""
+Версионирование схемы БД.
+
+Приложение при старте только сверяет сохраненную версию схемы с ожидаемой,
+а сами миграции запускаются отдельно через CLI:
+
+    python migrations.py upgrade     # применить все недостающие миграции
+    python migrations.py current     # показать текущую версию схемы
+    python migrations.py history     # список миграций
+"""
+import argparse
+from datetime import timedelta
+from typing import Callable, List, Optional, Tuple
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import DBAPIError
+
+from database import Base, engine, get_utc_time
+import models  # noqa: F401 – регистрация моделей в Base.metadata
+
+SCHEMA_VERSION_TABLE = "schema_version"
+# Секции журнала скачиваний создаются заранее на столько месяцев вперед
+DOWNLOAD_PARTITION_MONTHS_AHEAD = 2
+
+
+def _create_indexes(conn: Connection, table, *names: str):
+    """Создание объявленных в модели индексов, если их еще нет"""
+    for index in table.indexes:
+        if index.name in names:
+            index.create(conn, checkfirst=True)
+
+
+def _add_column(conn: Connection, table, name: str):
+    """Добавление объявленной в модели колонки, если ее еще нет"""
+    if name in {column["name"] for column in inspect(conn).get_columns(table.name)}:
+        return
+    column = table.c[name]
+    ddl = f"ALTER TABLE {table.name} ADD COLUMN {name} {column.type.compile(dialect=conn.dialect)}"
+    if column.server_default is not None:
+        # Существующие строки сразу получают значение по умолчанию
+        ddl += f" DEFAULT {column.server_default.arg}"
+    if not column.nullable:
+        ddl += " NOT NULL"
+    conn.execute(text(ddl))
+
+
+def _initial_schema(conn: Connection):
+    """
+    Исходная схема: все таблицы моделей.
+    На пустой БД создает и то, что добавляют следующие миграции,
+    поэтому все миграции должны быть идемпотентными (checkfirst / IF NOT EXISTS).
+    """
+    Base.metadata.create_all(conn)
+
+
+def _reports_app_id_index(conn: Connection):
+    """Индекс reports(app_id, id) для сводки и постраничной выдачи отзывов"""
+    _create_indexes(conn, models.Report.__table__, "ix_reports_app_id_id")
+
+
+def _jobs_table(conn: Connection):
+    """Таблица фоновых задач"""
+    models.Job.__table__.create(conn, checkfirst=True)
+
+
+def _balance_ledger(conn: Connection):
+    """Журнал баланса и снимки; текущие балансы переносятся как начальные записи"""
+    models.BalanceEntry.__table__.create(conn, checkfirst=True)
+    models.BalanceSnapshot.__table__.create(conn, checkfirst=True)
+    has_entries = conn.execute(text("SELECT 1 FROM balance_ledger LIMIT 1")).first()
+    if not has_entries:
+        conn.execute(text(
+            "INSERT INTO balance_ledger (user_id, amount, kind, created_at) "
+            "SELECT id, balance, 'opening', CURRENT_TIMESTAMP FROM users "
+            "WHERE balance IS NOT NULL AND balance <> 0"
+        ))
+
+
+def _refresh_tokens(conn: Connection):
+    """Таблица refresh-токенов"""
+    models.RefreshToken.__table__.create(conn, checkfirst=True)
+
+
+def _apps_catalog_indexes(conn: Connection):
+    """Составные индексы для фильтров и сортировок каталога"""
+    _create_indexes(
+        conn, models.App.__table__,
+        "ix_apps_downloads_id", "ix_apps_rating_id", "ix_apps_price_id",
+        "ix_apps_category_downloads", "ix_apps_category_rating",
+        "ix_apps_category_price", "ix_apps_category_name",
+    )
+
+
+def _set_based_deletes(conn: Connection):
+    """Мягкое удаление приложений и индексы для удаления зависимых строк без полного прохода"""
+    _add_column(conn, models.App.__table__, "deleted_at")
+    _create_indexes(conn, models.user_downloaded_apps, "ix_user_downloaded_apps_app_id")
+    _create_indexes(conn, models.Report.__table__, "ix_reports_user_id")
+    _create_indexes(conn, models.BalanceEntry.__table__, "ix_balance_ledger_app_id")
+
+
+
+def _row_versions(conn: Connection):
+    """Версии строк пользователей, категорий и приложений для оптимистичной блокировки"""
+    for model in (models.User, models.Category, models.App):
+        _add_column(conn, model.__table__, "version")
+
+
+
+def _app_packages(conn: Connection):
+    """Таблица загруженных пакетов приложений"""
+    models.AppPackage.__table__.create(conn, checkfirst=True)
+
+
+
+def ensure_download_partitions(conn: Connection, months_ahead: int = DOWNLOAD_PARTITION_MONTHS_AHEAD) -> List[str]:
+    """
+    Месячные секции download_events (только PostgreSQL) на текущий и months_ahead следующих месяцев
+    по UTC (created_at хранится в UTC),
+    плюс секция по умолчанию, чтобы вставка не падала, если секцию не успели создать.
+    Секции создаются заранее: новая секция не создается, если ее строки уже попали в секцию по умолчанию.
+    Возвращает имена созданных секций.
+    """
+    if conn.dialect.name != "postgresql":
+        return []
+    table = models.DownloadEvent.__tablename__
+    created = []
+    month = get_utc_time().date().replace(day=1)
+    for _ in range(months_ahead + 1):
+        following = (month + timedelta(days=32)).replace(day=1)
+        name = f"{table}_{month:%Y_%m}"
+        if conn.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar() is None:
+            conn.execute(text(
+                f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM ('{month}') TO ('{following}')"
+            ))
+            created.append(name)
+        month = following
+    conn.execute(text(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT"))
+    return created
+
+
+def _download_events(conn: Connection):
+    """Журнал скачиваний по месяцам, почасовые и посуточные агрегаты"""
+    for model in (models.DownloadEvent, models.DownloadStatsHourly, models.DownloadStatsDaily, models.DownloadRollupState):
+        model.__table__.create(conn, checkfirst=True)
+    ensure_download_partitions(conn)
+    if conn.execute(text("SELECT 1 FROM download_rollup_state WHERE id = 1")).first() is None:
+        conn.execute(text("INSERT INTO download_rollup_state (id, last_event_id, updated_at) VALUES (1, 0, CURRENT_TIMESTAMP)"))
+
+
+
+def _report_duplicate_of(conn: Connection):
+    """Пометка почти одинаковых отзывов reports.duplicate_of"""
+    _add_column(conn, models.Report.__table__, "duplicate_of")
+
+
+def _download_stats_moscow_buckets(conn: Connection):
+    """
+    Агрегаты статистики пересчитываются с московскими интервалами. Старые события записаны
+    московским временем с tzinfo, которое PostgreSQL перевел в зону сеанса (по умолчанию UTC),
+    а агрегаты разбиты по этой зоне: они очищаются, свертка заново проходит весь журнал
+    """
+    if conn.dialect.name != "postgresql":
+        return
+    conn.execute(text("DELETE FROM download_stats_hourly"))
+    conn.execute(text("DELETE FROM download_stats_daily"))
+    conn.execute(text("UPDATE download_rollup_state SET last_event_id = 0"))
+
+
+def _app_publishers(conn: Connection):
+    """Издатели приложений и администраторы: права на загрузку пакетов"""
+    _add_column(conn, models.User.__table__, "is_admin")
+    if "publisher_id" not in {column["name"] for column in inspect(conn).get_columns("apps")}:
+        # _add_column не создает внешние ключи; у существующих приложений издателя нет
+        conn.execute(text("ALTER TABLE apps ADD COLUMN publisher_id INTEGER REFERENCES users (id) ON DELETE SET NULL"))
+    _create_indexes(conn, models.App.__table__, "ix_apps_publisher_id")
+
+
+# Список миграций: (версия, описание, функция). Новые миграции добавляются в конец.
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "Исходная схема", _initial_schema),
+    (2, "Индекс reports(app_id, id)", _reports_app_id_index),
+    (3, "Таблица фоновых задач jobs", _jobs_table),
+    (4, "Журнал баланса balance_ledger и снимки balance_snapshots", _balance_ledger),
+    (5, "Таблица refresh-токенов", _refresh_tokens),
+    (6, "Индексы фильтров и сортировок каталога", _apps_catalog_indexes),
+    (7, "Мягкое удаление приложений, индексы для удаления пользователей и приложений", _set_based_deletes),
+    (8, "Версии строк users, categories, apps", _row_versions),
+    (9, "Таблица пакетов приложений app_packages", _app_packages),
+    (10, "Журнал скачиваний download_events по месяцам и агрегаты статистики", _download_events),
+    (11, "Колонка reports.duplicate_of для почти одинаковых отзывов", _report_duplicate_of),
+    (12, "Агрегаты статистики скачиваний по московским часам и суткам", _download_stats_moscow_buckets),
+    (13, "Издатели приложений apps.publisher_id и администраторы users.is_admin", _app_publishers),
+]
+
+# Версия схемы, которую ожидает текущий код
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_current_version(conn: Connection) -> int:
+    """Версия схемы, сохраненная в БД (0 – схема не версионирована)"""
+    try:
+        with conn.begin_nested():
+            version = conn.execute(text(f"SELECT MAX(version) FROM {SCHEMA_VERSION_TABLE}")).scalar()
+    except DBAPIError:
+        return 0
+    return version or 0
+
+
+def check_schema_version() -> Tuple[int, int]:
+    """Быстрая проверка при старте: (версия в БД, ожидаемая версия)"""
+    with engine.connect() as conn:
+        current = get_current_version(conn)
+    return current, SCHEMA_VERSION
+
+
+def upgrade(target: Optional[int] = None) -> int:
+    """Применение недостающих миграций, каждая – в своей транзакции"""
+    target = SCHEMA_VERSION if target is None else target
+    with engine.begin() as conn:
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {SCHEMA_VERSION_TABLE} ("
+            "version INTEGER PRIMARY KEY, "
+            "description VARCHAR(200) NOT NULL, "
+            "applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+        ))
+        current = get_current_version(conn)
+
+    for version, description, migration in MIGRATIONS:
+        if version <= current or version > target:
+            continue
+        with engine.begin() as conn:
+            migration(conn)
+            conn.execute(
+                text(f"INSERT INTO {SCHEMA_VERSION_TABLE} (version, description) VALUES (:version, :description)"),
+                {"version": version, "description": description},
+            )
+        print(f"✅ Миграция {version} применена: {description}")
+        current = version
+
+    return current
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Миграции схемы БД")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    upgrade_parser = subparsers.add_parser("upgrade", help="Применить недостающие миграции")
+    upgrade_parser.add_argument("--to", type=int, default=None, help="Целевая версия схемы")
+    subparsers.add_parser("current", help="Показать текущую версию схемы")
+    subparsers.add_parser("history", help="Показать список миграций")
+    args = parser.parse_args(argv)
+
+    if args.command == "upgrade":
+        version = upgrade(args.to)
+        print(f"📊 Версия схемы: {version}")
+    elif args.command == "current":
+        current, expected = check_schema_version()
+        print(f"📊 Версия схемы в БД: {current}, ожидаемая: {expected}")
+    elif args.command == "history":
+        for version, description, _ in MIGRATIONS:
+            print(f"  ├─ {version}: {description}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,21 @@
-from sqlalchemy import String, Float, Integer, JSON, ForeignKey, Table, Column
+from sqlalchemy import String, Float, Integer, BigInteger, Boolean, JSON, ForeignKey, Table, Column, Index, DateTime, Numeric, Identity, text
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from typing import List, Optional
 from datetime import datetime
-from database import Base, get_current_time
+from decimal import Decimal
+from database import Base, get_current_time, get_utc_time
+
+# Рейтинг приложения без оценок
+DEFAULT_APP_RATING = 5.0
 
 # Ассоциативная таблица для связи многие-ко-многим между User и App
 user_downloaded_apps = Table(
     'user_downloaded_apps',
     Base.metadata,
     Column('user_id', ForeignKey('users.id'), primary_key=True),
-    Column('app_id', ForeignKey('apps.id'), primary_key=True)
+    Column('app_id', ForeignKey('apps.id'), primary_key=True),
+    # Пользователи приложения и порционная очистка связей удаленного приложения
+    Index('ix_user_downloaded_apps_app_id', 'app_id', 'user_id')
 )
 
 class User(Base):
@@ -20,11 +26,18 @@ class User(Base):
     email: Mapped[str] = mapped_column(String(100), unique=True, index=True)
     name: Mapped[str] = mapped_column(String(50))
     password: Mapped[str] = mapped_column(String(100))  # Хеш пароля всегда фиксированной длины
+    # Устаревшее поле: баланс хранится в журнале balance_ledger (см. LedgerRepository)
     balance: Mapped[Optional[float]] = mapped_column(Float, default=0.0)
     created_at: Mapped[datetime] = mapped_column(default=get_current_time)
     updated_at: Mapped[datetime] = mapped_column(default=get_current_time)
     age: Mapped[int] = mapped_column(Integer, default=0)
     count_inputs: Mapped[int] = mapped_column(Integer, default=0)
+    # Администратор загружает пакеты любых приложений; назначается только в БД
+    is_admin: Mapped[bool] = mapped_column(Boolean, default=False, server_default=text("false"))
+    # Версия строки для оптимистичной блокировки (If-Match на PUT)
+    version: Mapped[int] = mapped_column(Integer, server_default=text("1"))
+    
+    __mapper_args__ = {"version_id_col": version}
     
     # Связь многие-ко-многим с приложениями через ассоциативную таблицу
     downloaded_apps: Mapped[List["App"]] = relationship(
@@ -39,11 +52,27 @@ class Category(Base):
     
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str] = mapped_column(String(50), unique=True, index=True)
+    version: Mapped[int] = mapped_column(Integer, server_default=text("1"))
+    
+    __mapper_args__ = {"version_id_col": version}
     
     apps: Mapped[List["App"]] = relationship("App", back_populates="category")
 
 class App(Base):
     __tablename__ = "apps"
+    __table_args__ = (
+        # Сортировки каталога: (сортировка, id) и (категория, сортировка, id),
+        # фильтры по цене/возрасту/рейтингу применяются при проходе по индексу
+        Index("ix_apps_downloads_id", "downloads", "id"),
+        Index("ix_apps_rating_id", "rating", "id"),
+        Index("ix_apps_price_id", "price", "id"),
+        Index("ix_apps_category_downloads", "category_id", "downloads", "id"),
+        Index("ix_apps_category_rating", "category_id", "rating", "id"),
+        Index("ix_apps_category_price", "category_id", "price", "id"),
+        Index("ix_apps_category_name", "category_id", "name"),
+        # Сброс издателя при удалении пользователя
+        Index("ix_apps_publisher_id", "publisher_id"),
+    )
     
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str] = mapped_column(String(20), unique=True, index=True)
@@ -52,10 +81,18 @@ class App(Base):
     full_descr: Mapped[str] = mapped_column(String(1000))
     price: Mapped[float] = mapped_column(Float, default=0)
     downloads: Mapped[int] = mapped_column(Integer, default=0)
-    rating: Mapped[float] = mapped_column(Float, default=5)
+    rating: Mapped[float] = mapped_column(Float, default=DEFAULT_APP_RATING)
     age_restriction: Mapped[int] = mapped_column(Integer, default=0)
+    # Мягкое удаление: приложение сразу скрыто, строки удаляет фоновая задача purge_deleted_apps
+    deleted_at: Mapped[Optional[datetime]] = mapped_column(nullable=True)
+    # Версия строки: меняется при правках приложения, но не от счетчиков скачиваний и рейтинга
+    version: Mapped[int] = mapped_column(Integer, server_default=text("1"))
+    
+    __mapper_args__ = {"version_id_col": version}
     
     category_id: Mapped[int] = mapped_column(ForeignKey("categories.id"))
+    # Издатель – пользователь, создавший приложение с токеном; только он (и администратор) загружает пакеты
+    publisher_id: Mapped[Optional[int]] = mapped_column(ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
     category: Mapped["Category"] = relationship("Category", back_populates="apps")
     
     # Связь многие-ко-многим с пользователями через ассоциативную таблицу
@@ -66,14 +103,143 @@ class App(Base):
     )
     reports: Mapped[List["Report"]] = relationship("Report", back_populates="app_rep")
 
+class AppPackage(Base):
+    """Загруженный пакет приложения: файл <PACKAGE_DIR>/<app_id>/<sha256> (см. packages.py)"""
+    __tablename__ = "app_packages"
+    
+    app_id: Mapped[int] = mapped_column(ForeignKey("apps.id", ondelete="CASCADE"), primary_key=True)
+    sha256: Mapped[str] = mapped_column(String(64))
+    size: Mapped[int] = mapped_column(BigInteger)
+    filename: Mapped[str] = mapped_column(String(200))
+    content_type: Mapped[str] = mapped_column(String(100))
+    uploaded_at: Mapped[datetime] = mapped_column(default=get_current_time)
+
 class Report(Base):
     __tablename__ = "reports"
+    __table_args__ = (
+        # Отзывы приложения по порядку: сводка, последние N и постраничная выдача
+        Index("ix_reports_app_id_id", "app_id", "id"),
+        # Удаление отзывов пользователя одним запросом
+        Index("ix_reports_user_id", "user_id"),
+    )
     
     id: Mapped[int] = mapped_column(primary_key=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
     app_id: Mapped[int] = mapped_column(ForeignKey("apps.id"))
     text: Mapped[str] = mapped_column(String(500))
     rating: Mapped[Optional[float]] = mapped_column(Float)
+    # Самый похожий ранее оставленный отзыв, если текст – почти копия (без внешнего ключа: отзывы удаляются)
+    duplicate_of: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
     
     app_rep: Mapped["App"] = relationship("App", back_populates="reports")
-    author: Mapped["User"] = relationship("User", back_populates="reports")
\ No newline at end of file
+    author: Mapped["User"] = relationship("User", back_populates="reports")
+
+class Job(Base):
+    __tablename__ = "jobs"
+    __table_args__ = (
+        # Выбор следующей задачи: статус -> приоритет -> время запуска
+        Index("ix_jobs_status_priority", "status", "priority", "run_after"),
+    )
+    
+    id: Mapped[int] = mapped_column(primary_key=True)
+    kind: Mapped[str] = mapped_column(String(50), index=True)
+    status: Mapped[str] = mapped_column(String(20), default="queued")  # queued / running / succeeded / failed
+    priority: Mapped[int] = mapped_column(Integer, default=0)  # больше – раньше
+    params: Mapped[Optional[dict]] = mapped_column(JSON, nullable=True)
+    result: Mapped[Optional[dict]] = mapped_column(JSON, nullable=True)
+    progress: Mapped[float] = mapped_column(Float, default=0)
+    message: Mapped[Optional[str]] = mapped_column(String(200), nullable=True)
+    error: Mapped[Optional[str]] = mapped_column(String(1000), nullable=True)
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    max_attempts: Mapped[int] = mapped_column(Integer, default=3)
+    run_after: Mapped[datetime] = mapped_column(DateTime, default=get_current_time)
+    created_at: Mapped[datetime] = mapped_column(default=get_current_time)
+    started_at: Mapped[Optional[datetime]] = mapped_column(nullable=True)
+    finished_at: Mapped[Optional[datetime]] = mapped_column(nullable=True)
+
+class BalanceEntry(Base):
+    """Запись журнала баланса: пополнение (+), покупка (-), возврат (+), корректировка"""
+    __tablename__ = "balance_ledger"
+    __table_args__ = (
+        # Хвост журнала пользователя после снимка
+        Index("ix_balance_ledger_user_id_id", "user_id", "id"),
+        # ON DELETE SET NULL при удалении приложения без полного прохода по журналу
+        Index("ix_balance_ledger_app_id", "app_id"),
+    )
+    
+    id: Mapped[int] = mapped_column(primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"))
+    amount: Mapped[Decimal] = mapped_column(Numeric(12, 2))
+    kind: Mapped[str] = mapped_column(String(20))  # opening / topup / purchase / refund / adjustment
+    app_id: Mapped[Optional[int]] = mapped_column(ForeignKey("apps.id", ondelete="SET NULL"), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(default=get_current_time)
+
+class BalanceSnapshot(Base):
+    """Сжатый баланс: сумма журнала до last_entry_id включительно"""
+    __tablename__ = "balance_snapshots"
+    
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    balance: Mapped[Decimal] = mapped_column(Numeric(14, 2), default=Decimal("0"))
+    last_entry_id: Mapped[int] = mapped_column(Integer, default=0)
+    updated_at: Mapped[datetime] = mapped_column(default=get_current_time)
+
+class DownloadEvent(Base):
+    """
+    Событие скачивания (amount = 0) или покупки приложения.
+    created_at – UTC без tzinfo: московское время с tzinfo psycopg2 передает как timestamptz,
+    и PostgreSQL молча переводит его в зону сеанса.
+    В PostgreSQL таблица секционирована по месяцам created_at (секции – migrations.ensure_download_partitions),
+    поэтому created_at входит в первичный ключ. Внешних ключей нет: история переживает удаление.
+    """
+    __tablename__ = "download_events"
+    __table_args__ = (
+        # Еще не свернутый хвост событий приложения при чтении статистики
+        Index("ix_download_events_app_id_id", "app_id", "id"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+    
+    id: Mapped[int] = mapped_column(BigInteger, Identity(), primary_key=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, primary_key=True, default=get_utc_time)
+    app_id: Mapped[int] = mapped_column(Integer)
+    user_id: Mapped[int] = mapped_column(Integer)
+    amount: Mapped[Decimal] = mapped_column(Numeric(12, 2), default=Decimal("0"))
+
+class DownloadStatsHourly(Base):
+    """Почасовой агрегат событий скачивания (сворачивается задачей rollup_downloads)"""
+    __tablename__ = "download_stats_hourly"
+    
+    app_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    bucket: Mapped[datetime] = mapped_column(DateTime, primary_key=True)
+    downloads: Mapped[int] = mapped_column(Integer, default=0)
+    purchases: Mapped[int] = mapped_column(Integer, default=0)
+    revenue: Mapped[Decimal] = mapped_column(Numeric(14, 2), default=Decimal("0"))
+
+class DownloadStatsDaily(Base):
+    """Посуточный агрегат событий скачивания"""
+    __tablename__ = "download_stats_daily"
+    
+    app_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    bucket: Mapped[datetime] = mapped_column(DateTime, primary_key=True)
+    downloads: Mapped[int] = mapped_column(Integer, default=0)
+    purchases: Mapped[int] = mapped_column(Integer, default=0)
+    revenue: Mapped[Decimal] = mapped_column(Numeric(14, 2), default=Decimal("0"))
+
+class DownloadRollupState(Base):
+    """Граница свертки: события с id <= last_event_id уже учтены в агрегатах"""
+    __tablename__ = "download_rollup_state"
+    
+    id: Mapped[int] = mapped_column(primary_key=True)
+    last_event_id: Mapped[int] = mapped_column(BigInteger, default=0)
+    updated_at: Mapped[datetime] = mapped_column(default=get_current_time)
+
+class RefreshToken(Base):
+    """Долгоживущий refresh-токен; хранится только SHA-256 хеш"""
+    __tablename__ = "refresh_tokens"
+    
+    id: Mapped[int] = mapped_column(primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), index=True)
+    token_hash: Mapped[str] = mapped_column(String(64), unique=True, index=True)
+    family_id: Mapped[str] = mapped_column(String(32), index=True)  # цепочка ротаций одного входа
+    expires_at: Mapped[datetime] = mapped_column(DateTime)
+    revoked_at: Mapped[Optional[datetime]] = mapped_column(nullable=True)
+    created_at: Mapped[datetime] = mapped_column(default=get_current_time)
\ No newline at end of file
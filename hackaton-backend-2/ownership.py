@@ -0,0 +1,142 @@
+"""
+Компактный индекс владения: какие приложения скачал пользователь.
+
+Для каждого пользователя хранится отсортированный массив id приложений
+(array('I'), 4 байта на приложение), проверка владения – бинарный поиск.
+Массив загружается одним запросом по первичному ключу user_downloaded_apps
+и дополняется на месте после покупки (UserRepository.checkout).
+
+Владение только растет, поэтому положительный ответ индекса надежен;
+отрицательный может устареть, если покупку провел другой процесс –
+для этого массивы перечитываются из БД не реже раза в MAX_AGE секунд.
+Индекс – кеш для чтения: от повторной покупки защищает не он, а
+первичный ключ user_downloaded_apps в транзакции списания.
+"""
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterable, Set
+
+from sqlalchemy import lambda_stmt, select
+
+from database import SessionLocal
+from models import user_downloaded_apps
+
+# Пользователей в индексе процесса (самые давние вытесняются)
+MAX_USERS = 200_000
+# Срок, после которого массив пользователя перечитывается из БД
+MAX_AGE = 5.0
+
+
+class OwnershipIndex:
+    """Отсортированные массивы id приложений по пользователям"""
+
+    def __init__(self, max_users: int = MAX_USERS, max_age: float = MAX_AGE):
+        self.max_users = max_users
+        self.max_age = max_age
+        self._apps: Dict[int, array] = {}
+        self._loaded_at: Dict[int, float] = {}
+        self._lock = threading.Lock()
+        self.loads = 0
+
+    def __len__(self) -> int:
+        return len(self._apps)
+
+    def _load(self, user_id: int) -> array:
+        with SessionLocal() as session:
+            app_ids = session.execute(lambda_stmt(
+                lambda: select(user_downloaded_apps.c.app_id)
+                .where(user_downloaded_apps.c.user_id == user_id)
+                .order_by(user_downloaded_apps.c.app_id)
+            )).scalars().all()
+        apps = array("I", app_ids)
+        with self._lock:
+            self._apps.pop(user_id, None)
+            if len(self._apps) >= self.max_users:
+                # dict хранит порядок вставки – первым идет самый давно загруженный
+                oldest = next(iter(self._apps))
+                del self._apps[oldest]
+                self._loaded_at.pop(oldest, None)
+            self._apps[user_id] = apps
+            self._loaded_at[user_id] = time.monotonic()
+            self.loads += 1
+        return apps
+
+    def apps_of(self, user_id: int) -> array:
+        """Отсортированный массив приложений пользователя"""
+        apps = self._apps.get(user_id)
+        loaded_at = self._loaded_at.get(user_id)
+        if apps is None or loaded_at is None or time.monotonic() - loaded_at >= self.max_age:
+            apps = self._load(user_id)
+        return apps
+
+    def owns(self, user_id: int, app_id: int, confirm: bool = False) -> bool:
+        """
+        Проверка владения за O(log n).
+        confirm=True – отрицательный ответ перепроверяется по БД (доступ к пакету приложения).
+        Перед списанием денег не используется: покупку проверяет транзакция checkout.
+        """
+        apps = self.apps_of(user_id)
+        position = bisect_left(apps, app_id)
+        if position < len(apps) and apps[position] == app_id:
+            return True
+        if confirm:
+            apps = self._load(user_id)
+            position = bisect_left(apps, app_id)
+            return position < len(apps) and apps[position] == app_id
+        return False
+
+    def owned_among(self, user_id: int, app_ids: Iterable[int]) -> Set[int]:
+        """Какие из app_ids принадлежат пользователю"""
+        apps = self.apps_of(user_id)
+        if not apps:
+            return set()
+        owned = set()
+        for app_id in app_ids:
+            position = bisect_left(apps, app_id)
+            if position < len(apps) and apps[position] == app_id:
+                owned.add(app_id)
+        return owned
+
+    def add(self, user_id: int, app_id: int):
+        """Учет новой покупки; если пользователь не загружен – прочитается при первом обращении"""
+        with self._lock:
+            apps = self._apps.get(user_id)
+            if apps is None:
+                return
+            position = bisect_left(apps, app_id)
+            if position == len(apps) or apps[position] != app_id:
+                apps.insert(position, app_id)
+
+    def forget(self, user_id: int):
+        with self._lock:
+            self._apps.pop(user_id, None)
+            self._loaded_at.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._apps.clear()
+            self._loaded_at.clear()
+
+    def memory_usage(self) -> dict:
+        """Занимаемая память (массивы и словари индекса) и оценка на миллион пользователей"""
+        with self._lock:
+            users = len(self._apps)
+            owned = sum(len(apps) for apps in self._apps.values())
+            total = sys.getsizeof(self._apps) + sys.getsizeof(self._loaded_at)
+            # ключи-int и float моменты загрузки тоже занимают память
+            total += sum(sys.getsizeof(apps) + sys.getsizeof(user_id) for user_id, apps in self._apps.items())
+            total += users * sys.getsizeof(0.0)
+        return {
+            "users": users,
+            "owned_apps": owned,
+            "bytes": total,
+            # пустые словари не зависят от числа пользователей – в пересчет не входят
+            "bytes_per_million_users": round((total - 2 * sys.getsizeof({})) / users * 1_000_000) if users else 0,
+        }
+
+
+# Индекс владения процесса
+ownership_index = OwnershipIndex()
@@ -0,0 +1,203 @@
+"""
+Хранилище пакетов приложений на локальном диске.
+
+Загрузка идет потоком: тело запроса пишется во временный файл порциями
+по CHUNK_SIZE, SHA-256 и размер считаются на лету – память не зависит
+от размера пакета. Готовый файл атомарно переименовывается в
+<PACKAGE_DIR>/<app_id>/<sha256>: читатели никогда не видят недописанный
+пакет, а ETag – это сама контрольная сумма.
+
+Отдача – FileResponse: Range/If-Range (докачка), HEAD и pathsend у серверов,
+которые его поддерживают. Если задан PACKAGE_ACCEL_PREFIX, файл отдает nginx
+(X-Accel-Redirect, sendfile без копирования через процесс), а приложение
+только проверяет права.
+"""
+import base64
+import hashlib
+import os
+import secrets
+from typing import AsyncIterator, NamedTuple, Optional
+from urllib.parse import quote
+
+from fastapi import Request, Response
+from fastapi.responses import FileResponse
+from starlette.concurrency import run_in_threadpool
+
+PACKAGE_DIR = os.environ.get(
+    "PACKAGE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "packages")
+)
+# Размер порции записи на диск (входящие куски тела накапливаются до него)
+CHUNK_SIZE = 1024 * 1024
+MAX_PACKAGE_SIZE = 4 * 1024 ** 3
+# Внутренний location nginx с тем же каталогом, например "/_packages/"
+PACKAGE_ACCEL_PREFIX = os.environ.get("PACKAGE_ACCEL_PREFIX")
+
+TEMP_PREFIX = ".upload-"
+
+
+class PackageTooLarge(ValueError):
+    def __init__(self, max_size: int):
+        super().__init__(f"Пакет больше {max_size} байт")
+        self.max_size = max_size
+
+
+class ChecksumMismatch(ValueError):
+    def __init__(self, expected: str, actual: str):
+        super().__init__(f"Контрольная сумма не совпала: ожидалась {expected}, получена {actual}")
+        self.expected = expected
+        self.actual = actual
+
+
+class StoredPackage(NamedTuple):
+    sha256: str
+    size: int
+    path: str
+
+
+def package_etag(sha256: str) -> str:
+    return f'"{sha256}"'
+
+
+def content_disposition(filename: str) -> str:
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
+def repr_digest(sha256: str) -> str:
+    """Заголовок Repr-Digest (RFC 9530): клиент может проверить скачанный файл"""
+    return "sha-256=:" + base64.b64encode(bytes.fromhex(sha256)).decode() + ":"
+
+
+class PackageStore:
+    """Файлы пакетов: потоковая запись с контрольной суммой и раздача с докачкой"""
+
+    def __init__(self, directory: str = PACKAGE_DIR):
+        self.directory = directory
+
+    def app_directory(self, app_id: int) -> str:
+        return os.path.join(self.directory, str(app_id))
+
+    def path_for(self, app_id: int, sha256: str) -> str:
+        return os.path.join(self.app_directory(app_id), sha256)
+
+    # ---------- загрузка ----------
+
+    async def save_stream(
+        self,
+        app_id: int,
+        chunks: AsyncIterator[bytes],
+        expected_sha256: Optional[str] = None,
+        max_size: int = MAX_PACKAGE_SIZE,
+    ) -> StoredPackage:
+        """
+        Запись пакета из потока кусков тела запроса.
+        Запись и хеширование идут в пуле потоков, чтобы не блокировать цикл событий.
+        """
+        directory = self.app_directory(app_id)
+        await run_in_threadpool(os.makedirs, directory, exist_ok=True)
+        temp_path = os.path.join(directory, f"{TEMP_PREFIX}{os.getpid()}-{secrets.token_hex(8)}")
+        digest = hashlib.sha256()
+        size = 0
+        pending, pending_size = [], 0
+        file = await run_in_threadpool(open, temp_path, "wb")
+        try:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > max_size:
+                    raise PackageTooLarge(max_size)
+                pending.append(chunk)
+                pending_size += len(chunk)
+                if pending_size >= CHUNK_SIZE:
+                    await run_in_threadpool(self._write, file, digest, b"".join(pending))
+                    pending, pending_size = [], 0
+            if pending:
+                await run_in_threadpool(self._write, file, digest, b"".join(pending))
+            await run_in_threadpool(self._close, file)
+        except BaseException:
+            # Обрыв соединения, превышение размера, ошибка диска – временный файл не остается
+            file.close()
+            self._discard(temp_path)
+            raise
+
+        sha256 = digest.hexdigest()
+        if expected_sha256 is not None and expected_sha256.lower() != sha256:
+            self._discard(temp_path)
+            raise ChecksumMismatch(expected_sha256.lower(), sha256)
+        path = self.path_for(app_id, sha256)
+        os.replace(temp_path, path)
+        return StoredPackage(sha256, size, path)
+
+    @staticmethod
+    def _write(file, digest, data: bytes):
+        digest.update(data)
+        file.write(data)
+
+    @staticmethod
+    def _close(file):
+        file.flush()
+        os.fsync(file.fileno())
+        file.close()
+
+    @staticmethod
+    def _discard(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def remove(self, app_id: int, sha256: Optional[str] = None):
+        """Удаление одного файла пакета или (sha256=None) всех файлов приложения"""
+        if sha256 is not None:
+            self._discard(self.path_for(app_id, sha256))
+            return
+        directory = self.app_directory(app_id)
+        if not os.path.isdir(directory):
+            return
+        for name in os.listdir(directory):
+            self._discard(os.path.join(directory, name))
+        try:
+            os.rmdir(directory)
+        except OSError:
+            pass
+
+    # ---------- раздача ----------
+
+    def respond(
+        self, request: Request, app_id: int, sha256: str, filename: str, content_type: str
+    ) -> Optional[Response]:
+        """Ответ с файлом пакета; None – файла на диске нет"""
+        headers = {
+            "ETag": package_etag(sha256),
+            "Repr-Digest": repr_digest(sha256),
+            # Содержимое по ETag неизменно: кешировать можно, но только клиенту (права проверяются)
+            "Cache-Control": "private, max-age=0, must-revalidate",
+        }
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None and package_etag(sha256) in (tag.strip() for tag in if_none_match.split(",")):
+            return Response(status_code=304, headers=headers)
+
+        path = self.path_for(app_id, sha256)
+        try:
+            stat_result = os.stat(path)
+        except OSError:
+            return None
+
+        if PACKAGE_ACCEL_PREFIX:
+            # Range, HEAD и sendfile выполняет nginx
+            return Response(
+                headers={
+                    **headers,
+                    "X-Accel-Redirect": f"{PACKAGE_ACCEL_PREFIX.rstrip('/')}/{app_id}/{sha256}",
+                    "Content-Type": content_type,
+                    "Content-Disposition": content_disposition(filename),
+                }
+            )
+        return FileResponse(
+            path, filename=filename, media_type=content_type, headers=headers, stat_result=stat_result
+        )
+
+
+# Хранилище пакетов процесса
+package_store = PackageStore()
@@ -0,0 +1,59 @@
+import threading
+from datetime import datetime
+from typing import Dict, Optional
+
+
+class Readiness:
+    """
+    Состояние готовности процесса принимать трафик.
+    Процесс готов, когда пройдены все шаги старта (проверка схемы,
+    прогрев пула, предзагрузка кешей) и он не находится в остановке.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._steps: Dict[str, bool] = {}
+        self._error: Optional[str] = None
+        self._draining = False
+        self.ready_since: Optional[datetime] = None
+
+    def reset(self, *steps: str):
+        with self._lock:
+            self._steps = {step: False for step in steps}
+            self._error = None
+            self._draining = False
+            self.ready_since = None
+
+    def complete(self, step: str):
+        with self._lock:
+            self._steps[step] = True
+            if all(self._steps.values()) and self._error is None:
+                self.ready_since = datetime.now()
+
+    def fail(self, step: str, error: str):
+        with self._lock:
+            self._steps[step] = False
+            self._error = f"{step}: {error}"
+            self.ready_since = None
+
+    def drain(self):
+        """Перевод в режим остановки: новые запросы балансировщик должен отправлять другим процессам"""
+        with self._lock:
+            self._draining = True
+
+    @property
+    def is_ready(self) -> bool:
+        return self.ready_since is not None and not self._draining
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "ready": self.ready_since is not None and not self._draining,
+                "draining": self._draining,
+                "steps": dict(self._steps),
+                "error": self._error,
+                "ready_since": self.ready_since.isoformat() if self.ready_since else None,
+            }
+
+
+readiness = Readiness()
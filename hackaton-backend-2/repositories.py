@@ -1,7 +1,145 @@
-from sqlalchemy import select
-from typing import List, Optional
-from database import SessionLocal, get_current_time
-from models import User, App, Report, Category, user_downloaded_apps
+from sqlalchemy import select, func, case, insert, update, delete, text, and_, bindparam, lambda_stmt, literal, union_all
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError
+from typing import Dict, Iterable, List, Optional, Tuple
+import secrets
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+from database import MOSCOW_TZ, SessionLocal, get_current_time, get_utc_time, moscow_to_utc
+from models import (
+    User, App, AppPackage, Report, Category, user_downloaded_apps, BalanceEntry, BalanceSnapshot, RefreshToken,
+    DownloadEvent, DownloadStatsHourly, DownloadStatsDaily, DownloadRollupState, DEFAULT_APP_RATING,
+)
+from security import REFRESH_TOKEN_EXPIRE_DAYS, create_refresh_token, hash_refresh_token, revoked_refresh_tokens
+from cache import bump_catalog_version, user_ages
+import events
+from events import broadcaster
+from suggest import suggest_index
+from trending import trending_index
+from duplicates import report_duplicates
+from ownership import ownership_index
+from packages import package_store
+
+# ========== ЗАПИСИ ТОЛЬКО ДЛЯ ЧТЕНИЯ ==========
+# Списки для ответов читаются кортежами колонок (Core) без ORM-объектов:
+# нет identity map, отслеживания изменений и ленивых загрузок.
+# Порядок полей в to_dict совпадает со схемами ответа, JSON получается тот же.
+
+class AppRecord:
+    __slots__ = ("id", "name", "url", "short_descr", "full_descr", "price", "age_restriction",
+                 "category_id", "downloads", "rating", "version", "downloaded_by_users")
+    
+    COLUMNS = (App.id, App.name, App.url, App.short_descr, App.full_descr, App.price, App.age_restriction,
+               App.category_id, App.downloads, App.rating, App.version)
+    
+    def __init__(self, row, downloaded_by_users: List[int]):
+        (self.id, self.name, self.url, self.short_descr, self.full_descr, self.price,
+         self.age_restriction, self.category_id, self.downloads, self.rating, self.version) = row
+        self.downloaded_by_users = downloaded_by_users
+    
+    def to_dict(self) -> dict:
+        """Поля в порядке AppResponse"""
+        return {
+            "name": self.name,
+            "url": self.url,
+            "short_descr": self.short_descr,
+            "full_descr": self.full_descr,
+            "price": self.price,
+            "age_restriction": self.age_restriction,
+            "category_id": self.category_id,
+            "id": self.id,
+            "downloads": self.downloads,
+            "rating": self.rating,
+            "downloaded_by_users": self.downloaded_by_users,
+            "version": self.version,
+        }
+
+class UserRecord:
+    __slots__ = ("id", "login", "email", "name", "age", "count_inputs", "created_at", "updated_at",
+                 "version", "balance", "downloaded_apps")
+    
+    COLUMNS = (User.id, User.login, User.email, User.name, User.age, User.count_inputs,
+               User.created_at, User.updated_at, User.version)
+    
+    def __init__(self, row, balance: Decimal, downloaded_apps: List[int]):
+        (self.id, self.login, self.email, self.name, self.age, self.count_inputs,
+         self.created_at, self.updated_at, self.version) = row
+        self.balance = balance
+        self.downloaded_apps = downloaded_apps
+    
+    def to_dict(self) -> dict:
+        """Поля в порядке UserResponse, значения – только JSON-типы"""
+        return {
+            "login": self.login,
+            "email": self.email,
+            "name": self.name,
+            "age": self.age,
+            "id": self.id,
+            "balance": float(self.balance),
+            "count_inputs": self.count_inputs,
+            "created_at": self.created_at.isoformat(),
+            "updated_at": self.updated_at.isoformat(),
+            "downloaded_apps": self.downloaded_apps,
+            "version": self.version,
+        }
+
+# ========== ОПТИМИСТИЧНАЯ БЛОКИРОВКА ==========
+# Правки пользователей, категорий и приложений сверяют версию строки (If-Match)
+# прямо в UPDATE: без SELECT перед записью, refresh после нее и блокировок.
+
+class VersionConflict(ValueError):
+    """Строку успели изменить: ожидаемая версия не совпала с текущей"""
+    
+    def __init__(self, current_version: int):
+        super().__init__("Запись изменена другим запросом – перечитайте ее и повторите правку")
+        self.current_version = current_version
+
+def editable_values(model, fields: dict) -> dict:
+    """Изменяемые колонки модели из полей запроса (id и версия не меняются напрямую)"""
+    return {
+        key: value for key, value in fields.items()
+        if key in model.__table__.c and key not in ("id", "version")
+    }
+
+def versioned_update(session, model, row_id: int, values: dict, columns,
+                     expected_version: Optional[int] = None, criteria: tuple = ()):
+    """
+    UPDATE ... SET ..., version = version + 1 WHERE id = :id [AND version = :expected]
+    RETURNING columns – правка и новое состояние строки одним запросом.
+    criteria – дополнительные условия видимости строки (например, не удалена).
+    None – строки нет; VersionConflict – версия не совпала. Коммит – на вызывающем.
+    """
+    stmt = (
+        update(model)
+        .where(model.id == row_id, *criteria)
+        .values(**values, version=model.version + 1)
+        .returning(*columns)
+        .execution_options(synchronize_session=False)
+    )
+    if expected_version is not None:
+        stmt = stmt.where(model.version == expected_version)
+    row = session.execute(stmt).first()
+    if row is None and expected_version is not None:
+        # Строки нет или версия другая – различаем отдельным запросом только в этом редком случае
+        current = session.execute(select(model.version).where(model.id == row_id, *criteria)).scalar()
+        session.rollback()
+        if current is not None:
+            raise VersionConflict(current)
+    return row
+
+class CheckoutError(ValueError):
+    """
+    Покупка набора приложений не выполнена; транзакция откачена целиком.
+    reason: not_found – нет пользователя или приложений, insufficient_funds, conflict
+    """
+    def __init__(self, reason: str, message: str, app_ids: Optional[List[int]] = None,
+                 required: Optional[Decimal] = None, balance: Optional[Decimal] = None):
+        super().__init__(message)
+        self.reason = reason
+        self.app_ids = app_ids
+        self.required = required
+        self.balance = balance
 
 class UserRepository:
     def __init__(self, session=None):
@@ -26,45 +164,195 @@ class UserRepository:
         result = self.session.execute(stmt)
         return list(result.scalars().all())
     
-    def update_user(self, user_id: int, **kwargs) -> Optional[User]:
-        """Обновление данных пользователя"""
-        user = self.get_user_by_id(user_id)
-        if user:
-            for key, value in kwargs.items():
-                if hasattr(user, key):
-                    setattr(user, key, value)
-            user.updated_at = get_current_time()
-            self.session.commit()
-            self.session.refresh(user)
+    def get_all_user_records(self) -> List[UserRecord]:
+        """Все пользователи для ответа списком: три запроса независимо от числа пользователей"""
+        libraries: Dict[int, List[int]] = {}
+        for user_id, app_id in self.session.execute(
+            select(user_downloaded_apps.c.user_id, user_downloaded_apps.c.app_id)
+            .order_by(user_downloaded_apps.c.user_id, user_downloaded_apps.c.app_id)
+        ):
+            libraries.setdefault(user_id, []).append(app_id)
+        balances = LedgerRepository(self.session).get_all_balances()
+        rows = self.session.execute(select(*UserRecord.COLUMNS).order_by(User.created_at))
+        zero = Decimal("0.00")
+        return [UserRecord(row, balances.get(row[0], zero), libraries.get(row[0], [])) for row in rows]
+    
+    def update_user(self, user_id: int, expected_version: Optional[int] = None, **kwargs) -> Optional[UserRecord]:
+        """
+        Обновление данных пользователя одним UPDATE ... RETURNING.
+        expected_version – версия из If-Match; при несовпадении VersionConflict.
+        """
+        # Баланс не пишется в строку пользователя – разница уходит в журнал корректировкой
+        balance = kwargs.pop("balance", None)
+        values = editable_values(User, kwargs)
+        values["updated_at"] = get_current_time()
+        row = versioned_update(self.session, User, user_id, values, UserRecord.COLUMNS, expected_version)
+        if row is None:
+            return None
+        ledger = LedgerRepository(self.session)
+        if balance is not None:
+            ledger.lock_balance(user_id)
+            difference = to_money(balance) - ledger.get_balance(user_id)
+            if difference:
+                ledger.post_entry(user_id, difference, "adjustment", commit=False)
+        user = UserRecord(row, ledger.get_balance(user_id), self.get_downloaded_app_ids(user_id))
+        self.session.commit()
+        user_ages.invalidate(user_id)
         return user
     
+    def increment_count_inputs(self, user_id: int):
+        """Атомарное увеличение счетчика входов (версию строки не меняет)"""
+        self.session.execute(
+            update(User).where(User.id == user_id).values(count_inputs=User.count_inputs + 1)
+            .execution_options(synchronize_session=False)
+        )
+        self.session.commit()
+    
+    def get_downloaded_app_ids(self, user_id: int) -> List[int]:
+        """ID скачанных приложений пользователя по первичному ключу связей"""
+        return list(self.session.execute(lambda_stmt(
+            lambda: select(user_downloaded_apps.c.app_id)
+            .where(user_downloaded_apps.c.user_id == user_id)
+            .order_by(user_downloaded_apps.c.app_id)
+        )).scalars())
+    
     def delete_user(self, user_id: int) -> bool:
-        """Удаление пользователя"""
-        user = self.get_user_by_id(user_id)
-        if user:
-            self.session.delete(user)
-            self.session.commit()
-            return True
-        return False
+        """
+        Удаление пользователя набором запросов без загрузки связанных строк:
+        библиотека и отзывы удаляются по индексам, журнал баланса, снимки
+        и refresh-токены – каскадом внешних ключей, издатель приложений сбрасывается в NULL. Рейтинги приложений,
+        у которых удалены отзывы, пересчитываются в той же транзакции.
+        """
+        reviewed_app_ids = self.session.execute(
+            select(Report.app_id).where(Report.user_id == user_id, Report.rating.is_not(None)).distinct()
+        ).scalars().all()
+        self.session.execute(delete(user_downloaded_apps).where(user_downloaded_apps.c.user_id == user_id))
+        report_ids = self.session.execute(delete(Report).where(Report.user_id == user_id).returning(Report.id)).scalars().all()
+        result = self.session.execute(delete(User).where(User.id == user_id))
+        if result.rowcount == 0:
+            self.session.rollback()
+            return False
+        
+        if reviewed_app_ids:
+            averages = dict(self.session.execute(
+                select(Report.app_id, func.avg(Report.rating))
+                .where(Report.app_id.in_(reviewed_app_ids), Report.rating.is_not(None))
+                .group_by(Report.app_id)
+            ).all())
+            for app_id in reviewed_app_ids:
+                # Приложение, у которого не осталось оценок, возвращается к рейтингу по умолчанию
+                rating = round(float(averages[app_id]), 2) if app_id in averages else DEFAULT_APP_RATING
+                self.session.execute(update(App).where(App.id == app_id).values(rating=rating))
+        self.session.commit()
+        # Удаленные строки могли остаться в identity map сессии
+        self.session.expire_all()
+        ownership_index.forget(user_id)
+        user_ages.invalidate(user_id)
+        report_duplicates.remove(report_ids)
+        if reviewed_app_ids:
+            bump_catalog_version()
+        return True
     
     def add_downloaded_app(self, user_id: int, app_id: int) -> bool:
-        """Добавление приложения в список скачанных пользователем"""
-        user = self.get_user_by_id(user_id)
-        app = self.session.get(App, app_id)
+        """
+        Добавление приложения в список скачанных пользователем.
+        Связь вставляется только вместе со списанием (checkout): True – приложение добавлено,
+        False – уже скачано, не найдено или не хватает средств
+        """
+        try:
+            return bool(self.checkout(user_id, [app_id])["purchased"])
+        except CheckoutError:
+            return False
+    
+    def checkout(self, user_id: int, app_ids: Iterable[int]) -> dict:
+        """
+        Покупка нескольких приложений одной транзакцией (все или ничего):
+        проверка приложений и владения, одна проверка баланса на всю сумму
+        под блокировкой баланса, записи журнала, счетчики скачиваний одним
+        UPDATE, связи и события статистики пакетными вставками.
+        Уже купленные приложения пропускаются без списания.
+        """
+        app_ids = sorted(set(app_ids))
+        ledger = LedgerRepository(self.session)
+        try:
+            if self.session.get(User, user_id) is None:
+                raise CheckoutError("not_found", "Пользователь не найден")
+            # Параллельные покупки пользователя выполняются по очереди
+            ledger.lock_balance(user_id)
+            prices = dict(self.session.execute(
+                select(App.id, App.price).where(App.id.in_(app_ids), App.deleted_at.is_(None))
+            ).all())
+            missing = [app_id for app_id in app_ids if app_id not in prices]
+            if missing:
+                raise CheckoutError("not_found", "Приложения не найдены", app_ids=missing)
+            owned = set(self.session.execute(
+                select(user_downloaded_apps.c.app_id)
+                .where(user_downloaded_apps.c.user_id == user_id, user_downloaded_apps.c.app_id.in_(app_ids))
+            ).scalars())
+            new_ids = [app_id for app_id in app_ids if app_id not in owned]
+            total = to_money(sum((to_money(prices[app_id]) for app_id in new_ids), Decimal("0")))
+            balance = ledger.get_balance(user_id)
+            if balance < total:
+                raise CheckoutError("insufficient_funds", "Недостаточно средств", required=total, balance=balance)
+            if not new_ids:
+                self.session.rollback()
+                return {"purchased": [], "already_owned": app_ids, "total": total, "balance": balance}
+            
+            paid = [app_id for app_id in new_ids if to_money(prices[app_id]) > 0]
+            if paid:
+                self.session.execute(insert(BalanceEntry), [
+                    {"user_id": user_id, "amount": -to_money(prices[app_id]), "kind": "purchase", "app_id": app_id}
+                    for app_id in paid
+                ])
+            downloads = self.session.execute(
+                update(App).where(App.id.in_(new_ids)).values(downloads=App.downloads + 1)
+                .returning(App.id, App.category_id, App.downloads)
+                .execution_options(synchronize_session=False)
+            ).all()
+            # Первичный ключ (user_id, app_id) отсекает покупку, параллельную одиночному скачиванию
+            self.session.execute(insert(user_downloaded_apps), [
+                {"user_id": user_id, "app_id": app_id} for app_id in new_ids
+            ])
+            self.session.execute(insert(DownloadEvent), [
+                {"app_id": app_id, "user_id": user_id, "amount": to_money(prices[app_id]), "created_at": get_utc_time()}
+                for app_id in new_ids
+            ])
+            self.session.execute(
+                update(User).where(User.id == user_id).values(count_inputs=User.count_inputs + len(new_ids))
+                .execution_options(synchronize_session=False)
+            )
+            self.session.commit()
+        except IntegrityError:
+            self.session.rollback()
+            raise CheckoutError("conflict", "Приложения уже покупаются другим запросом – повторите покупку")
+        except CheckoutError:
+            self.session.rollback()
+            raise
         
-        if user and app:
-            if app not in user.downloaded_apps:
-                user.downloaded_apps.append(app)
-                self.session.commit()
-                return True
-        return False
+        for app_id, category_id, app_downloads in downloads:
+            ownership_index.add(user_id, app_id)
+            suggest_index.set_downloads(app_id, app_downloads)
+            trending_index.record_download(app_id, category_id)
+            broadcaster.publish(events.APP_DOWNLOADED, app_id, category_id, user_id=user_id, downloads=app_downloads)
+        if downloads:
+            # Покупка меняет только счетчики скачиваний и списки покупателей
+            bump_catalog_version(counters_only=True)
+        return {
+            "purchased": new_ids,
+            "already_owned": sorted(owned),
+            "total": total,
+            "balance": to_money(balance - total),
+        }
     
     def get_downloaded_apps(self, user_id: int) -> List[App]:
         """Получение списка скачанных приложений пользователя"""
-        user = self.get_user_by_id(user_id)
-        if user:
-            return user.downloaded_apps
-        return []
+        stmt = lambda_stmt(
+            lambda: select(App)
+            .join(user_downloaded_apps, user_downloaded_apps.c.app_id == App.id)
+            .where(user_downloaded_apps.c.user_id == user_id, App.deleted_at.is_(None))
+            .order_by(App.id)
+        )
+        return list(self.session.execute(stmt).scalars().all())
     
     def close(self):
         """Закрытие сессии"""
@@ -79,15 +367,23 @@ class UserRepository:
         
     def get_user_by_login(self, login: str) -> Optional[User]:
         """Получение пользователя по логину"""
-        stmt = select(User).where(User.login == login)
+        stmt = lambda_stmt(lambda: select(User).where(User.login == login))
         result = self.session.execute(stmt)
         return result.scalar_one_or_none()
 
     def get_user_by_email(self, email: str) -> Optional[User]:
         """Получение пользователя по email"""
-        stmt = select(User).where(User.email == email)
+        stmt = lambda_stmt(lambda: select(User).where(User.email == email))
         result = self.session.execute(stmt)
         return result.scalar_one_or_none()
+    
+    def get_balance(self, user_id: int) -> Decimal:
+        """Текущий баланс пользователя из журнала"""
+        return LedgerRepository(self.session).get_balance(user_id)
+    
+    def get_balances(self, user_ids: Iterable[int]) -> Dict[int, Decimal]:
+        """Балансы нескольких пользователей"""
+        return LedgerRepository(self.session).get_balances(user_ids)
 
 class CategoryRepository:
     def __init__(self, session=None):
@@ -100,6 +396,7 @@ class CategoryRepository:
         self.session.add(category)
         self.session.commit()
         self.session.refresh(category)
+        bump_catalog_version()
         return category
     
     def get_category_by_id(self, category_id: int) -> Optional[Category]:
@@ -112,25 +409,67 @@ class CategoryRepository:
         result = self.session.execute(stmt)
         return list(result.scalars().all())
     
-    def update_category(self, category_id: int, **kwargs) -> Optional[Category]:
-        """Обновление данных категории"""
-        category = self.get_category_by_id(category_id)
-        if category:
-            for key, value in kwargs.items():
-                if hasattr(category, key):
-                    setattr(category, key, value)
-            self.session.commit()
-            self.session.refresh(category)
-        return category
+    def get_category_stats(self, max_age: Optional[int] = None) -> List[dict]:
+        """
+        Категории с агрегатами по приложениям одним запросом GROUP BY:
+        количество приложений, сумма скачиваний и средний рейтинг.
+        max_age – учитывать только приложения, разрешенные для этого возраста.
+        """
+        join_condition = and_(App.category_id == Category.id, App.deleted_at.is_(None))
+        if max_age is not None:
+            join_condition = and_(join_condition, App.age_restriction <= max_age)
+        stmt = (
+            select(
+                Category.id,
+                Category.name,
+                Category.version,
+                func.count(App.id),
+                func.coalesce(func.sum(App.downloads), 0),
+                func.avg(App.rating),
+            )
+            .outerjoin(App, join_condition)
+            .group_by(Category.id, Category.name, Category.version)
+            .order_by(Category.name)
+        )
+        return [
+            {
+                "id": category_id,
+                "name": name,
+                "version": version,
+                "apps_count": apps_count,
+                "total_downloads": int(total_downloads),
+                "avg_rating": round(float(avg_rating), 2) if avg_rating is not None else None,
+            }
+            for category_id, name, version, apps_count, total_downloads, avg_rating in self.session.execute(stmt).all()
+        ]
+    
+    def update_category(self, category_id: int, expected_version: Optional[int] = None, **kwargs) -> Optional[dict]:
+        """Обновление данных категории (UPDATE ... RETURNING; VersionConflict – версия не совпала)"""
+        row = versioned_update(
+            self.session, Category, category_id, editable_values(Category, kwargs),
+            (Category.id, Category.name, Category.version), expected_version,
+        )
+        if row is None:
+            return None
+        self.session.commit()
+        bump_catalog_version()
+        return {"id": row.id, "name": row.name, "version": row.version}
     
     def delete_category(self, category_id: int) -> bool:
-        """Удаление категории"""
-        category = self.get_category_by_id(category_id)
-        if category:
-            self.session.delete(category)
-            self.session.commit()
-            return True
-        return False
+        """
+        Удаление пустой категории.
+        Категорию с приложениями (в том числе еще не очищенными после удаления) удалить нельзя – ValueError.
+        """
+        has_apps = self.session.execute(select(App.id).where(App.category_id == category_id).limit(1)).first()
+        if has_apps:
+            raise ValueError("В категории есть приложения")
+        result = self.session.execute(delete(Category).where(Category.id == category_id))
+        self.session.commit()
+        if result.rowcount == 0:
+            return False
+        self.session.expire_all()
+        bump_catalog_version()
+        return True
     
     def close(self):
         """Закрытие сессии"""
@@ -143,12 +482,67 @@ class CategoryRepository:
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.close()
 
+# Поля сортировки каталога
+APP_SORT_COLUMNS = {
+    "name": App.name,
+    "downloads": App.downloads,
+    "rating": App.rating,
+    "price": App.price,
+}
+
+# Ценовые диапазоны фасетов: (метка, от включительно, до не включительно)
+PRICE_BUCKETS = (
+    ("free", 0, 0),
+    ("0-100", 0, 100),
+    ("100-500", 100, 500),
+    ("500-1000", 500, 1000),
+    ("1000+", 1000, None),
+)
+
+def price_bucket_expression():
+    """SQL-выражение метки ценового диапазона"""
+    whens = [(App.price <= 0, "free")]
+    for label, low, high in PRICE_BUCKETS[1:]:
+        if high is not None:
+            whens.append((App.price < high, label))
+    return case(*whens, else_=PRICE_BUCKETS[-1][0])
+
+def apply_app_filters(
+    stmt,
+    category_id: Optional[int] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    free: Optional[bool] = None,
+    max_age: Optional[int] = None,
+    min_rating: Optional[float] = None,
+):
+    """Фильтры каталога приложений (удаленные приложения не показываются никогда)"""
+    stmt = stmt.where(App.deleted_at.is_(None))
+    if category_id is not None:
+        stmt = stmt.where(App.category_id == category_id)
+    if min_price is not None:
+        stmt = stmt.where(App.price >= min_price)
+    if max_price is not None:
+        stmt = stmt.where(App.price <= max_price)
+    if free is True:
+        stmt = stmt.where(App.price <= 0)
+    elif free is False:
+        stmt = stmt.where(App.price > 0)
+    if max_age is not None:
+        stmt = stmt.where(App.age_restriction <= max_age)
+    if min_rating is not None:
+        stmt = stmt.where(App.rating >= min_rating)
+    return stmt
+
+# Строк за одну транзакцию при очистке удаленных приложений
+PURGE_BATCH_SIZE = 5000
+
 class AppsRepository:
     def __init__(self, session=None):
         self.session = session or SessionLocal()
         self._is_external_session = session is not None
     
-    def create_app(self, name: str, price: float, url: str, short_descr: str, full_descr: str, category_id: int, age_restriction: int = 0) -> App:
+    def create_app(self, name: str, price: float, url: str, short_descr: str, full_descr: str, category_id: int, age_restriction: int = 0, publisher_id: Optional[int] = None) -> App:
         """Создание нового приложения"""
         app = App(
             name=name, 
@@ -157,49 +551,267 @@ class AppsRepository:
             price=price, 
             full_descr=full_descr, 
             category_id=category_id,
-            age_restriction=age_restriction
+            age_restriction=age_restriction,
+            publisher_id=publisher_id
         )
         self.session.add(app)
         self.session.commit()
         self.session.refresh(app)
+        bump_catalog_version()
+        suggest_index.upsert(app.id, app.name, app.downloads, app.age_restriction)
+        trending_index.upsert(app.id, app.category_id, app.age_restriction)
+        broadcaster.publish(events.APP_CREATED, app.id, app.category_id, name=app.name, price=app.price)
         return app
     
     def get_app_by_id(self, app_id: int) -> Optional[App]:
-        """Получение приложения по ID"""
-        return self.session.get(App, app_id)
+        """Получение приложения по ID (удаленные не возвращаются)"""
+        app = self.session.get(App, app_id)
+        return app if app is not None and app.deleted_at is None else None
     
     def get_all_apps(self) -> List[App]:
         """Получение всех приложений"""
-        stmt = select(App).order_by(App.name)
+        stmt = select(App).where(App.deleted_at.is_(None)).order_by(App.name)
+        result = self.session.execute(stmt)
+        return list(result.scalars().all())
+    
+    def get_all_app_records(self) -> List[AppRecord]:
+        """Все приложения каталога (по названию) для ответа списком: два запроса вместо 1 + N"""
+        downloaders = self.get_downloaders_by_app()
+        rows = self.session.execute(
+            select(*AppRecord.COLUMNS).where(App.deleted_at.is_(None)).order_by(App.name)
+        )
+        return [AppRecord(row, downloaders.get(row[0], [])) for row in rows]
+    
+    def search_apps(
+        self,
+        sort: str = "name",
+        descending: bool = False,
+        limit: Optional[int] = None,
+        offset: int = 0,
+        **filters,
+    ) -> List[App]:
+        """Поиск приложений по фильтрам каталога с сортировкой"""
+        column = APP_SORT_COLUMNS[sort]
+        order = column.desc() if descending else column.asc()
+        tiebreak = App.id.desc() if descending else App.id.asc()
+        stmt = apply_app_filters(select(App), **filters).order_by(order, tiebreak)
+        if offset:
+            stmt = stmt.offset(offset)
+        if limit is not None:
+            stmt = stmt.limit(limit)
         result = self.session.execute(stmt)
         return list(result.scalars().all())
     
+    def count_apps(self, **filters) -> int:
+        """Количество приложений, подходящих под фильтры"""
+        stmt = apply_app_filters(select(func.count(App.id)), **filters)
+        return self.session.execute(stmt).scalar() or 0
+    
+    def get_app_facets(self, **filters) -> dict:
+        """
+        Фасеты каталога: количество приложений по категориям и ценовым диапазонам.
+        Каждый фасет считается без собственного фильтра, чтобы показывать альтернативы.
+        """
+        category_filters = {key: value for key, value in filters.items() if key != "category_id"}
+        categories = self.session.execute(
+            apply_app_filters(select(App.category_id, func.count(App.id)), **category_filters)
+            .group_by(App.category_id)
+            .order_by(App.category_id)
+        ).all()
+        
+        bucket = price_bucket_expression()
+        price_filters = {key: value for key, value in filters.items() if key not in ("min_price", "max_price", "free")}
+        buckets = dict(self.session.execute(
+            apply_app_filters(select(bucket, func.count(App.id)), **price_filters).group_by(bucket)
+        ).all())
+        
+        return {
+            "categories": [{"category_id": category_id, "count": count} for category_id, count in categories],
+            "price_buckets": [
+                {"bucket": label, "min_price": low, "max_price": high, "count": buckets.get(label, 0)}
+                for label, low, high in PRICE_BUCKETS
+            ],
+        }
+    
+    def get_age_restrictions(self) -> List[int]:
+        """Различные возрастные ограничения в каталоге"""
+        stmt = (
+            select(App.age_restriction)
+            .where(App.deleted_at.is_(None))
+            .distinct()
+            .order_by(App.age_restriction)
+        )
+        return list(self.session.execute(stmt).scalars().all())
+    
     def get_apps_by_category(self, category_id: int) -> List[App]:
         """Получение приложений по категории"""
-        stmt = select(App).where(App.category_id == category_id).order_by(App.name)
+        stmt = select(App).where(App.category_id == category_id, App.deleted_at.is_(None)).order_by(App.name)
         result = self.session.execute(stmt)
         return list(result.scalars().all())
     
-    def update_app(self, app_id: int, **kwargs) -> Optional[App]:
-        """Обновление данных приложения"""
-        app = self.get_app_by_id(app_id)
-        if app:
-            for key, value in kwargs.items():
-                if hasattr(app, key):
-                    setattr(app, key, value)
-            self.session.commit()
-            self.session.refresh(app)
+    def update_app(self, app_id: int, expected_version: Optional[int] = None, **kwargs) -> Optional[AppRecord]:
+        """
+        Обновление данных приложения одним UPDATE ... RETURNING (удаленные не меняются).
+        expected_version – версия из If-Match; при несовпадении VersionConflict.
+        """
+        row = versioned_update(
+            self.session, App, app_id, editable_values(App, kwargs), AppRecord.COLUMNS,
+            expected_version, criteria=(App.deleted_at.is_(None),),
+        )
+        if row is None:
+            return None
+        app = AppRecord(row, self.get_downloaded_user_ids(app_id))
+        self.session.commit()
+        bump_catalog_version()
+        suggest_index.upsert(app.id, app.name, app.downloads, app.age_restriction)
+        trending_index.upsert(app.id, app.category_id, app.age_restriction)
+        broadcaster.publish(
+            events.APP_UPDATED, app.id, app.category_id,
+            fields=sorted(kwargs), downloads=app.downloads, rating=app.rating, price=app.price
+        )
         return app
     
+    def increment_downloads(self, app_id: int):
+        """Атомарное увеличение счетчика скачиваний (версию строки не меняет – это не правка приложения)"""
+        self.session.execute(
+            update(App).where(App.id == app_id).values(downloads=App.downloads + 1)
+            .execution_options(synchronize_session=False)
+        )
+        self.session.commit()
+    
+    def get_package(self, app_id: int) -> Optional[AppPackage]:
+        """Загруженный пакет приложения (у удаленных приложений пакет не отдается)"""
+        return self.session.execute(lambda_stmt(
+            lambda: select(AppPackage)
+            .join(App, App.id == AppPackage.app_id)
+            .where(AppPackage.app_id == app_id, App.deleted_at.is_(None))
+        )).scalar_one_or_none()
+    
+    def publish_package(self, app_id: int, sha256: str, size: int, filename: str,
+                        content_type: str) -> Tuple[Optional[AppPackage], Optional[str]]:
+        """
+        Привязка загруженного файла к приложению под блокировкой строки приложения –
+        одновременные загрузки применяются по очереди.
+        Возвращает (пакет, sha256 замененного файла); (None, None) – приложения нет.
+        """
+        found = self.session.execute(
+            select(App.id).where(App.id == app_id, App.deleted_at.is_(None)).with_for_update()
+        ).scalar()
+        if found is None:
+            self.session.rollback()
+            return None, None
+        previous = self.session.execute(select(AppPackage.sha256).where(AppPackage.app_id == app_id)).scalar()
+        values = dict(sha256=sha256, size=size, filename=filename, content_type=content_type,
+                      uploaded_at=get_current_time())
+        if previous is None:
+            self.session.execute(insert(AppPackage).values(app_id=app_id, **values))
+        else:
+            self.session.execute(update(AppPackage).where(AppPackage.app_id == app_id).values(**values))
+        self.session.commit()
+        return self.session.get(AppPackage, app_id), previous
+    
+    def get_downloaded_user_ids(self, app_id: int) -> List[int]:
+        """ID пользователей, скачавших приложение (индекс ix_user_downloaded_apps_app_id)"""
+        return list(self.session.execute(lambda_stmt(
+            lambda: select(user_downloaded_apps.c.user_id)
+            .where(user_downloaded_apps.c.app_id == app_id)
+            .order_by(user_downloaded_apps.c.user_id)
+        )).scalars())
+    
     def delete_app(self, app_id: int) -> bool:
-        """Удаление приложения"""
+        """
+        Удаление приложения: оно сразу скрывается из каталога (deleted_at),
+        а связи со скачавшими, отзывы и сама строка удаляются порциями в purge_deleted
+        (фоновая задача purge_deleted_apps) – время ответа не зависит от числа скачиваний.
+        Название и URL освобождаются после очистки.
+        """
         app = self.get_app_by_id(app_id)
         if app:
-            self.session.delete(app)
+            category_id = app.category_id
+            self.session.execute(
+                update(App).where(App.id == app_id, App.deleted_at.is_(None)).values(deleted_at=get_current_time())
+            )
             self.session.commit()
+            bump_catalog_version()
+            suggest_index.remove(app_id)
+            trending_index.remove(app_id)
+            broadcaster.publish(events.APP_DELETED, app_id, category_id)
             return True
         return False
     
+    def purge_deleted(self, batch_size: int = PURGE_BATCH_SIZE) -> int:
+        """
+        Шаг очистки удаленных приложений – короткая транзакция с ограниченным числом строк:
+        порция связей со скачавшими, затем порция отзывов, затем строка приложения.
+        Возвращает число удаленных строк; 0 – очищать больше нечего.
+        """
+        app_id = self.session.execute(
+            select(App.id).where(App.deleted_at.is_not(None)).order_by(App.id).limit(1)
+        ).scalar()
+        if app_id is None:
+            return 0
+        
+        user_ids = self.session.execute(
+            select(user_downloaded_apps.c.user_id).where(user_downloaded_apps.c.app_id == app_id).limit(batch_size)
+        ).scalars().all()
+        if user_ids:
+            self.session.execute(
+                delete(user_downloaded_apps)
+                .where(user_downloaded_apps.c.app_id == app_id, user_downloaded_apps.c.user_id.in_(user_ids))
+            )
+            self.session.commit()
+            return len(user_ids)
+        
+        report_ids = self.session.execute(
+            select(Report.id).where(Report.app_id == app_id).order_by(Report.id).limit(batch_size)
+        ).scalars().all()
+        if report_ids:
+            self.session.execute(delete(Report).where(Report.id.in_(report_ids)))
+            self.session.commit()
+            report_duplicates.remove(report_ids)
+            return len(report_ids)
+        
+        # Записи журнала баланса сохраняются: app_id обнуляется внешним ключом (ON DELETE SET NULL)
+        self.session.execute(delete(AppPackage).where(AppPackage.app_id == app_id))
+        self.session.execute(delete(App).where(App.id == app_id))
+        self.session.commit()
+        package_store.remove(app_id)
+        return 1
+    
+    def count_pending_purge(self) -> int:
+        """Сколько строк осталось удалить после мягкого удаления приложений"""
+        deleted_ids = select(App.id).where(App.deleted_at.is_not(None))
+        links = self.session.execute(
+            select(func.count()).select_from(user_downloaded_apps).where(user_downloaded_apps.c.app_id.in_(deleted_ids))
+        ).scalar() or 0
+        reports = self.session.execute(
+            select(func.count(Report.id)).where(Report.app_id.in_(deleted_ids))
+        ).scalar() or 0
+        apps = self.session.execute(select(func.count()).select_from(deleted_ids.subquery())).scalar() or 0
+        return links + reports + apps
+    
+    def get_app_cards(self, app_ids: Iterable[int]) -> Dict[int, dict]:
+        """Краткие карточки приложений по ID одним запросом (удаленные пропускаются)"""
+        app_ids = list(app_ids)
+        if not app_ids:
+            return {}
+        rows = self.session.execute(
+            select(App.id, App.name, App.category_id, App.price, App.rating, App.downloads)
+            .where(App.id.in_(app_ids), App.deleted_at.is_(None))
+        )
+        return {row.id: row._asdict() for row in rows}
+    
+    def get_downloaders_by_app(self) -> Dict[int, List[int]]:
+        """ID скачавших пользователей по всем приложениям одним запросом (для массового рендера каталога)"""
+        result: Dict[int, List[int]] = {}
+        rows = self.session.execute(
+            select(user_downloaded_apps.c.app_id, user_downloaded_apps.c.user_id)
+            .order_by(user_downloaded_apps.c.app_id, user_downloaded_apps.c.user_id)
+        )
+        for app_id, user_id in rows:
+            result.setdefault(app_id, []).append(user_id)
+        return result
+    
     def get_users_downloaded_app(self, app_id: int) -> List[User]:
         """Получение пользователей, скачавших приложение"""
         app = self.get_app_by_id(app_id)
@@ -218,19 +830,65 @@ class AppsRepository:
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.close()
 
+# Шкала звезд для гистограммы отзывов
+REPORT_STARS = (0, 1, 2, 3, 4, 5)
+
+def _report_summary_stmt():
+    # Оценки округляются до целых звезд 0..5; все агрегаты считаются одним запросом
+    stars = func.round(Report.rating)
+    return select(
+        func.count(Report.id),
+        func.count(Report.rating),
+        func.avg(Report.rating),
+        *[func.sum(case((stars == star, 1), else_=0)) for star in REPORT_STARS],
+    ).where(Report.app_id == bindparam("app_id"))
+
+# Готовый параметризованный запрос: строится один раз, ключ кеша компиляции запоминается
+REPORT_SUMMARY_STMT = _report_summary_stmt()
+
+class DuplicateReport(ValueError):
+    """Отзыв почти повторяет уже оставленные (спам-кампания)"""
+    def __init__(self, similar_in_app: int, similar_total: int, duplicate_of: Optional[int]):
+        super().__init__(
+            f"Отзыв почти совпадает с уже оставленными: {similar_in_app} в этом приложении, {similar_total} всего"
+        )
+        self.similar_in_app = similar_in_app
+        self.similar_total = similar_total
+        self.duplicate_of = duplicate_of
+
 class ReportRepository:
     def __init__(self, session=None):
         self.session = session or SessionLocal()
         self._is_external_session = session is not None
     
     def create_report(self, user_id: int, app_id: int, text: str, rating: Optional[float] = None) -> Report:
-        """Создание нового отчета"""
-        report = Report(user_id=user_id, app_id=app_id, text=text, rating=rating)
+        """
+        Создание нового отчета. Почти копия уже оставленных отзывов помечается duplicate_of,
+        а при большом числе копий (спам-кампания) отклоняется исключением DuplicateReport
+        """
+        check = report_duplicates.check(app_id, text)
+        if check.rejected and self._drop_deleted_matches(check):
+            # Часть похожих отзывов удалена другим процессом – проверяем заново по актуальному индексу
+            check = report_duplicates.check(app_id, text)
+        if check.rejected:
+            raise DuplicateReport(len(check.similar_in_app), check.similar_total, check.best_match)
+        report = Report(user_id=user_id, app_id=app_id, text=text, rating=rating, duplicate_of=check.best_match)
         self.session.add(report)
         self.session.commit()
         self.session.refresh(report)
+        report_duplicates.add(report.id, app_id, check.signature)
+        trending_index.record_report(app_id)
+        broadcaster.publish(events.REPORT_CREATED, app_id, report_id=report.id, user_id=user_id, rating=rating)
         return report
     
+    def _drop_deleted_matches(self, check) -> bool:
+        """Удаление из индекса похожих отзывов, которых уже нет в БД; True – такие были"""
+        report_ids = check.similar_in_app + check.similar_elsewhere
+        existing = set(self.session.execute(select(Report.id).where(Report.id.in_(report_ids))).scalars())
+        missing = [report_id for report_id in report_ids if report_id not in existing]
+        report_duplicates.remove(missing)
+        return bool(missing)
+    
     def get_report_by_id(self, report_id: int) -> Optional[Report]:
         """Получение отчета по ID"""
         return self.session.get(Report, report_id)
@@ -247,12 +905,44 @@ class ReportRepository:
         result = self.session.execute(stmt)
         return list(result.scalars().all())
     
-    def get_reports_by_app(self, app_id: int) -> List[Report]:
-        """Получение всех отчетов для приложения"""
-        stmt = select(Report).where(Report.app_id == app_id).order_by(Report.id)
+    def get_reports_by_app(self, app_id: int, limit: Optional[int] = None, after_id: Optional[int] = None) -> List[Report]:
+        """Получение отчетов для приложения (постранично по id, если задан limit)"""
+        # Каждая комбинация условий кешируется отдельно, значения идут параметрами
+        stmt = lambda_stmt(lambda: select(Report).where(Report.app_id == app_id))
+        if after_id is not None:
+            stmt += lambda s: s.where(Report.id > after_id)
+        stmt += lambda s: s.order_by(Report.id)
+        if limit is not None:
+            stmt += lambda s: s.limit(limit)
         result = self.session.execute(stmt)
         return list(result.scalars().all())
     
+    def get_report_summary(self, app_id: int, latest: int = 5) -> dict:
+        """Сводка по отзывам приложения: количество, средняя оценка, гистограмма и последние отзывы"""
+        row = self.session.execute(REPORT_SUMMARY_STMT, {"app_id": app_id}).one()
+        count, rated_count, average = row[0], row[1], row[2]
+        histogram = {star: int(value or 0) for star, value in zip(REPORT_STARS, row[3:])}
+
+        latest_reports = []
+        if count and latest > 0:
+            # Последние N по индексу reports(app_id, id)
+            latest_stmt = lambda_stmt(
+                lambda: select(Report)
+                .where(Report.app_id == app_id)
+                .order_by(Report.id.desc())
+                .limit(latest)
+            )
+            latest_reports = list(self.session.execute(latest_stmt).scalars().all())
+
+        return {
+            "app_id": app_id,
+            "count": count,
+            "rated_count": rated_count,
+            "average_rating": round(float(average), 2) if average is not None else None,
+            "histogram": histogram,
+            "latest": latest_reports,
+        }
+    
     def close(self):
         """Закрытие сессии"""
         if not self._is_external_session:
@@ -262,4 +952,427 @@ class ReportRepository:
         return self
     
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.close()
\ No newline at end of file
+        self.close()
+
+# Точность денежных сумм
+MONEY_QUANT = Decimal("0.01")
+# Пространство ключей advisory-блокировок баланса в PostgreSQL
+BALANCE_LOCK_NAMESPACE = 1032
+# Записи моложе этого возраста не сжимаются: транзакция с меньшим id
+# могла еще не зафиксироваться, и снимок ее бы пропустил
+COMPACTION_LAG = timedelta(minutes=1)
+
+# Запросы баланса выполняются на каждой покупке и пополнении – строятся один раз
+BALANCE_SNAPSHOT_STMT = (
+    select(BalanceSnapshot.balance, BalanceSnapshot.last_entry_id)
+    .where(BalanceSnapshot.user_id == bindparam("user_id"))
+)
+BALANCE_TAIL_STMT = (
+    select(func.coalesce(func.sum(BalanceEntry.amount), 0))
+    .where(BalanceEntry.user_id == bindparam("user_id"), BalanceEntry.id > bindparam("last_entry_id"))
+)
+
+def to_money(value) -> Decimal:
+    """Приведение суммы к Decimal с точностью до копеек"""
+    return Decimal(str(value)).quantize(MONEY_QUANT, rounding=ROUND_HALF_UP)
+
+class LedgerRepository:
+    """
+    Журнал баланса: только вставки, строка пользователя не обновляется.
+    Баланс = снимок (balance_snapshots) + сумма хвоста журнала после снимка.
+    """
+    def __init__(self, session=None):
+        self.session = session or SessionLocal()
+        self._is_external_session = session is not None
+    
+    def get_balance(self, user_id: int) -> Decimal:
+        """Баланс: снимок + хвост журнала (по индексу (user_id, id))"""
+        snapshot = self.session.execute(BALANCE_SNAPSHOT_STMT, {"user_id": user_id}).first()
+        base, last_entry_id = (snapshot.balance, snapshot.last_entry_id) if snapshot else (Decimal("0"), 0)
+        tail = self.session.execute(
+            BALANCE_TAIL_STMT, {"user_id": user_id, "last_entry_id": last_entry_id}
+        ).scalar()
+        return to_money(Decimal(base) + Decimal(tail))
+    
+    def get_balances(self, user_ids: Iterable[int]) -> Dict[int, Decimal]:
+        """Балансы нескольких пользователей за два запроса"""
+        user_ids = list(user_ids)
+        if not user_ids:
+            return {}
+        balances = {user_id: Decimal("0") for user_id in user_ids}
+        snapshots = self.session.execute(
+            select(BalanceSnapshot.user_id, BalanceSnapshot.balance).where(BalanceSnapshot.user_id.in_(user_ids))
+        ).all()
+        for user_id, balance in snapshots:
+            balances[user_id] += Decimal(balance)
+        tails = self.session.execute(
+            select(BalanceEntry.user_id, func.sum(BalanceEntry.amount))
+            .outerjoin(BalanceSnapshot, BalanceSnapshot.user_id == BalanceEntry.user_id)
+            .where(
+                BalanceEntry.user_id.in_(user_ids),
+                BalanceEntry.id > func.coalesce(BalanceSnapshot.last_entry_id, 0),
+            )
+            .group_by(BalanceEntry.user_id)
+        ).all()
+        for user_id, total in tails:
+            balances[user_id] += Decimal(total)
+        return {user_id: to_money(balance) for user_id, balance in balances.items()}
+    
+    def get_all_balances(self) -> Dict[int, Decimal]:
+        """Балансы всех пользователей, у которых есть записи: снимки плюс хвосты журнала, без списка ID"""
+        balances: Dict[int, Decimal] = {}
+        for user_id, balance in self.session.execute(select(BalanceSnapshot.user_id, BalanceSnapshot.balance)):
+            balances[user_id] = Decimal(balance)
+        tails = self.session.execute(
+            select(BalanceEntry.user_id, func.sum(BalanceEntry.amount))
+            .outerjoin(BalanceSnapshot, BalanceSnapshot.user_id == BalanceEntry.user_id)
+            .where(BalanceEntry.id > func.coalesce(BalanceSnapshot.last_entry_id, 0))
+            .group_by(BalanceEntry.user_id)
+        )
+        for user_id, total in tails:
+            balances[user_id] = balances.get(user_id, Decimal("0")) + Decimal(total)
+        return {user_id: to_money(balance) for user_id, balance in balances.items()}
+    
+    def get_entries(self, user_id: int, limit: int = 50, before_id: Optional[int] = None) -> List[BalanceEntry]:
+        """История операций пользователя (новые первыми)"""
+        stmt = select(BalanceEntry).where(BalanceEntry.user_id == user_id)
+        if before_id is not None:
+            stmt = stmt.where(BalanceEntry.id < before_id)
+        stmt = stmt.order_by(BalanceEntry.id.desc()).limit(limit)
+        return list(self.session.execute(stmt).scalars().all())
+    
+    def post_entry(self, user_id: int, amount, kind: str, app_id: Optional[int] = None, commit: bool = True) -> BalanceEntry:
+        """Добавление записи в журнал"""
+        entry = BalanceEntry(user_id=user_id, amount=to_money(amount), kind=kind, app_id=app_id)
+        self.session.add(entry)
+        if commit:
+            self.session.commit()
+            self.session.refresh(entry)
+        return entry
+    
+    def top_up(self, user_id: int, amount) -> BalanceEntry:
+        """Пополнение баланса"""
+        return self.post_entry(user_id, to_money(amount), "topup")
+    
+    def lock_balance(self, user_id: int):
+        """
+        Сериализация списаний одного пользователя до конца транзакции.
+        Advisory-блокировка не пишет в строку users и не мешает
+        остальным запросам к пользователю.
+        """
+        if self.session.get_bind().dialect.name == "postgresql":
+            self.session.execute(
+                text("SELECT pg_advisory_xact_lock(:namespace, :user_id)"),
+                {"namespace": BALANCE_LOCK_NAMESPACE, "user_id": user_id},
+            )
+    
+    def debit(self, user_id: int, amount, kind: str = "purchase", app_id: Optional[int] = None, commit: bool = True) -> Optional[BalanceEntry]:
+        """Списание с проверкой достаточности средств; None, если денег не хватает"""
+        amount = to_money(amount)
+        self.lock_balance(user_id)
+        if self.get_balance(user_id) < amount:
+            if commit:
+                self.session.rollback()
+            return None
+        return self.post_entry(user_id, -amount, kind, app_id=app_id, commit=commit)
+    
+    def compact(self, lag: timedelta = COMPACTION_LAG, batch_size: int = 1000) -> int:
+        """Сжатие хвостов журнала в снимки; возвращает число обновленных снимков"""
+        cutoff_id = self.session.execute(
+            select(func.max(BalanceEntry.id)).where(BalanceEntry.created_at < get_current_time() - lag)
+        ).scalar()
+        if not cutoff_id:
+            return 0
+        
+        previous = func.coalesce(BalanceSnapshot.last_entry_id, 0)
+        rows = self.session.execute(
+            select(BalanceEntry.user_id, previous, func.sum(BalanceEntry.amount), func.max(BalanceEntry.id))
+            .outerjoin(BalanceSnapshot, BalanceSnapshot.user_id == BalanceEntry.user_id)
+            .where(BalanceEntry.id <= cutoff_id, BalanceEntry.id > previous)
+            .group_by(BalanceEntry.user_id, previous)
+        ).all()
+        
+        compacted = 0
+        for start in range(0, len(rows), batch_size):
+            for user_id, previous_id, total, last_id in rows[start:start + batch_size]:
+                if previous_id:
+                    # Условное обновление: параллельное сжатие не прибавит хвост дважды
+                    result = self.session.execute(
+                        update(BalanceSnapshot)
+                        .where(BalanceSnapshot.user_id == user_id, BalanceSnapshot.last_entry_id == previous_id)
+                        .values(
+                            balance=BalanceSnapshot.balance + total,
+                            last_entry_id=last_id,
+                            updated_at=get_current_time(),
+                        )
+                    )
+                    compacted += result.rowcount
+                else:
+                    try:
+                        with self.session.begin_nested():
+                            self.session.execute(
+                                insert(BalanceSnapshot).values(
+                                    user_id=user_id, balance=total, last_entry_id=last_id, updated_at=get_current_time()
+                                )
+                            )
+                        compacted += 1
+                    except IntegrityError:
+                        pass
+            self.session.commit()
+        return compacted
+    
+    def close(self):
+        """Закрытие сессии"""
+        if not self._is_external_session:
+            self.session.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+# ========== СТАТИСТИКА СКАЧИВАНИЙ ==========
+# События скачиваний и покупок пишутся в download_events (секции по месяцам).
+# Задача rollup_downloads сворачивает новые события в почасовые и посуточные
+# агрегаты; статистика читается из агрегатов плюс еще не свернутый хвост.
+# События хранятся в UTC, интервалы агрегатов – часы и сутки по Москве.
+
+# События моложе этого возраста не сворачиваются – по той же причине, что и в сжатии журнала
+ROLLUP_LAG = timedelta(minutes=1)
+STATS_GRANULARITIES = {"hour": DownloadStatsHourly, "day": DownloadStatsDaily}
+STATS_STEPS = {"hour": timedelta(hours=1), "day": timedelta(days=1)}
+# Предельное число точек в одном ответе
+MAX_STATS_POINTS = 1500
+# Зона интервалов статистики
+STATS_TIMEZONE = MOSCOW_TZ.zone
+
+def truncate_bucket(moment: datetime, granularity: str) -> datetime:
+    """Начало часа или суток, в которые попадает момент"""
+    moment = moment.replace(minute=0, second=0, microsecond=0)
+    if granularity == "day":
+        moment = moment.replace(hour=0)
+    return moment
+
+class DownloadStatsRepository:
+    """Журнал скачиваний и агрегаты статистики для разработчиков (PostgreSQL)"""
+    def __init__(self, session=None):
+        self.session = session or SessionLocal()
+        self._is_external_session = session is not None
+    
+    def record(self, app_id: int, user_id: int, amount=0, commit: bool = True):
+        """Событие скачивания; amount > 0 – покупка"""
+        self.session.execute(
+            insert(DownloadEvent).values(
+                app_id=app_id, user_id=user_id, amount=to_money(amount or 0), created_at=get_utc_time()
+            )
+        )
+        if commit:
+            self.session.commit()
+    
+    def _lock_state(self) -> DownloadRollupState:
+        """Граница свертки под блокировкой строки: одновременные свертки выполняются по очереди"""
+        stmt = select(DownloadRollupState).where(DownloadRollupState.id == 1).with_for_update()
+        state = self.session.execute(stmt).scalar_one_or_none()
+        if state is None:
+            try:
+                with self.session.begin_nested():
+                    self.session.execute(
+                        insert(DownloadRollupState).values(id=1, last_event_id=0, updated_at=get_current_time())
+                    )
+            except IntegrityError:
+                pass
+            state = self.session.execute(stmt).scalar_one()
+        return state
+    
+    @staticmethod
+    def _aggregate(granularity: str):
+        """Колонки агрегата событий: интервал (московский, без tzinfo), скачивания, покупки, выручка"""
+        # UTC -> timestamptz -> московское время: не зависит от зоны сеанса
+        local_time = func.timezone(STATS_TIMEZONE, func.timezone("UTC", DownloadEvent.created_at))
+        return (
+            func.date_trunc(granularity, local_time).label("bucket"),
+            func.count().label("downloads"),
+            func.sum(case((DownloadEvent.amount > 0, 1), else_=0)).label("purchases"),
+            func.coalesce(func.sum(DownloadEvent.amount), 0).label("revenue"),
+        )
+    
+    def rollup(self, lag: timedelta = ROLLUP_LAG) -> int:
+        """Свертка новых событий в агрегаты одним запросом на таблицу; возвращает число событий"""
+        state = self._lock_state()
+        last_event_id = state.last_event_id
+        cutoff_id = self.session.execute(
+            select(func.max(DownloadEvent.id))
+            .where(DownloadEvent.id > last_event_id, DownloadEvent.created_at < get_utc_time() - lag)
+        ).scalar()
+        if not cutoff_id:
+            self.session.rollback()
+            return 0
+        
+        window = and_(DownloadEvent.id > last_event_id, DownloadEvent.id <= cutoff_id)
+        events_count = self.session.execute(select(func.count()).select_from(DownloadEvent).where(window)).scalar()
+        for granularity, model in STATS_GRANULARITIES.items():
+            bucket, downloads, purchases, revenue = self._aggregate(granularity)
+            source = (
+                select(DownloadEvent.app_id, bucket, downloads, purchases, revenue)
+                .where(window)
+                .group_by(DownloadEvent.app_id, bucket)
+            )
+            stmt = pg_insert(model).from_select(["app_id", "bucket", "downloads", "purchases", "revenue"], source)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[model.app_id, model.bucket],
+                set_={
+                    "downloads": model.downloads + stmt.excluded.downloads,
+                    "purchases": model.purchases + stmt.excluded.purchases,
+                    "revenue": model.revenue + stmt.excluded.revenue,
+                },
+            )
+            self.session.execute(stmt)
+        state.last_event_id = cutoff_id
+        state.updated_at = get_current_time()
+        self.session.commit()
+        return events_count
+    
+    def get_stats(self, app_id: int, start: datetime, end: datetime, granularity: str) -> List[dict]:
+        """
+        Точки [start, end) с шагом granularity, пустые интервалы – нулями.
+        Границы – московское время без tzinfo, начала интервалов в ответе – с московской зоной.
+        Агрегаты и хвост после границы свертки читаются одним запросом (один снимок данных),
+        поэтому свертка, зафиксированная в это время, не дает двойного счета или пропуска.
+        """
+        model = STATS_GRANULARITIES[granularity]
+        watermark = (
+            select(DownloadRollupState.last_event_id).where(DownloadRollupState.id == 1).scalar_subquery()
+        )
+        rolled = select(
+            model.bucket.label("bucket"), model.downloads.label("downloads"),
+            model.purchases.label("purchases"), model.revenue.label("revenue"),
+        ).where(model.app_id == app_id, model.bucket >= start, model.bucket < end)
+        bucket, downloads, purchases, revenue = self._aggregate(granularity)
+        tail = (
+            select(bucket, downloads, purchases, revenue)
+            .where(
+                DownloadEvent.app_id == app_id,
+                DownloadEvent.id > func.coalesce(watermark, literal(0)),
+                DownloadEvent.created_at >= moscow_to_utc(start),
+                DownloadEvent.created_at < moscow_to_utc(end),
+            )
+            .group_by(bucket)
+        )
+        combined = union_all(rolled, tail).subquery()
+        rows = self.session.execute(
+            select(
+                combined.c.bucket, func.sum(combined.c.downloads),
+                func.sum(combined.c.purchases), func.sum(combined.c.revenue),
+            ).group_by(combined.c.bucket)
+        ).all()
+        found = {row[0]: row[1:] for row in rows}
+        
+        points = []
+        step = STATS_STEPS[granularity]
+        moment = start
+        while moment < end:
+            downloads_count, purchases_count, total = found.get(moment, (0, 0, 0))
+            points.append({
+                "bucket": MOSCOW_TZ.localize(moment),
+                "downloads": int(downloads_count),
+                "purchases": int(purchases_count),
+                "revenue": float(to_money(total)),
+            })
+            moment += step
+        return points
+    
+    def close(self):
+        """Закрытие сессии"""
+        if not self._is_external_session:
+            self.session.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+class TokenRepository:
+    """Refresh-токены: выпуск, ротация и отзыв"""
+    def __init__(self, session=None):
+        self.session = session or SessionLocal()
+        self._is_external_session = session is not None
+    
+    def issue(self, user_id: int, family_id: Optional[str] = None, commit: bool = True) -> str:
+        """Выпуск нового refresh-токена; в БД сохраняется только хеш"""
+        token = create_refresh_token()
+        self.session.add(RefreshToken(
+            user_id=user_id,
+            token_hash=hash_refresh_token(token),
+            family_id=family_id or secrets.token_hex(16),
+            expires_at=get_current_time() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+        ))
+        if commit:
+            self.session.commit()
+        return token
+    
+    def rotate(self, token: str) -> Optional[Tuple[int, str]]:
+        """
+        Обмен refresh-токена на новый: (user_id, новый токен) или None.
+        Повторное использование уже замененного токена означает утечку –
+        отзывается вся цепочка токенов этого входа.
+        """
+        token_hash = hash_refresh_token(token)
+        if token_hash in revoked_refresh_tokens:
+            self.revoke_family_of(token_hash)
+            return None
+        
+        stmt = lambda_stmt(lambda: select(RefreshToken).where(RefreshToken.token_hash == token_hash).with_for_update())
+        record = self.session.execute(stmt).scalar_one_or_none()
+        if record is None:
+            return None
+        if record.revoked_at is not None:
+            self.session.rollback()
+            self.revoke_family_of(token_hash)
+            return None
+        
+        now = get_current_time()
+        active = self.session.execute(
+            select(RefreshToken.id).where(RefreshToken.id == record.id, RefreshToken.expires_at > now)
+        ).first()
+        if active is None:
+            self.session.rollback()
+            return None
+        
+        # Замененный токен в память не попадает: его повтор распознается по revoked_at выше
+        record.revoked_at = now
+        new_token = self.issue(record.user_id, family_id=record.family_id, commit=False)
+        self.session.commit()
+        return record.user_id, new_token
+    
+    def revoke_family_of(self, token_hash: str) -> int:
+        """Отзыв всей цепочки, к которой относится токен"""
+        family = select(RefreshToken.family_id).where(RefreshToken.token_hash == token_hash).scalar_subquery()
+        stmt = (
+            update(RefreshToken)
+            .where(RefreshToken.family_id == family, RefreshToken.revoked_at.is_(None))
+            .values(revoked_at=get_current_time())
+            .returning(RefreshToken.token_hash)
+        )
+        revoked = self.session.execute(stmt).scalars().all()
+        self.session.commit()
+        expires_at = time.time() + REFRESH_TOKEN_EXPIRE_DAYS * 86400
+        for revoked_hash in [token_hash, *revoked]:
+            revoked_refresh_tokens.add(revoked_hash, expires_at)
+        return len(revoked)
+    
+    def revoke(self, token: str) -> int:
+        """Отзыв токена и его цепочки (выход из системы)"""
+        return self.revoke_family_of(hash_refresh_token(token))
+    
+    def close(self):
+        """Закрытие сессии"""
+        if not self._is_external_session:
+            self.session.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
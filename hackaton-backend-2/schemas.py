@@ -1,6 +1,7 @@
 from pydantic import BaseModel, EmailStr, Field, validator
-from typing import List, Optional
+from typing import Any, Dict, List, Literal, Optional
 from datetime import datetime
+from decimal import Decimal
 
 # Схемы для пользователей
 class UserBase(BaseModel):
@@ -28,6 +29,7 @@ class UserUpdate(BaseModel):
     age: Optional[int] = Field(None, ge=0, le=120)
     balance: Optional[float] = None
     count_inputs: Optional[int] = None
+    version: Optional[int] = Field(None, ge=1)  # ожидаемая версия строки (вместо заголовка If-Match)
 
 class UserResponse(UserBase):
     id: int
@@ -36,6 +38,7 @@ class UserResponse(UserBase):
     created_at: datetime
     updated_at: datetime
     downloaded_apps: List[int] = []  # Теперь список ID приложений
+    version: int  # версия строки для If-Match при обновлении
 
     class Config:
         from_attributes = True
@@ -71,6 +74,11 @@ class UserRegister(BaseModel):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+    expires_in: Optional[int] = None  # срок жизни access_token в секундах
+
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str = Field(..., min_length=20, max_length=200)
 
 class UserOut(BaseModel):
     id: int
@@ -92,13 +100,20 @@ class CategoryCreate(CategoryBase):
 
 class CategoryUpdate(BaseModel):
     name: Optional[str] = Field(None, min_length=1, max_length=50)
+    version: Optional[int] = Field(None, ge=1)  # ожидаемая версия строки (вместо заголовка If-Match)
 
 class CategoryResponse(CategoryBase):
     id: int
+    version: int  # версия строки для If-Match при обновлении
 
     class Config:
         from_attributes = True
 
+class CategoryStatsResponse(CategoryResponse):
+    apps_count: int
+    total_downloads: int
+    avg_rating: Optional[float] = None  # None – в категории нет приложений
+
 # Схемы для приложений
 class AppBase(BaseModel):
     name: str = Field(..., min_length=1, max_length=20)
@@ -122,16 +137,66 @@ class AppUpdate(BaseModel):
     rating: Optional[float] = Field(None, ge=0, le=5)
     age_restriction: Optional[int] = Field(None, ge=0)
     category_id: Optional[int] = None
+    version: Optional[int] = Field(None, ge=1)  # ожидаемая версия строки (вместо заголовка If-Match)
 
 class AppResponse(AppBase):
     id: int
     downloads: int
     rating: float
     downloaded_by_users: List[int] = []  # Список ID пользователей
+    version: int  # версия строки для If-Match при обновлении
+
+    class Config:
+        from_attributes = True
+
+class CatalogAppResponse(AppResponse):
+    owned: Optional[bool] = None  # только для авторизованного пользователя
+
+# Схемы для каталога с фасетами
+class CategoryFacet(BaseModel):
+    category_id: int
+    count: int
+
+class PriceBucketFacet(BaseModel):
+    bucket: str
+    min_price: float
+    max_price: Optional[float] = None
+    count: int
+
+class AppFacets(BaseModel):
+    categories: List[CategoryFacet]
+    price_buckets: List[PriceBucketFacet]
+
+class AppCatalogResponse(BaseModel):
+    items: List[AppResponse]
+    total: int
+    facets: AppFacets
+
+class AppPackageResponse(BaseModel):
+    app_id: int
+    sha256: str
+    size: int
+    filename: str
+    content_type: str
+    uploaded_at: datetime
 
     class Config:
         from_attributes = True
 
+class AppSuggestion(BaseModel):
+    id: int
+    name: str
+    downloads: int
+
+class TrendingApp(BaseModel):
+    id: int
+    name: str
+    category_id: int
+    price: float
+    rating: float
+    downloads: int
+    score: float  # затухающая сумма недавних скачиваний и отзывов
+
 # Схемы для отчетов
 class ReportBase(BaseModel):
     text: str = Field(..., min_length=1, max_length=500)
@@ -144,10 +209,36 @@ class ReportCreate(ReportBase):
 class ReportResponse(ReportBase):
     id: int
     user_id: int
+    duplicate_of: Optional[int] = None  # отзыв почти повторяет этот (возможный спам)
 
     class Config:
         from_attributes = True
 
+class ReportSummaryResponse(BaseModel):
+    app_id: int
+    count: int
+    rated_count: int
+    average_rating: Optional[float] = None
+    histogram: Dict[int, int]  # звезды (0-5) -> количество отзывов
+    latest: List[ReportResponse] = []
+
+# Схемы статистики скачиваний
+class DownloadStatsPoint(BaseModel):
+    bucket: datetime  # начало часа или суток
+    downloads: int
+    purchases: int  # скачивания с оплатой
+    revenue: float
+
+class AppDownloadStatsResponse(BaseModel):
+    app_id: int
+    granularity: Literal["hour", "day"]
+    start: datetime
+    end: datetime  # не включается
+    downloads: int
+    purchases: int
+    revenue: float
+    points: List[DownloadStatsPoint]
+
 # Схемы с расширенной информацией
 class AppWithDetailsResponse(AppResponse):
     category: CategoryResponse
@@ -157,4 +248,95 @@ class UserWithDetailsResponse(UserResponse):
 
 class ReportWithDetailsResponse(ReportResponse):
     author: UserResponse
-    app_rep: AppResponse
\ No newline at end of file
+    app_rep: AppResponse
+
+# Схемы для баланса
+class BalanceTopUp(BaseModel):
+    amount: Decimal = Field(..., gt=0, max_digits=12, decimal_places=2)
+
+class BalanceResponse(BaseModel):
+    user_id: int
+    balance: Decimal
+
+class CheckoutRequest(BaseModel):
+    app_ids: List[int] = Field(..., min_length=1, max_length=100)
+
+class CheckoutResponse(BaseModel):
+    user_id: int
+    purchased: List[int]
+    already_owned: List[int]  # уже были куплены – не оплачиваются повторно
+    total: Decimal
+    balance: Decimal
+
+class BalanceEntryResponse(BaseModel):
+    id: int
+    user_id: int
+    amount: Decimal
+    kind: str
+    app_id: Optional[int] = None
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+# Схемы для фоновых задач
+class JobCreate(BaseModel):
+    kind: str = Field(..., min_length=1, max_length=50)
+    params: Dict[str, Any] = {}
+    priority: int = Field(0, ge=-100, le=100)
+    max_attempts: int = Field(3, ge=1, le=10)
+
+class JobResponse(BaseModel):
+    id: int
+    kind: str
+    status: str
+    priority: int
+    params: Optional[Dict[str, Any]] = None
+    result: Optional[Dict[str, Any]] = None
+    progress: float
+    message: Optional[str] = None
+    error: Optional[str] = None
+    attempts: int
+    max_attempts: int
+    run_after: datetime
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+# Схемы для статистики БД
+class TableStatsResponse(BaseModel):
+    name: str
+    row_estimate: Optional[int] = None
+    live_tuples: Optional[int] = None
+    dead_tuples: Optional[int] = None
+    dead_ratio: float = 0
+    table_bytes: int
+    index_bytes: int
+    total_bytes: int
+    seq_scan: Optional[int] = None
+    idx_scan: Optional[int] = None
+    last_vacuum: Optional[datetime] = None
+    last_analyze: Optional[datetime] = None
+
+class IndexStatsResponse(BaseModel):
+    table_name: str
+    name: str
+    idx_scan: int
+    idx_tup_read: int
+    idx_tup_fetch: int
+    bytes: int
+
+class AdminStatsResponse(BaseModel):
+    generated_at: datetime
+    tables: List[TableStatsResponse]
+    indexes: List[IndexStatsResponse]
+    exact_counts: Optional[Dict[str, int]] = None  # результат последней фоновой задачи table_stats
+    exact_counts_at: Optional[datetime] = None
+    exact_job_id: Optional[int] = None
+    ownership_index: Optional[Dict[str, int]] = None  # память индекса владения этого процесса
+    report_duplicates: Optional[Dict[str, int]] = None  # память индекса почти одинаковых отзывов этого процесса
+    read_coalescing: Optional[dict] = None  # склейка одинаковых одновременных чтений этого процесса
+    statement_cache: Optional[Dict[str, Optional[float]]] = None  # попадания в кеш компиляции SQL этого процесса
\ No newline at end of file
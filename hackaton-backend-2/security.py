@@ -1,4 +1,9 @@
+import hashlib
+import secrets
+import threading
+import time
 import pytz
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import jwt
@@ -8,6 +13,9 @@ from fastapi.security import OAuth2PasswordBearer
 SECRET_KEY = "SUPER_SECRET_KEY_CHANGE_IT"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
+REFRESH_TOKEN_EXPIRE_DAYS = 30
+# Предел числа отозванных хешей в памяти; вытесненные распознаются по revoked_at в БД
+MAX_REVOKED_TOKENS = 10_000
 
 # Используем bcrypt_sha256 вместо "голого" bcrypt
 pwd_context = CryptContext(
@@ -51,5 +59,55 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
+def create_refresh_token() -> str:
+    """Случайный refresh-токен (256 бит энтропии)"""
+    return secrets.token_urlsafe(32)
+
+
+def hash_refresh_token(token: str) -> str:
+    """
+    Хеш refresh-токена для хранения в БД.
+    Токен случайный и длинный, поэтому достаточно быстрого SHA-256 –
+    медленный bcrypt нужен только для паролей, выбранных людьми.
+    """
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+class RevocationSet:
+    """
+    Хеши токенов отозванных цепочек (выход, обнаруженный повтор) в памяти процесса.
+    Повторно предъявленный токен такой цепочки отклоняется без обращения к БД.
+    Это только ускорение – источник истины revoked_at в БД, поэтому записей
+    не больше max_size (вытесняются самые старые) и не дольше срока токена.
+    """
+
+    def __init__(self, max_size: int = MAX_REVOKED_TOKENS):
+        self.max_size = max_size
+        self._items: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, token_hash: str, expires_at: float):
+        with self._lock:
+            self._items[token_hash] = expires_at
+            self._items.move_to_end(token_hash)
+            self._prune()
+
+    def __contains__(self, token_hash: str) -> bool:
+        with self._lock:
+            expires_at = self._items.get(token_hash)
+        return expires_at is not None and expires_at > time.time()
+
+    def _prune(self):
+        # Записи упорядочены по добавлению, а срок у всех одинаковый – истекшие и лишние всегда в начале
+        now = time.time()
+        while self._items and (len(self._items) > self.max_size or next(iter(self._items.values())) <= now):
+            self._items.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+revoked_refresh_tokens = RevocationSet()
+
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
\ No newline at end of file
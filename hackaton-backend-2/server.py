@@ -0,0 +1,216 @@
+"""
+Production-запуск: несколько процессов uvicorn с предзагруженным приложением.
+
+    python server.py --workers 4 --port 8000
+
+Мастер-процесс импортирует приложение до fork (общая память копируется
+при записи), открывает слушающий сокет и запускает воркеры. Каждый воркер
+проходит lifespan (проверка схемы, прогрев пула и кешей), перезапускается
+после max-requests запросов и корректно завершается по SIGTERM.
+Для разработки по-прежнему используется `python main.py` (reload).
+"""
+import argparse
+import gc
+import os
+import random
+import signal
+import socket
+import sys
+import time
+from typing import Dict
+
+import uvicorn
+
+# Воркер, проработавший столько секунд после последнего неудачного старта,
+# сбрасывает счетчик неудачных стартов: редкие сбои за время жизни мастера не копятся
+STABLE_UPTIME = 60.0
+
+
+def default_workers() -> int:
+    """Число воркеров по умолчанию – по количеству доступных CPU"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def bind_socket(host: str, port: int, backlog: int = 2048) -> socket.socket:
+    """Общий слушающий сокет для всех воркеров"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+class Master:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.workers: Dict[int, float] = {}
+        self.stopping = False
+        self.boot_failed = False
+        self.sock = None
+        self.app = None
+
+    def preload(self):
+        """Импорт приложения до fork, чтобы воркеры разделяли память"""
+        from main import app
+        from database import engine
+
+        # Соединения пула не должны переходить в дочерние процессы
+        engine.dispose()
+        self.app = app
+        # Переносим уже созданные объекты в постоянное поколение GC,
+        # чтобы сборщик не трогал их страницы памяти в воркерах
+        gc.collect()
+        gc.freeze()
+        print(f"📦 Приложение загружено в мастер-процесс (PID: {os.getpid()})")
+
+    def spawn_worker(self):
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = time.monotonic()
+            return
+
+        # Дочерний процесс
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        random.seed()
+        from database import engine
+        engine.dispose(close=False)
+
+        # Разброс лимита запросов, чтобы воркеры не перезапускались одновременно
+        limit = None
+        if self.args.max_requests:
+            limit = self.args.max_requests + random.randint(0, self.args.max_requests_jitter)
+
+        config = uvicorn.Config(
+            self.app,
+            lifespan="on",
+            limit_max_requests=limit,
+            timeout_graceful_shutdown=self.args.graceful_timeout,
+            timeout_keep_alive=self.args.keep_alive,
+            log_level=self.args.log_level,
+        )
+        server = uvicorn.Server(config)
+        exit_code = 0
+        try:
+            server.run(sockets=[self.sock])
+            if not server.started:
+                exit_code = 3
+        except SystemExit as e:
+            # Новые версии uvicorn сами вызывают sys.exit(3), если lifespan не завершил старт
+            exit_code = e.code if isinstance(e.code, int) else 1
+        except Exception as e:
+            print(f"❌ Ошибка воркера {os.getpid()}: {e}")
+            exit_code = 1
+        finally:
+            os._exit(exit_code)
+
+    def handle_stop(self, signum, frame):
+        if not self.stopping:
+            print(f"🛑 Получен сигнал {signal.Signals(signum).name}, останавливаем воркеры")
+        self.stopping = True
+
+    def reap(self) -> int:
+        """Сбор завершившихся воркеров; возвращает число неуспешных стартов"""
+        failed = 0
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return failed
+            if pid == 0:
+                return failed
+            started = self.workers.pop(pid, None)
+            code = os.waitstatus_to_exitcode(status)
+            if code == 3:
+                failed += 1
+            if not self.stopping:
+                uptime = time.monotonic() - started if started else 0
+                print(f"♻️ Воркер {pid} завершился (код {code}, работал {uptime:.0f} с)")
+
+    def has_stable_worker(self, since: float) -> bool:
+        """Есть воркер, запущенный после since и проработавший не меньше STABLE_UPTIME"""
+        now = time.monotonic()
+        return any(started >= since and now - started >= STABLE_UPTIME for started in self.workers.values())
+
+    def stop_workers(self):
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                self.workers.pop(pid, None)
+
+        deadline = time.monotonic() + self.args.graceful_timeout + 5
+        while self.workers and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+
+        for pid in list(self.workers):
+            print(f"⚠️ Воркер {pid} не завершился вовремя, принудительная остановка")
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        while self.workers:
+            try:
+                pid, _ = os.waitpid(-1, 0)
+            except ChildProcessError:
+                break
+            self.workers.pop(pid, None)
+
+    def run(self):
+        self.preload()
+        self.sock = bind_socket(self.args.host, self.args.port)
+        signal.signal(signal.SIGTERM, self.handle_stop)
+        signal.signal(signal.SIGINT, self.handle_stop)
+
+        print(f"🚀 Мастер {os.getpid()}: {self.args.workers} воркеров на http://{self.args.host}:{self.args.port}")
+        for _ in range(self.args.workers):
+            self.spawn_worker()
+
+        boot_failures, last_failure = 0, 0.0
+        while not self.stopping:
+            failed = self.reap()
+            if failed:
+                boot_failures += failed
+                last_failure = time.monotonic()
+            elif boot_failures and self.has_stable_worker(last_failure):
+                boot_failures = 0
+            if boot_failures >= self.args.workers * 3:
+                print("❌ Воркеры не могут стартовать, завершаем работу")
+                self.stopping = True
+                self.boot_failed = True
+                break
+            while not self.stopping and len(self.workers) < self.args.workers:
+                self.spawn_worker()
+            time.sleep(0.2)
+
+        self.stop_workers()
+        self.sock.close()
+        print("🛑 Сервер остановлен")
+        if self.boot_failed:
+            # Ненулевой код – супервизор (systemd, оркестратор) видит неудачный запуск
+            sys.exit(1)
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Production-запуск App Store API")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=default_workers(), help="Число процессов (по умолчанию – число CPU)")
+    parser.add_argument("--max-requests", type=int, default=10000, help="Перезапуск воркера после N запросов (0 – без ограничения)")
+    parser.add_argument("--max-requests-jitter", type=int, default=1000, help="Случайная добавка к max-requests")
+    parser.add_argument("--graceful-timeout", type=int, default=30, help="Время на завершение активных запросов, с")
+    parser.add_argument("--keep-alive", type=int, default=5, help="Таймаут keep-alive соединений, с")
+    parser.add_argument("--log-level", default="info")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    if not hasattr(os, "fork"):
+        sys.exit("❌ Многопроцессный запуск поддерживается только на Unix, используйте python main.py")
+    Master(parse_args()).run()
@@ -0,0 +1,344 @@
+"""
+Статические снимки каталога для анонимных пользователей.
+
+После записей в каталог (с задержкой DEBOUNCE, но не позже MAX_DELAY
+от первой записи) сборщик рендерит JSON-файлы каталога в новый каталог
+версии, рядом кладет сжатые .gz/.br и атомарно переключает символическую
+ссылку `latest`. Анонимные запросы отдаются файлом (sendfile, если сервер
+его поддерживает) без репозиториев, Pydantic и сжатия на каждый запрос;
+тот же каталог можно раздавать nginx напрямую.
+
+Процесс, в котором были записи, пока снимок не перестроен, отвечает
+динамически – свои изменения он видит сразу. Остальные процессы видят
+их после перестройки снимка.
+
+Покупки меняют только счетчики скачиваний: они не переводят процесс
+в динамические ответы и попадают в снимок не чаще раза в COUNTERS_DELAY.
+Снимок каталога собирает один воркер (блокировка файла в каталоге снимков),
+неизмененные файлы прошлой версии переносятся жесткими ссылками без
+повторного сжатия.
+"""
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # fcntl только на Unix – без него каждый процесс собирает снимок сам
+    fcntl = None
+
+from fastapi import Request
+from fastapi.responses import FileResponse
+
+from cache import on_catalog_change
+from compression import MIN_COMPRESS_SIZE, brotli, choose_encoding, compress
+
+SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "catalog_snapshots")
+LATEST = "latest"
+BUILD_LOCK = ".build.lock"
+# Пауза после последней записи и предельная задержка перестройки при непрерывных записях
+DEBOUNCE = 1.0
+MAX_DELAY = 10.0
+# Изменения только счетчиков скачиваний (покупки) попадают в снимок не позже чем через
+COUNTERS_DELAY = 60.0
+# Сколько последних версий хранить (по старым еще могут дочитываться ответы)
+KEEP_VERSIONS = 3
+# При старте процесса снимок не перестраивается, если он моложе
+STARTUP_MAX_AGE = 60.0
+
+ENCODING_SUFFIXES = {"gzip": ".gz", "br": ".br"}
+
+# Файлы снимка: (относительный путь, тело)
+SnapshotRenderer = Callable[[], Iterable[Tuple[str, bytes]]]
+
+
+def _version_name() -> str:
+    return f"v{int(time.time() * 1000)}-{os.getpid()}"
+
+
+def _version_time(name: str) -> int:
+    """Момент сборки из имени версии (0 – не версия)"""
+    try:
+        return int(name[1:].split("-", 1)[0]) if name.startswith("v") else 0
+    except ValueError:
+        return 0
+
+
+class CatalogSnapshots:
+    """Сборка, переключение и раздача версий статического снимка каталога"""
+
+    def __init__(self, directory: str = SNAPSHOT_DIR):
+        self.directory = directory
+        self.renderer: Optional[SnapshotRenderer] = None
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self._pending = False
+        self._first_change: Optional[float] = None
+        self._last_change = 0.0
+        # Первая покупка, еще не попавшая в снимок
+        self._counters_since: Optional[float] = None
+        # Время (time.time) последнего изменения, которое должен включить следующий снимок
+        self._requested_at = 0.0
+        # В этом процессе были записи, еще не попавшие в снимок
+        self._dirty = True
+        self._listening = False
+        self.builds = 0
+        self.reused_files = 0
+        self.last_build_seconds: Optional[float] = None
+
+    @property
+    def latest_path(self) -> str:
+        return os.path.join(self.directory, LATEST)
+
+    def current_version(self) -> Optional[str]:
+        try:
+            return os.readlink(self.latest_path)
+        except OSError:
+            return None
+
+    # ---------- жизненный цикл ----------
+
+    def start(self, renderer: SnapshotRenderer):
+        """Запуск сборщика в процессе-воркере; первый снимок – если текущего нет или он устарел"""
+        self.renderer = renderer
+        os.makedirs(self.directory, exist_ok=True)
+        if not self._listening:
+            on_catalog_change(self._on_change)
+            self._listening = True
+
+        current = self.current_version()
+        fresh = current is not None and time.time() - _version_time(current) / 1000 < STARTUP_MAX_AGE
+        with self._cond:
+            self._stopping = False
+            self._dirty = not fresh
+            if not fresh:
+                self._pending = True
+                self._first_change = self._last_change = time.monotonic() - DEBOUNCE
+                self._requested_at = time.time()
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="catalog-snapshots", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _on_change(self, version: int, counters_only: bool = False):
+        now = time.monotonic()
+        with self._cond:
+            self._requested_at = time.time()
+            if counters_only:
+                # Анонимным читателям допустимы чуть устаревшие счетчики, а покупатель
+                # с токеном и так получает динамические ответы – снимок не сбрасываем
+                if self._counters_since is None:
+                    self._counters_since = now
+                    self._cond.notify_all()
+                return
+            self._dirty = True
+            self._pending = True
+            self._last_change = now
+            if self._first_change is None:
+                self._first_change = now
+            self._cond.notify_all()
+
+    def _due(self) -> Optional[float]:
+        """Момент следующей сборки (time.monotonic); None – изменений нет"""
+        due = None
+        if self._pending:
+            # Ждем паузы в записях, но не дольше MAX_DELAY от первой
+            due = min(self._last_change + DEBOUNCE, self._first_change + MAX_DELAY)
+        if self._counters_since is not None:
+            counters_due = self._counters_since + COUNTERS_DELAY
+            due = counters_due if due is None else min(due, counters_due)
+        return due
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopping:
+                    due = self._due()
+                    if due is None:
+                        self._cond.wait()
+                    elif due > time.monotonic():
+                        self._cond.wait(due - time.monotonic())
+                    else:
+                        break
+                if self._stopping:
+                    return
+                pending, requested_at = self._pending, self._requested_at
+                self._pending = False
+                self._first_change = None
+                self._counters_since = None
+
+            try:
+                name = self.build(not_before=requested_at)
+            except Exception as e:
+                print(f"❌ Ошибка сборки снимка каталога: {e}")
+                continue
+            with self._cond:
+                if name is None:
+                    # Снимок собирает другой процесс, но его сборка могла начаться до наших
+                    # изменений: через DEBOUNCE проверяем latest и при необходимости собираем сами
+                    now = time.monotonic()
+                    if pending:
+                        self._pending = True
+                        self._last_change = max(self._last_change, now)
+                        if self._first_change is None:
+                            self._first_change = now
+                    elif self._counters_since is None:
+                        self._counters_since = now - COUNTERS_DELAY + DEBOUNCE
+                    self._requested_at = max(self._requested_at, requested_at)
+                # Записи во время сборки могли в снимок не попасть – тогда остаемся "грязными"
+                elif not self._pending:
+                    self._dirty = False
+
+    # ---------- сборка ----------
+
+    @contextmanager
+    def _build_lock(self) -> Iterator[bool]:
+        """Блокировка сборки между процессами: True – захвачена, False – собирает другой процесс"""
+        if fcntl is None:
+            yield True
+            return
+        with open(os.path.join(self.directory, BUILD_LOCK), "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                acquired = False
+            else:
+                acquired = True
+            # Блокировка снимается вместе с закрытием файла
+            yield acquired
+
+    def build(self, not_before: Optional[float] = None) -> Optional[str]:
+        """
+        Рендер новой версии, атомарное переключение latest и удаление старых версий.
+        Текущая версия, собранная после not_before (time.time), уже содержит нужные
+        изменения и возвращается без сборки; None – снимок собирает другой процесс.
+        """
+        with self._build_lock() as acquired:
+            if not acquired:
+                return None
+            current = self.current_version()
+            if not_before is not None and current is not None and _version_time(current) >= not_before * 1000:
+                return current
+            return self._build(current)
+
+    def _build(self, current: Optional[str]) -> str:
+        """Сборка под блокировкой; current – текущая версия, из которой берутся неизмененные файлы"""
+        started = time.monotonic()
+        # Имя версии – момент начала сборки: все записи до него в снимок попадают
+        name = _version_name()
+        root = os.path.join(self.directory, name)
+        previous = os.path.join(self.directory, current) if current is not None else None
+        files = reused = 0
+        for relative_path, body in self.renderer():
+            path = os.path.join(root, relative_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            files += 1
+            if previous is not None and self._link_unchanged(os.path.join(previous, relative_path), path, body):
+                reused += 1
+                continue
+            self._write(path, body)
+            if len(body) >= MIN_COMPRESS_SIZE:
+                self._write(path + ENCODING_SUFFIXES["gzip"], compress(body, "gzip", precompressed=True))
+                if brotli is not None:
+                    self._write(path + ENCODING_SUFFIXES["br"], compress(body, "br", precompressed=True))
+
+        latest = self.current_version()
+        if latest is not None and _version_time(latest) > _version_time(name):
+            # Без блокировки (не Unix) другой процесс мог успеть опубликовать более новую версию
+            shutil.rmtree(root, ignore_errors=True)
+            return latest
+
+        # Новая ссылка создается рядом и переименовывается поверх – читатели всегда видят целую версию
+        link = os.path.join(self.directory, f".{LATEST}-{os.getpid()}")
+        if os.path.lexists(link):
+            os.remove(link)
+        os.symlink(name, link)
+        os.replace(link, self.latest_path)
+        self._cleanup(keep=name)
+
+        self.builds += 1
+        self.reused_files += reused
+        self.last_build_seconds = time.monotonic() - started
+        print(f"🗂️ Снимок каталога {name}: файлов {files}, без изменений {reused}, {self.last_build_seconds:.2f} с")
+        return name
+
+    @staticmethod
+    def _write(path: str, data: bytes):
+        with open(path, "wb") as f:
+            f.write(data)
+
+    @staticmethod
+    def _link_unchanged(old_path: str, path: str, body: bytes) -> bool:
+        """Файл прошлой версии с тем же телом переносится со сжатыми копиями жесткими ссылками"""
+        suffixes = [""]
+        if len(body) >= MIN_COMPRESS_SIZE:
+            suffixes.append(ENCODING_SUFFIXES["gzip"])
+            if brotli is not None:
+                suffixes.append(ENCODING_SUFFIXES["br"])
+        linked = []
+        try:
+            if os.path.getsize(old_path) != len(body):
+                return False
+            with open(old_path, "rb") as f:
+                if f.read() != body:
+                    return False
+            for suffix in suffixes:
+                os.link(old_path + suffix, path + suffix)
+                linked.append(path + suffix)
+        except OSError:
+            # Частично перенесенные ссылки убираем: запись поверх ссылки испортила бы прошлую версию
+            for linked_path in linked:
+                os.remove(linked_path)
+            return False
+        return True
+
+    def _cleanup(self, keep: str):
+        versions = sorted(
+            (entry for entry in os.listdir(self.directory) if _version_time(entry)),
+            key=_version_time,
+            reverse=True,
+        )
+        for old in versions[KEEP_VERSIONS:]:
+            if old != keep:
+                shutil.rmtree(os.path.join(self.directory, old), ignore_errors=True)
+
+    # ---------- раздача ----------
+
+    def respond(self, request: Request, relative_path: str) -> Optional[FileResponse]:
+        """Файл текущего снимка в согласованной кодировке; None – отвечать динамически"""
+        if self._dirty:
+            return None
+        path = os.path.join(self.latest_path, relative_path)
+        headers = {"Vary": "Accept-Encoding, Authorization"}
+        encoding = choose_encoding(request.headers.get("accept-encoding"))
+        if encoding is not None:
+            try:
+                stat_result = os.stat(path + ENCODING_SUFFIXES[encoding])
+            except OSError:
+                pass
+            else:
+                headers["Content-Encoding"] = encoding
+                return FileResponse(
+                    path + ENCODING_SUFFIXES[encoding], media_type="application/json",
+                    headers=headers, stat_result=stat_result,
+                )
+        try:
+            stat_result = os.stat(path)
+        except OSError:
+            return None
+        return FileResponse(path, media_type="application/json", headers=headers, stat_result=stat_result)
+
+
+# Снимки публичного каталога
+catalog_snapshots = CatalogSnapshots()
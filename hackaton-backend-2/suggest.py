@@ -0,0 +1,246 @@
+"""
+Подсказки по названиям приложений (search-as-you-type).
+
+Индекс живет в памяти процесса:
+  * отсортированный массив ключей (название и каждый его хвост, начинающийся
+    с нового слова) – поиск по префиксу бинарным поиском;
+  * триграммный индекс – запасной вариант для запросов с опечатками.
+
+Строится при старте, обновляется из AppsRepository при создании, изменении
+и удалении приложения и раз в REBUILD_INTERVAL перестраивается целиком
+в фоновом потоке, чтобы подхватить записи, сделанные другими процессами.
+"""
+import heapq
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import select
+
+from database import SessionLocal
+from models import App
+
+DEFAULT_LIMIT = 10
+# Триграммный поиск включается только для запросов от этой длины
+MIN_FUZZY_LENGTH = 3
+# Минимальная доля триграмм запроса, найденных в названии
+FUZZY_THRESHOLD = 0.5
+# Полная перестройка индекса (изменения из других процессов)
+REBUILD_INTERVAL = 60.0
+# Ответы для коротких префиксов (самые широкие диапазоны) запоминаются
+# до следующего изменения набора названий
+CACHED_PREFIX_LENGTH = 2
+
+
+def normalize(text: str) -> str:
+    """Нормализация названия: нижний регистр, одиночные пробелы"""
+    return " ".join(text.lower().split())
+
+
+def word_suffixes(key: str) -> List[str]:
+    """Хвосты названия, начинающиеся с каждого слова: "super mario run" -> ["super mario run", "mario run", "run"]"""
+    words = key.split(" ")
+    return [" ".join(words[i:]) for i in range(len(words))]
+
+
+def trigrams(key: str, partial: bool = False) -> Set[str]:
+    """
+    Триграммы слов как в pg_trgm: слово дополняется двумя пробелами слева и одним справа.
+    Для вводимого запроса (partial) последнее слово не закончено – правый пробел не добавляется.
+    """
+    words = key.split(" ")
+    result = set()
+    for i, word in enumerate(words):
+        if not word:
+            continue
+        padded = "  " + word + ("" if partial and i == len(words) - 1 else " ")
+        result.update(padded[j:j + 3] for j in range(len(padded) - 2))
+    return result
+
+
+class _Entry:
+    __slots__ = ("id", "name", "key", "downloads", "age_restriction", "trigrams")
+
+    def __init__(self, id: int, name: str, downloads: int, age_restriction: int):
+        self.id = id
+        self.name = name
+        self.key = normalize(name)
+        self.downloads = downloads or 0
+        self.age_restriction = age_restriction or 0
+        self.trigrams = trigrams(self.key)
+
+    def as_dict(self) -> dict:
+        return {"id": self.id, "name": self.name, "downloads": self.downloads}
+
+
+class SuggestIndex:
+    """Префиксный и триграммный индекс названий приложений"""
+
+    def __init__(self):
+        self._entries: Dict[int, _Entry] = {}
+        self._keys: List[Tuple[str, int]] = []
+        self._trigrams: Dict[str, Set[int]] = {}
+        self._cache: Dict[Tuple[str, int, Optional[int]], List[dict]] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.built_at: Optional[float] = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    # ---------- построение и изменения ----------
+
+    def rebuild(self, rows: Iterable[Tuple[int, str, int, int]]):
+        """Полная перестройка по строкам (id, name, downloads, age_restriction)"""
+        entries = {row[0]: _Entry(*row) for row in rows}
+        keys = sorted((suffix, entry.id) for entry in entries.values() for suffix in word_suffixes(entry.key))
+        postings: Dict[str, Set[int]] = {}
+        for entry in entries.values():
+            for trigram in entry.trigrams:
+                postings.setdefault(trigram, set()).add(entry.id)
+        with self._lock:
+            self._entries, self._keys, self._trigrams = entries, keys, postings
+            self._cache = {}
+            self.built_at = time.monotonic()
+
+    def load(self):
+        """Построение индекса из БД"""
+        with SessionLocal() as session:
+            rows = session.execute(
+                select(App.id, App.name, App.downloads, App.age_restriction).where(App.deleted_at.is_(None))
+            ).all()
+        self.rebuild(rows)
+        print(f"🔎 Индекс подсказок построен: {len(rows)} приложений")
+
+    def upsert(self, app_id: int, name: str, downloads: int = 0, age_restriction: int = 0):
+        """Добавление или обновление приложения"""
+        entry = _Entry(app_id, name, downloads, age_restriction)
+        with self._lock:
+            previous = self._entries.get(app_id)
+            if previous is not None and previous.key == entry.key and previous.age_restriction == entry.age_restriction:
+                # Название не менялось – достаточно обновить счетчик скачиваний
+                previous.name, previous.downloads = entry.name, entry.downloads
+                return
+            if previous is not None:
+                self._unlink(previous)
+            self._entries[app_id] = entry
+            for suffix in word_suffixes(entry.key):
+                insort(self._keys, (suffix, app_id))
+            for trigram in entry.trigrams:
+                self._trigrams.setdefault(trigram, set()).add(app_id)
+            self._cache = {}
+
+    def remove(self, app_id: int):
+        with self._lock:
+            entry = self._entries.pop(app_id, None)
+            if entry is not None:
+                self._unlink(entry)
+                self._cache = {}
+
+    def set_downloads(self, app_id: int, downloads: int):
+        """Обновление счетчика скачиваний (ранжирование); кеш коротких префиксов не сбрасывается"""
+        entry = self._entries.get(app_id)
+        if entry is not None:
+            entry.downloads = downloads or 0
+
+    def _unlink(self, entry: _Entry):
+        for suffix in word_suffixes(entry.key):
+            position = bisect_left(self._keys, (suffix, entry.id))
+            if position < len(self._keys) and self._keys[position] == (suffix, entry.id):
+                del self._keys[position]
+        for trigram in entry.trigrams:
+            posting = self._trigrams.get(trigram)
+            if posting is not None:
+                posting.discard(entry.id)
+                if not posting:
+                    del self._trigrams[trigram]
+
+    # ---------- обслуживание ----------
+
+    def start(self):
+        """Построение и периодическая перестройка в фоне; запросы тем временем идут по старому индексу"""
+        self.load()
+        self._stop.clear()
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="suggest-rebuild", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(REBUILD_INTERVAL):
+            try:
+                self.load()
+            except Exception as e:
+                print(f"❌ Ошибка перестройки индекса подсказок: {e}")
+
+    # ---------- поиск ----------
+
+    def suggest(self, prefix: str, limit: int = DEFAULT_LIMIT, max_age: Optional[int] = None) -> List[dict]:
+        """Подсказки по префиксу, с запасным нечетким поиском; ранжирование по скачиваниям"""
+        query = normalize(prefix)
+        if not query:
+            return []
+        cache_key = (query, limit, max_age)
+        if len(query) <= CACHED_PREFIX_LENGTH:
+            cached = self._cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        with self._lock:
+            cache = self._cache
+            matches = self._prefix_matches(query, max_age)
+            best = heapq.nlargest(limit, matches, key=lambda e: (e.downloads, -e.id))
+            if len(best) < limit and len(query) >= MIN_FUZZY_LENGTH:
+                seen = {entry.id for entry in best}
+                best.extend(self._fuzzy_matches(query, limit - len(best), max_age, seen))
+        result = [entry.as_dict() for entry in best]
+
+        if len(query) <= CACHED_PREFIX_LENGTH:
+            cache[cache_key] = result
+        return result
+
+    def _prefix_matches(self, query: str, max_age: Optional[int]) -> List[_Entry]:
+        """Приложения, название или одно из слов которых начинается с query"""
+        found: Dict[int, _Entry] = {}
+        position = bisect_left(self._keys, (query, -1))
+        while position < len(self._keys):
+            key, app_id = self._keys[position]
+            if not key.startswith(query):
+                break
+            entry = self._entries[app_id]
+            if max_age is None or entry.age_restriction <= max_age:
+                found[app_id] = entry
+            position += 1
+        return list(found.values())
+
+    def _fuzzy_matches(self, query: str, limit: int, max_age: Optional[int], exclude: Set[int]) -> List[_Entry]:
+        """Нечеткий поиск по общим триграммам; сначала по схожести, затем по скачиваниям"""
+        query_trigrams = trigrams(query, partial=True)
+        if not query_trigrams:
+            return []
+        shared: Counter = Counter()
+        for trigram in query_trigrams:
+            shared.update(self._trigrams.get(trigram, ()))
+        needed = len(query_trigrams) * FUZZY_THRESHOLD
+        candidates = []
+        for app_id, count in shared.items():
+            if count < needed or app_id in exclude:
+                continue
+            entry = self._entries[app_id]
+            if max_age is not None and entry.age_restriction > max_age:
+                continue
+            candidates.append((count / len(query_trigrams), entry))
+        best = heapq.nlargest(limit, candidates, key=lambda c: (c[0], c[1].downloads, -c[1].id))
+        return [entry for _, entry in best]
+
+
+# Индекс подсказок процесса
+suggest_index = SuggestIndex()
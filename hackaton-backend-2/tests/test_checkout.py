@@ -0,0 +1,107 @@
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from sqlalchemy import text
+
+
+def checkout(client, user_id, app_ids):
+    return client.post(f"/api/users/{user_id}/checkout", json={"app_ids": app_ids})
+
+
+def balance(client, user_id):
+    return Decimal(client.get(f"/api/users/{user_id}/balance").json()["balance"])
+
+
+def owned(engine, user_id):
+    with engine.connect() as conn:
+        return conn.execute(text(
+            "SELECT app_id FROM user_downloaded_apps WHERE user_id = :user_id ORDER BY app_id"
+        ), {"user_id": user_id}).scalars().all()
+
+
+def test_checkout_buys_all_apps(client, db, create_user, create_app):
+    user_id = create_user(balance=100)
+    app_ids = [create_app(price=10), create_app(price=25), create_app(price=0)]
+
+    response = checkout(client, user_id, app_ids)
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["purchased"] == app_ids
+    assert body["already_owned"] == []
+    assert Decimal(body["total"]) == Decimal("35.00")
+    assert Decimal(body["balance"]) == Decimal("65.00")
+    assert balance(client, user_id) == Decimal("65.00")
+    assert owned(db, user_id) == app_ids
+    with db.connect() as conn:
+        assert conn.execute(text("SELECT count(*) FROM balance_ledger WHERE kind = 'purchase'")).scalar() == 2
+        assert conn.execute(text("SELECT count(*) FROM download_events")).scalar() == 3
+        assert conn.execute(text("SELECT sum(downloads) FROM apps")).scalar() == 3
+        assert conn.execute(text("SELECT count_inputs FROM users WHERE id = :id"), {"id": user_id}).scalar() == 3
+
+
+def test_checkout_skips_owned_apps(client, create_user, create_app):
+    user_id = create_user(balance=100)
+    first, second = create_app(price=10), create_app(price=20)
+    checkout(client, user_id, [first])
+
+    body = checkout(client, user_id, [first, second]).json()
+
+    assert body["purchased"] == [second]
+    assert body["already_owned"] == [first]
+    assert Decimal(body["total"]) == Decimal("20.00")
+    assert balance(client, user_id) == Decimal("70.00")
+
+
+def test_insufficient_funds_buys_nothing(client, db, create_user, create_app):
+    user_id = create_user(balance=30)
+    app_ids = [create_app(price=10), create_app(price=25)]
+
+    response = checkout(client, user_id, app_ids)
+
+    assert response.status_code == 400
+    assert Decimal(response.json()["detail"]["required"]) == Decimal("35.00")
+    assert balance(client, user_id) == Decimal("30.00")
+    assert owned(db, user_id) == []
+    with db.connect() as conn:
+        assert conn.execute(text("SELECT sum(downloads) FROM apps")).scalar() == 0
+        assert conn.execute(text("SELECT count(*) FROM download_events")).scalar() == 0
+
+
+def test_missing_app_or_user_is_404(client, db, create_user, create_app):
+    user_id, app_id = create_user(balance=100), create_app(price=10)
+
+    response = checkout(client, user_id, [app_id, 999])
+
+    assert response.status_code == 404
+    assert response.json()["detail"]["app_ids"] == [999]
+    assert owned(db, user_id) == []
+    assert checkout(client, 999, [app_id]).status_code == 404
+
+
+def test_concurrent_checkouts_share_one_balance(client, db, create_user, create_app):
+    user_id = create_user(balance=50)
+    carts = [[create_app(price=20), create_app(price=20)] for _ in range(3)]
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        responses = list(pool.map(lambda cart: checkout(client, user_id, cart), carts))
+
+    assert sorted(response.status_code for response in responses) == [200, 400, 400]
+    assert balance(client, user_id) == Decimal("10.00")
+    assert len(owned(db, user_id)) == 2
+
+
+def test_checkout_and_single_download_do_not_double_charge(client, db, create_user, create_app):
+    user_id = create_user(balance=100)
+    app_ids = [create_app(price=10) for _ in range(4)]
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        requests = [lambda: checkout(client, user_id, app_ids)] * 4
+        requests += [lambda app_id=app_id: client.post(f"/api/users/{user_id}/download_app/{app_id}") for app_id in app_ids]
+        responses = list(pool.map(lambda request: request(), requests))
+
+    assert all(response.status_code == 200 for response in responses)
+    assert balance(client, user_id) == Decimal("60.00")
+    assert owned(db, user_id) == app_ids
+    with db.connect() as conn:
+        assert conn.execute(text("SELECT count(*) FROM balance_ledger WHERE kind = 'purchase'")).scalar() == 4
@@ -0,0 +1,31 @@
+from sqlalchemy import text
+
+
+def review(client, user_id, app_id, rating):
+    response = client.post("/api/reports", json={
+        "user_id": user_id, "app_id": app_id, "rating": rating,
+        "text": f"Отзыв пользователя {user_id} о приложении {app_id}: оценка {rating}",
+    })
+    assert response.status_code == 201, response.text
+
+
+def ratings(engine):
+    with engine.connect() as conn:
+        return dict(conn.execute(text("SELECT id, rating FROM apps ORDER BY id")).all())
+
+
+def test_delete_user_recomputes_ratings(client, db, create_user, create_app):
+    author, other = create_user(), create_user()
+    only_author, shared = create_app(), create_app()
+    review(client, author, only_author, 1)
+    review(client, author, shared, 1)
+    review(client, other, shared, 4)
+    with db.begin() as conn:
+        conn.execute(text("UPDATE apps SET rating = 2.5"))
+
+    assert client.delete(f"/api/users/{author}").status_code == 200
+
+    # Оценок не осталось – рейтинг по умолчанию; у второго – средняя оставшихся
+    assert ratings(db) == {only_author: 5.0, shared: 4.0}
+    with db.connect() as conn:
+        assert conn.execute(text("SELECT count(*) FROM reports")).scalar() == 1
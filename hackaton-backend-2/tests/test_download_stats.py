@@ -0,0 +1,128 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import event, text
+
+from database import get_current_time
+from repositories import DownloadStatsRepository
+
+
+@pytest.fixture(params=["UTC", "Asia/Tokyo"])
+def session_timezone(request, db):
+    """Зона сеанса PostgreSQL не должна влиять на статистику"""
+    def set_timezone(dbapi_connection, connection_record):
+        with dbapi_connection.cursor() as cursor:
+            cursor.execute(f"SET TIME ZONE '{request.param}'")
+
+    db.dispose()
+    event.listen(db, "connect", set_timezone)
+    yield request.param
+    event.remove(db, "connect", set_timezone)
+    db.dispose()
+
+
+def add_event(engine, app_id, created_at_utc, amount=0):
+    with engine.begin() as conn:
+        conn.execute(
+            text("INSERT INTO download_events (app_id, user_id, amount, created_at) VALUES (:app_id, 1, :amount, :created_at)"),
+            {"app_id": app_id, "amount": amount, "created_at": created_at_utc},
+        )
+
+
+def rollup():
+    with DownloadStatsRepository() as repo:
+        return repo.rollup(lag=timedelta(0))
+
+
+def nonzero(points):
+    return [(point["bucket"], point["downloads"], point["purchases"], point["revenue"]) for point in points if point["downloads"]]
+
+
+def test_download_counts_in_current_moscow_hour(client, db, session_timezone, create_user, create_app):
+    user_id, app_id = create_user(balance=100), create_app(price=10)
+    client.post(f"/api/users/{user_id}/download_app/{app_id}")
+    hour = get_current_time().replace(minute=0, second=0, microsecond=0)
+
+    for rolled_up in (False, True):
+        if rolled_up:
+            assert rollup() == 1
+        response = client.get(f"/api/apps/{app_id}/stats", params={
+            "from": hour.replace(tzinfo=None).isoformat(), "granularity": "hour",
+        })
+        assert response.status_code == 200
+        body = response.json()
+        assert body["downloads"] == 1
+        assert nonzero(body["points"]) == [(hour.isoformat(), 1, 1, 10.0)]
+
+
+def test_event_is_stored_in_utc(client, db, session_timezone, create_user, create_app):
+    user_id, app_id = create_user(), create_app()
+    client.post(f"/api/users/{user_id}/download_app/{app_id}")
+
+    with db.connect() as conn:
+        created_at = conn.execute(text("SELECT created_at FROM download_events")).scalar()
+    assert abs(created_at - datetime.now(timezone.utc).replace(tzinfo=None)) < timedelta(minutes=1)
+
+
+def test_buckets_follow_moscow_days(client, db, session_timezone, create_app):
+    app_id = create_app()
+    # 22:30 UTC 10 марта – 01:30 11 марта по Москве
+    add_event(db, app_id, datetime(2026, 3, 10, 22, 30), amount=5)
+    add_event(db, app_id, datetime(2026, 3, 10, 20, 59))
+    params = {"from": "2026-03-10T00:00:00", "to": "2026-03-11T00:00:00"}
+
+    for rolled_up in (False, True):
+        if rolled_up:
+            assert rollup() == 2
+        days = client.get(f"/api/apps/{app_id}/stats", params={**params, "granularity": "day"}).json()
+        assert nonzero(days["points"]) == [
+            ("2026-03-10T00:00:00+03:00", 1, 0, 0.0),
+            ("2026-03-11T00:00:00+03:00", 1, 1, 5.0),
+        ]
+        hours = client.get(f"/api/apps/{app_id}/stats", params={
+            **params, "to": "2026-03-11T01:00:00", "granularity": "hour",
+        }).json()
+        assert nonzero(hours["points"]) == [
+            ("2026-03-10T23:00:00+03:00", 1, 0, 0.0),
+            ("2026-03-11T01:00:00+03:00", 1, 1, 5.0),
+        ]
+
+
+def test_aware_bounds_are_converted(client, db, create_app):
+    app_id = create_app()
+    add_event(db, app_id, datetime(2026, 3, 10, 22, 30))
+
+    body = client.get(f"/api/apps/{app_id}/stats", params={
+        "from": "2026-03-10T22:00:00Z", "to": "2026-03-10T22:00:00Z", "granularity": "hour",
+    }).json()
+
+    assert body["start"] == "2026-03-11T01:00:00+03:00"
+    assert nonzero(body["points"]) == [("2026-03-11T01:00:00+03:00", 1, 0, 0.0)]
+
+
+def test_rollup_and_tail_are_not_double_counted(client, db, create_app):
+    app_id = create_app()
+    add_event(db, app_id, datetime(2026, 3, 10, 10, 0))
+    rollup()
+    add_event(db, app_id, datetime(2026, 3, 10, 10, 5))
+
+    body = client.get(f"/api/apps/{app_id}/stats", params={
+        "from": "2026-03-10T00:00:00", "to": "2026-03-10T00:00:00",
+    }).json()
+
+    assert body["downloads"] == 2
+    assert rollup() == 1
+    assert client.get(f"/api/apps/{app_id}/stats", params={
+        "from": "2026-03-10T00:00:00", "to": "2026-03-10T00:00:00",
+    }).json()["downloads"] == 2
+
+
+def test_invalid_periods(client, create_app):
+    app_id = create_app()
+    assert client.get(f"/api/apps/{app_id}/stats", params={
+        "from": "2026-03-11T00:00:00", "to": "2026-03-01T00:00:00",
+    }).status_code == 400
+    assert client.get(f"/api/apps/{app_id}/stats", params={
+        "from": "2020-01-01T00:00:00", "to": "2026-01-01T00:00:00", "granularity": "hour",
+    }).status_code == 400
+    assert client.get("/api/apps/999/stats").status_code == 404
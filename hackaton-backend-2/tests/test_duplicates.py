@@ -0,0 +1,75 @@
+import sys
+
+import pytest
+
+import duplicates
+from duplicates import ReportDuplicateIndex, signature
+
+SPAM = "Лучшее приложение в мире, скачивайте скорее и получите бонус по ссылке в профиле"
+OTHER = "Интерфейс неудобный, после обновления приложение стало часто вылетать на старте"
+
+
+@pytest.fixture
+def index(monkeypatch):
+    index = ReportDuplicateIndex()
+
+    def no_database(after_id):
+        raise AssertionError("проверка не должна обращаться к БД")
+
+    monkeypatch.setattr(index, "_read_reports", no_database)
+    return index
+
+
+def test_near_copies_are_found(index):
+    index.add(1, 10, signature(SPAM))
+    index.add(2, 20, signature(SPAM + "!"))
+    index.add(3, 10, signature(OTHER))
+
+    check = index.check(10, SPAM.upper())
+
+    assert check.similar_in_app == [1]
+    assert check.similar_elsewhere == [2]
+    assert check.best_match in (1, 2)
+    assert not check.rejected
+
+
+def test_rejected_after_repeated_copies_in_app(index):
+    for report_id in range(1, duplicates.REJECT_IN_APP + 1):
+        index.add(report_id, 10, signature(SPAM))
+
+    assert index.check(10, SPAM).rejected
+    assert not index.check(20, SPAM).rejected
+
+
+def test_short_texts_are_not_checked(index):
+    index.add(1, 10, signature(SPAM))
+    check = index.check(10, "Отлично!")
+
+    assert check.signature is None
+    assert check.similar_total == 0
+
+
+def test_removed_reports_are_ignored(index):
+    index.add(1, 10, signature(SPAM))
+    index.remove([1])
+
+    assert index.check(10, SPAM).similar_total == 0
+
+
+def test_different_texts_are_not_similar(index):
+    index.add(1, 10, signature(SPAM))
+    assert index.check(10, OTHER).similar_total == 0
+
+
+def test_memory_usage_matches_full_count(index):
+    for report_id in range(1, 300):
+        index.add(report_id, report_id % 7, signature(f"{SPAM} {report_id % 50}"))
+
+    usage = index.memory_usage()
+
+    counted = sum(sys.getsizeof(band) for band in index._bands)
+    for band in index._bands:
+        for key, bucket in band.items():
+            counted += sys.getsizeof(key) + (0 if isinstance(bucket, int) else sys.getsizeof(bucket))
+    assert usage["reports"] == 299
+    assert usage["bucket_bytes"] == counted
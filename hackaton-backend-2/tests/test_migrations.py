@@ -0,0 +1,50 @@
+from sqlalchemy import inspect, text
+
+import migrations
+from repositories import LedgerRepository
+
+
+def applied_versions(engine):
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT version FROM schema_version ORDER BY version")).scalars().all()
+
+
+def test_upgrade_empty_database(empty_db):
+    assert migrations.check_schema_version() == (0, migrations.SCHEMA_VERSION)
+
+    assert migrations.upgrade() == migrations.SCHEMA_VERSION
+
+    assert migrations.check_schema_version() == (migrations.SCHEMA_VERSION, migrations.SCHEMA_VERSION)
+    assert applied_versions(empty_db) == [version for version, _, _ in migrations.MIGRATIONS]
+    tables = set(inspect(empty_db).get_table_names())
+    assert {"users", "apps", "balance_ledger", "refresh_tokens", "jobs", "download_events"} <= tables
+
+
+def test_upgrade_is_idempotent(db):
+    assert migrations.upgrade() == migrations.SCHEMA_VERSION
+    assert applied_versions(db) == [version for version, _, _ in migrations.MIGRATIONS]
+
+
+def test_upgrade_from_old_schema_keeps_data(empty_db):
+    migrations.upgrade(target=3)
+    # Схема версии 3: еще без мягкого удаления и версий строк
+    with empty_db.begin() as conn:
+        conn.execute(text("ALTER TABLE apps DROP COLUMN deleted_at"))
+        for table in ("users", "categories", "apps"):
+            conn.execute(text(f"ALTER TABLE {table} DROP COLUMN version"))
+        conn.execute(text(
+            "INSERT INTO users (login, email, name, password, balance, created_at, updated_at, age, count_inputs) "
+            "VALUES ('old', 'old@example.com', 'Old', 'x', 42.5, now(), now(), 30, 0)"
+        ))
+
+    assert migrations.upgrade() == migrations.SCHEMA_VERSION
+
+    with empty_db.connect() as conn:
+        user_id, version = conn.execute(text("SELECT id, version FROM users WHERE login = 'old'")).one()
+        kinds = conn.execute(text("SELECT kind FROM balance_ledger WHERE user_id = :id"), {"id": user_id}).scalars().all()
+    assert version == 1
+    assert kinds == ["opening"]
+    with LedgerRepository() as ledger:
+        assert ledger.get_balance(user_id) == 42.5
+    columns = {column["name"] for column in inspect(empty_db).get_columns("apps")}
+    assert {"deleted_at", "version"} <= columns
@@ -0,0 +1,60 @@
+import pytest
+
+
+@pytest.fixture
+def app_id(create_app):
+    return create_app(price=0)
+
+
+def put_app(client, app_id, body, if_match=None):
+    headers = {"If-Match": if_match} if if_match is not None else {}
+    return client.put(f"/api/apps/{app_id}", json=body, headers=headers)
+
+
+def test_matching_if_match_updates_and_bumps_version(client, app_id):
+    response = put_app(client, app_id, {"name": "Новое имя"}, if_match='"1"')
+
+    assert response.status_code == 200
+    assert response.json()["version"] == 2
+    assert response.headers["ETag"] == '"2"'
+
+
+def test_stale_if_match_is_409_with_current_version(client, app_id):
+    put_app(client, app_id, {"name": "Первая правка"}, if_match='"1"')
+
+    response = put_app(client, app_id, {"name": "Вторая правка"}, if_match='"1"')
+
+    assert response.status_code == 409
+    assert response.json()["current_version"] == 2
+    assert response.headers["ETag"] == '"2"'
+    assert client.get(f"/api/apps/{app_id}").json()["name"] == "Первая правка"
+
+
+@pytest.mark.parametrize("if_match", ['W/"1"', "1"])
+def test_weak_and_bare_versions_are_accepted(client, app_id, if_match):
+    assert put_app(client, app_id, {"name": "Правка"}, if_match=if_match).status_code == 200
+
+
+def test_version_in_body_is_checked(client, app_id):
+    assert put_app(client, app_id, {"name": "Правка", "version": 1}).status_code == 200
+    assert put_app(client, app_id, {"name": "Еще правка", "version": 1}).status_code == 409
+
+
+def test_wildcard_and_missing_if_match_skip_check(client, app_id):
+    assert put_app(client, app_id, {"name": "Правка"}, if_match="*").status_code == 200
+    assert put_app(client, app_id, {"name": "Еще правка"}).status_code == 200
+
+
+def test_invalid_if_match_is_400(client, app_id):
+    assert put_app(client, app_id, {"name": "Правка"}, if_match='"abc"').status_code == 400
+    assert put_app(client, app_id, {"name": "Правка", "version": 2}, if_match='"1"').status_code == 400
+
+
+def test_stale_category_and_user_updates_are_409(client, create_user, app_id):
+    user_id = create_user()
+    assert client.put(f"/api/users/{user_id}", json={"name": "Имя"}, headers={"If-Match": '"1"'}).status_code == 200
+    assert client.put(f"/api/users/{user_id}", json={"name": "Имя 2"}, headers={"If-Match": '"1"'}).status_code == 409
+
+    category_id = client.get(f"/api/apps/{app_id}").json()["category_id"]
+    assert client.put(f"/api/categories/{category_id}", json={"name": "Новая"}, headers={"If-Match": '"1"'}).status_code == 200
+    assert client.put(f"/api/categories/{category_id}", json={"name": "Старая"}, headers={"If-Match": '"1"'}).status_code == 409
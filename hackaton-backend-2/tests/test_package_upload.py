@@ -0,0 +1,70 @@
+import hashlib
+
+from sqlalchemy import text
+
+PACKAGE = b"package contents"
+
+
+def login(client, login):
+    response = client.post("/api/auth/login", json={"login": login, "password": "secret1"})
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def create_app(client, headers=None):
+    category_id = client.post("/api/categories", json={"name": "Игры"}).json()["id"]
+    response = client.post("/api/apps", headers=headers or {}, json={
+        "name": "App", "url": "https://example.com/app", "short_descr": "Описание",
+        "full_descr": "Полное описание", "category_id": category_id,
+    })
+    assert response.status_code == 201, response.text
+    return response.json()["id"]
+
+
+def upload(client, app_id, headers=None):
+    return client.put(f"/api/apps/{app_id}/package", content=PACKAGE, headers={
+        **(headers or {}), "X-Checksum-SHA256": hashlib.sha256(PACKAGE).hexdigest(),
+    })
+
+
+def test_publisher_uploads_package(client, create_user):
+    create_user()
+    headers = login(client, "user1")
+    app_id = create_app(client, headers)
+
+    response = upload(client, app_id, headers)
+
+    assert response.status_code == 201, response.text
+    assert response.json()["sha256"] == hashlib.sha256(PACKAGE).hexdigest()
+
+
+def test_upload_requires_token(client):
+    app_id = create_app(client)
+
+    assert upload(client, app_id).status_code == 401
+
+
+def test_other_user_cannot_upload(client, create_user):
+    create_user(), create_user()
+    app_id = create_app(client, login(client, "user1"))
+
+    assert upload(client, app_id, login(client, "user2")).status_code == 403
+
+
+def test_admin_uploads_any_package(client, db, create_user):
+    admin_id = create_user()
+    app_id = create_app(client)
+    with db.begin() as conn:
+        conn.execute(text("UPDATE users SET is_admin = true WHERE id = :id"), {"id": admin_id})
+
+    assert upload(client, app_id, login(client, "user1")).status_code == 201
+
+
+def test_deleted_publisher_is_reset(client, db, create_user):
+    user_id = create_user()
+    app_id = create_app(client, login(client, "user1"))
+
+    assert client.delete(f"/api/users/{user_id}").status_code in (200, 204)
+
+    with db.connect() as conn:
+        assert conn.execute(text("SELECT publisher_id FROM apps WHERE id = :id"), {"id": app_id}).scalar() is None
@@ -0,0 +1,97 @@
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from sqlalchemy import text
+
+
+def balance(client, user_id):
+    return Decimal(client.get(f"/api/users/{user_id}/balance").json()["balance"])
+
+
+def purchase_state(engine, user_id, app_id):
+    with engine.connect() as conn:
+        return {
+            "purchases": conn.execute(text(
+                "SELECT count(*) FROM balance_ledger WHERE user_id = :user_id AND kind = 'purchase'"
+            ), {"user_id": user_id}).scalar(),
+            "links": conn.execute(text(
+                "SELECT count(*) FROM user_downloaded_apps WHERE user_id = :user_id AND app_id = :app_id"
+            ), {"user_id": user_id, "app_id": app_id}).scalar(),
+            "downloads": conn.execute(text("SELECT downloads FROM apps WHERE id = :id"), {"id": app_id}).scalar(),
+            "events": conn.execute(text(
+                "SELECT count(*) FROM download_events WHERE user_id = :user_id"
+            ), {"user_id": user_id}).scalar(),
+            "count_inputs": conn.execute(text("SELECT count_inputs FROM users WHERE id = :id"), {"id": user_id}).scalar(),
+        }
+
+
+def test_download_charges_and_links(client, db, create_user, create_app):
+    user_id, app_id = create_user(balance=100), create_app(price=30)
+
+    response = client.post(f"/api/users/{user_id}/download_app/{app_id}")
+
+    assert response.status_code == 200
+    assert balance(client, user_id) == Decimal("70.00")
+    assert purchase_state(db, user_id, app_id) == {
+        "purchases": 1, "links": 1, "downloads": 1, "events": 1, "count_inputs": 1,
+    }
+
+
+def test_repeat_download_is_not_charged(client, db, create_user, create_app):
+    user_id, app_id = create_user(balance=100), create_app(price=30)
+    client.post(f"/api/users/{user_id}/download_app/{app_id}")
+
+    response = client.post(f"/api/users/{user_id}/download_app/{app_id}")
+
+    assert response.json() == {"message": "Приложение уже скачано"}
+    assert balance(client, user_id) == Decimal("70.00")
+    assert purchase_state(db, user_id, app_id)["purchases"] == 1
+
+
+def test_insufficient_funds_changes_nothing(client, db, create_user, create_app):
+    user_id, app_id = create_user(balance=5), create_app(price=30)
+
+    response = client.post(f"/api/users/{user_id}/download_app/{app_id}")
+
+    assert response.status_code == 400
+    assert balance(client, user_id) == Decimal("5.00")
+    assert purchase_state(db, user_id, app_id) == {
+        "purchases": 0, "links": 0, "downloads": 0, "events": 0, "count_inputs": 0,
+    }
+
+
+def test_missing_app_is_404(client, create_user):
+    user_id = create_user(balance=100)
+    assert client.post(f"/api/users/{user_id}/download_app/999").status_code == 404
+
+
+def test_concurrent_downloads_of_same_app_charge_once(client, db, create_user, create_app):
+    user_id, app_id = create_user(balance=100), create_app(price=10)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        responses = list(pool.map(
+            lambda _: client.post(f"/api/users/{user_id}/download_app/{app_id}"), range(16)
+        ))
+
+    assert all(response.status_code == 200 for response in responses)
+    assert sum(response.json()["message"] != "Приложение уже скачано" for response in responses) == 1
+    assert balance(client, user_id) == Decimal("90.00")
+    assert purchase_state(db, user_id, app_id) == {
+        "purchases": 1, "links": 1, "downloads": 1, "events": 1, "count_inputs": 1,
+    }
+
+
+def test_concurrent_purchases_never_overdraw(client, db, create_user, create_app):
+    user_id = create_user(balance=25)
+    app_ids = [create_app(price=10) for _ in range(5)]
+
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        responses = list(pool.map(
+            lambda app_id: client.post(f"/api/users/{user_id}/download_app/{app_id}"), app_ids
+        ))
+
+    assert sorted(response.status_code for response in responses) == [200, 200, 400, 400, 400]
+    assert balance(client, user_id) == Decimal("5.00")
+    with db.connect() as conn:
+        assert conn.execute(text("SELECT count(*) FROM user_downloaded_apps")).scalar() == 2
+        assert conn.execute(text("SELECT sum(downloads) FROM apps")).scalar() == 2
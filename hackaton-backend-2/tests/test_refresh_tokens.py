@@ -0,0 +1,89 @@
+import time
+
+import pytest
+
+from security import RevocationSet, revoked_refresh_tokens
+
+
+@pytest.fixture
+def login(client, create_user):
+    create_user()
+
+    def login() -> dict:
+        response = client.post("/api/auth/login", json={"login": "user1", "password": "secret1"})
+        assert response.status_code == 200, response.text
+        return response.json()
+
+    return login
+
+
+def refresh(client, token):
+    return client.post("/api/auth/refresh", json={"refresh_token": token})
+
+
+def test_refresh_rotates_token(client, login):
+    tokens = login()
+
+    response = refresh(client, tokens["refresh_token"])
+
+    assert response.status_code == 200
+    rotated = response.json()
+    assert rotated["access_token"]
+    assert rotated["refresh_token"] != tokens["refresh_token"]
+    assert refresh(client, rotated["refresh_token"]).status_code == 200
+
+
+def test_replayed_token_revokes_whole_family(client, login):
+    first = login()["refresh_token"]
+    second = refresh(client, first).json()["refresh_token"]
+
+    # Повторное использование замененного токена – признак утечки
+    assert refresh(client, first).status_code == 401
+    assert refresh(client, second).status_code == 401
+
+
+def test_replay_detected_from_database(client, login, monkeypatch):
+    """Другой процесс не знает об отзыве: повтор распознается по revoked_at в БД"""
+    first = login()["refresh_token"]
+    second = refresh(client, first).json()["refresh_token"]
+    monkeypatch.setattr(type(revoked_refresh_tokens), "__contains__", lambda self, token_hash: False)
+
+    assert refresh(client, first).status_code == 401
+    assert refresh(client, second).status_code == 401
+
+
+def test_replay_does_not_touch_other_sessions(client, login):
+    first, other = login()["refresh_token"], login()["refresh_token"]
+    refresh(client, first)
+
+    assert refresh(client, first).status_code == 401
+    assert refresh(client, other).status_code == 200
+
+
+def test_logout_revokes_token(client, login):
+    token = login()["refresh_token"]
+
+    assert client.post("/api/auth/logout", json={"refresh_token": token}).status_code == 204
+    assert refresh(client, token).status_code == 401
+
+
+def test_rotation_does_not_grow_revocation_set(client, login):
+    token = login()["refresh_token"]
+    before = len(revoked_refresh_tokens)
+
+    for _ in range(3):
+        token = refresh(client, token).json()["refresh_token"]
+
+    assert len(revoked_refresh_tokens) == before
+
+
+def test_revocation_set_is_bounded():
+    revoked = RevocationSet(max_size=3)
+    expires_at = time.time() + 60
+    for number in range(5):
+        revoked.add(f"hash{number}", expires_at)
+    revoked.add("expired", time.time() - 1)
+
+    assert len(revoked) == 3
+    assert "hash0" not in revoked and "expired" not in revoked
+    assert "hash4" in revoked
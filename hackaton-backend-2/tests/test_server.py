@@ -0,0 +1,32 @@
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+import server
+from readiness import readiness
+
+
+def test_lifespan_fails_when_schema_is_outdated(monkeypatch):
+    monkeypatch.setattr(main, "check_schema_version", lambda: (12, 13))
+
+    with pytest.raises(RuntimeError, match="версия схемы 12"):
+        with TestClient(main.app):
+            pass
+    assert not readiness.is_ready
+
+
+def test_stable_worker_resets_boot_failures(monkeypatch):
+    monkeypatch.setattr(server, "STABLE_UPTIME", 60.0)
+    master = server.Master(server.parse_args(["--workers", "2"]))
+    now = time.monotonic()
+    last_failure = now - 30
+
+    master.workers = {1: now - 100, 2: now - 10}
+    # Воркер 1 запущен до последнего сбоя, воркер 2 работает слишком мало
+    assert not master.has_stable_worker(last_failure)
+
+    master.workers[2] = last_failure + 1
+    monkeypatch.setattr(server, "STABLE_UPTIME", 20.0)
+    assert master.has_stable_worker(last_failure)
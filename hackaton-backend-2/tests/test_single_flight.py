@@ -0,0 +1,62 @@
+import threading
+import time
+
+import pytest
+
+from cache import SingleFlight
+
+
+def run_concurrently(flights, func, callers=4):
+    results, errors = [], []
+
+    def call():
+        try:
+            results.append(flights.do(("group", 1), func))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(callers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def test_concurrent_calls_share_one_execution():
+    calls = []
+
+    def func():
+        calls.append(1)
+        time.sleep(0.2)
+        return "result"
+
+    flights = SingleFlight()
+    results, errors = run_concurrently(flights, func)
+
+    assert results == ["result"] * 4 and not errors
+    assert len(calls) == 1
+    assert flights.stats()["groups"]["group"] == {"calls": 4, "executions": 1, "collapsed": 3, "errors": 0}
+
+
+def test_waiters_get_their_own_copy_of_the_error():
+    def func():
+        time.sleep(0.2)
+        raise ValueError("БД недоступна")
+
+    results, errors = run_concurrently(SingleFlight(), func)
+
+    assert not results and len(errors) == 4
+    assert all(isinstance(error, ValueError) for error in errors)
+    assert len({id(error) for error in errors}) == 4
+    leader = [error for error in errors if error.__cause__ is None]
+    assert len(leader) == 1
+    assert all(error.__cause__ is leader[0] for error in errors if error is not leader[0])
+
+
+def test_sequential_calls_are_not_collapsed():
+    flights = SingleFlight()
+    assert flights.do(("group", 1), lambda: 1) == 1
+    assert flights.do(("group", 1), lambda: 2) == 2
+    with pytest.raises(KeyError):
+        flights.do(("group", 1), lambda: {}["missing"])
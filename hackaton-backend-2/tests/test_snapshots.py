@@ -0,0 +1,96 @@
+import os
+import time
+
+import pytest
+
+import snapshots
+from snapshots import COUNTERS_DELAY, DEBOUNCE, CatalogSnapshots
+
+# Тела больше MIN_COMPRESS_SIZE – рядом пишутся сжатые копии
+FIRST = b"[" + b'{"id":1},' * 200 + b"]"
+SECOND = b"[" + b'{"id":2},' * 200 + b"]"
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    files = {"apps.json": FIRST, "apps/1.json": SECOND}
+    store = CatalogSnapshots(str(tmp_path))
+    store.renderer = lambda: list(files.items())
+    return store, files
+
+
+def inode(store, name, relative_path):
+    return os.stat(os.path.join(store.directory, name, relative_path)).st_ino
+
+
+def test_unchanged_files_are_linked_from_previous_version(catalog):
+    store, files = catalog
+    first = store.build()
+    files["apps/1.json"] = FIRST
+    time.sleep(0.002)
+
+    second = store.build()
+
+    assert second != first
+    assert store.reused_files == 1
+    assert inode(store, first, "apps.json") == inode(store, second, "apps.json")
+    assert inode(store, first, "apps.json.gz") == inode(store, second, "apps.json.gz")
+    assert inode(store, first, "apps/1.json") != inode(store, second, "apps/1.json")
+    with open(os.path.join(store.latest_path, "apps/1.json"), "rb") as f:
+        assert f.read() == FIRST
+    with open(os.path.join(store.directory, first, "apps/1.json"), "rb") as f:
+        assert f.read() == SECOND
+
+
+def test_version_built_after_change_is_reused(catalog):
+    store, _ = catalog
+    name = store.build()
+
+    assert store.build(not_before=time.time() - 10) == name
+    assert store.builds == 1
+
+
+@pytest.mark.skipif(snapshots.fcntl is None, reason="нет fcntl")
+def test_only_one_process_builds(catalog):
+    store, _ = catalog
+    with open(os.path.join(store.directory, snapshots.BUILD_LOCK), "a") as lock_file:
+        snapshots.fcntl.flock(lock_file, snapshots.fcntl.LOCK_EX | snapshots.fcntl.LOCK_NB)
+        assert store.build() is None
+
+    assert store.build() is not None
+
+
+def test_counter_changes_keep_snapshot_and_wait_longer(catalog):
+    store, _ = catalog
+    store._dirty = False
+
+    store._on_change(1, counters_only=True)
+
+    assert not store._dirty
+    assert store._due() == pytest.approx(time.monotonic() + COUNTERS_DELAY, abs=1)
+
+    store._on_change(2)
+
+    assert store._dirty
+    assert store._due() == pytest.approx(time.monotonic() + DEBOUNCE, abs=0.5)
+
+
+@pytest.mark.skipif(snapshots.fcntl is None, reason="нет fcntl")
+def test_builder_retries_after_other_process_releases_lock(catalog, monkeypatch):
+    store, files = catalog
+    monkeypatch.setattr(snapshots, "DEBOUNCE", 0.05)
+    # Без подписки на изменения каталога: другие тесты не должны будить этот сборщик
+    store._listening = True
+    with open(os.path.join(store.directory, snapshots.BUILD_LOCK), "a") as lock_file:
+        snapshots.fcntl.flock(lock_file, snapshots.fcntl.LOCK_EX | snapshots.fcntl.LOCK_NB)
+        store.start(lambda: list(files.items()))
+        time.sleep(0.2)
+        assert store.builds == 0 and store._dirty
+    try:
+        deadline = time.monotonic() + 2
+        while store._dirty and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert store.builds == 1
+        assert not store._dirty
+    finally:
+        store.stop()
@@ -0,0 +1,34 @@
+import time
+
+import suggest
+from suggest import SuggestIndex
+
+ROWS = [(1, "Super Mario Run", 500, 0), (2, "Mario Kart", 900, 0), (3, "Subway Surfers", 100, 12)]
+
+
+def test_prefix_and_word_matches_ranked_by_downloads():
+    index = SuggestIndex()
+    index.rebuild(ROWS)
+
+    assert [item["id"] for item in index.suggest("mar")] == [2, 1]
+    assert [item["id"] for item in index.suggest("su", max_age=6)] == [1]
+
+
+def test_stale_index_is_rebuilt_in_background(monkeypatch):
+    monkeypatch.setattr(suggest, "REBUILD_INTERVAL", 0.05)
+    index = SuggestIndex()
+    loads = []
+    monkeypatch.setattr(index, "load", lambda: (loads.append(time.monotonic()), index.rebuild(ROWS)))
+
+    index.start()
+    try:
+        index.built_at = time.monotonic() - 3600
+        # Запрос к устаревшему индексу отвечает сразу и не перестраивает его сам
+        assert index.suggest("mario kart")[0]["id"] == 2
+        assert len(loads) == 1
+        deadline = time.monotonic() + 2
+        while len(loads) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert len(loads) >= 2
+    finally:
+        index.stop()
@@ -0,0 +1,83 @@
+import time
+
+import pytest
+
+import trending
+from trending import TrendingIndex
+
+
+@pytest.fixture
+def index(tmp_path):
+    return TrendingIndex(half_life=3600.0, path=str(tmp_path / "trending.json"))
+
+
+def test_top_orders_by_score(index):
+    for app_id, category_id in ((1, 10), (2, 10), (3, 20)):
+        index.upsert(app_id, category_id)
+    for _ in range(3):
+        index.record_download(2)
+    index.record_download(1)
+    index.record_report(3)
+
+    assert [app_id for app_id, _ in index.top()] == [2, 1, 3]
+    assert [app_id for app_id, _ in index.top(category_id=10)] == [2, 1]
+    assert [app_id for app_id, _ in index.top(limit=1)] == [2]
+
+
+def test_scores_halve_every_half_life(index):
+    now = time.time()
+    index.upsert(1, 10)
+    index.upsert(2, 10)
+    index.record_download(1, at=now - 3600.0)
+    index.record_download(2, at=now)
+
+    scores = dict(index.top())
+    assert scores[1] == pytest.approx(0.5, rel=1e-3)
+    assert scores[2] == pytest.approx(1.0, rel=1e-3)
+
+
+def test_rebase_keeps_scores(index, monkeypatch):
+    monkeypatch.setattr(trending, "REBASE_AFTER", 1)
+    now = time.time()
+    index.epoch = now - 3 * 3600.0
+    index.upsert(1, 10)
+    index.record_download(1, at=now - 3 * 3600.0)
+    # Показатель степени 3 > REBASE_AFTER: epoch переносится на now
+    index.record_download(1, at=now)
+
+    assert index.epoch == pytest.approx(now)
+    assert dict(index.top())[1] == pytest.approx(1.125, rel=1e-3)
+
+
+def test_large_age_restrictions_are_stored(index):
+    index.upsert(1, 10, age_restriction=200)
+    index.upsert(2, 10, age_restriction=12)
+    index.record_download(1)
+    index.record_download(2)
+
+    assert [app_id for app_id, _ in index.top(max_age=18)] == [2]
+    assert {app_id for app_id, _ in index.top(max_age=1000)} == {1, 2}
+
+
+def test_category_change_and_remove(index):
+    index.upsert(1, 10)
+    index.record_download(1)
+    index.upsert(1, 20)
+
+    assert index.top(category_id=10) == []
+    assert [app_id for app_id, _ in index.top(category_id=20)] == [1]
+
+    index.remove(1)
+    assert index.top() == []
+    assert index.top(category_id=20) == []
+
+
+def test_snapshot_round_trip(index):
+    index.upsert(1, 10)
+    index.record_download(1)
+    index.save()
+
+    state = TrendingIndex(half_life=3600.0, path=index.path)._read_snapshot()
+    assert state["epoch"] == index.epoch
+    assert state["apps"] == [[1, pytest.approx(1.0, rel=1e-3)]]
+    assert TrendingIndex(half_life=60.0, path=index.path)._read_snapshot() is None
@@ -0,0 +1,26 @@
+def login(client, login="user1"):
+    response = client.post("/api/auth/login", json={"login": login, "password": "secret1"})
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def test_age_change_applies_to_issued_token(client, create_user, create_app):
+    user_id = create_user(age=20)
+    app_id = create_app()
+    category_id = client.get(f"/api/apps/{app_id}").json()["category_id"]
+    assert client.put(f"/api/apps/{app_id}", json={"age_restriction": 18}).status_code == 200
+    headers = login(client)
+    assert client.get(f"/api/categories/{category_id}", headers=headers).json()["apps_count"] == 1
+
+    assert client.put(f"/api/users/{user_id}", json={"age": 10}).status_code == 200
+
+    assert client.get(f"/api/categories/{category_id}", headers=headers).json()["apps_count"] == 0
+
+
+def test_token_of_deleted_user_is_rejected(client, create_user):
+    user_id = create_user()
+    headers = login(client)
+
+    assert client.delete(f"/api/users/{user_id}").status_code in (200, 204)
+
+    assert client.get("/api/categories", headers=headers).status_code == 401
@@ -0,0 +1,271 @@
+"""
+Тренды: приложения, которые скачивают и обсуждают прямо сейчас.
+
+Счет приложения – сумма весов событий, затухающая с периодом полураспада
+HALF_LIFE. Чтобы не пересчитывать все счета на каждом событии, хранится
+счет, приведенный к моменту epoch:
+    stored += weight * 2 ** ((t - epoch) / HALF_LIFE),
+а текущий счет = stored * 2 ** (-(now - epoch) / HALF_LIFE).
+Множитель у всех приложений общий, поэтому порядок определяется stored
+без пересчета. Когда показатель степени растет, epoch переносится вперед
+с пересчетом массива (REBASE_AFTER полураспадов).
+
+Счета лежат в array('d') по слотам, категория и возрастное ограничение –
+в array('i'); топ-k – heapq.nlargest по слотам категории.
+
+Раз в SNAPSHOT_INTERVAL и при остановке состояние пишется в файл и
+читается при старте; события журнала скачиваний после момента снимка
+доигрываются из download_events, так что перезапуск не обнуляет тренды.
+Новые события приходят из путей записи этого процесса: при нескольких
+воркерах каждый считает свою долю трафика, порядок трендов при равномерной
+балансировке совпадает, а масштаб счета – нет.
+"""
+import heapq
+import json
+import os
+import threading
+import time
+from array import array
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import func, select
+
+from database import SessionLocal
+from models import App, DownloadEvent
+
+TRENDING_SNAPSHOT = os.environ.get(
+    "TRENDING_SNAPSHOT",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "trending_snapshots", "trending.json"),
+)
+# Период полураспада счета, секунды
+HALF_LIFE = 6 * 3600.0
+# Вес событий
+DOWNLOAD_WEIGHT = 1.0
+REPORT_WEIGHT = 0.5
+# Перенос epoch, когда множитель новых событий достигает 2 ** REBASE_AFTER
+REBASE_AFTER = 50
+SNAPSHOT_INTERVAL = 60.0
+# Старше этого события из журнала при старте не доигрываются (их вклад < 1 %)
+REPLAY_WINDOW = 7 * HALF_LIFE
+DEFAULT_LIMIT = 20
+# Приложение без категории (удалено или еще не загружено из БД)
+NO_CATEGORY = -1
+
+
+class TrendingIndex:
+    """Затухающие счета приложений и топ-k по категориям"""
+
+    def __init__(self, half_life: float = HALF_LIFE, path: str = TRENDING_SNAPSHOT):
+        self.half_life = half_life
+        self.path = path
+        self.epoch = time.time()
+        self._slots: Dict[int, int] = {}
+        self._app_ids = array("I")
+        self._scores = array("d")
+        self._categories = array("i")
+        self._ages = array("i")
+        self._by_category: Dict[int, Set[int]] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.saved_at: Optional[float] = None
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    # ---------- события ----------
+
+    def _slot(self, app_id: int) -> int:
+        slot = self._slots.get(app_id)
+        if slot is None:
+            slot = self._slots[app_id] = len(self._app_ids)
+            self._app_ids.append(app_id)
+            self._scores.append(0.0)
+            self._categories.append(NO_CATEGORY)
+            self._ages.append(0)
+        return slot
+
+    def _move(self, slot: int, category_id: Optional[int]):
+        category_id = NO_CATEGORY if category_id is None else category_id
+        previous = self._categories[slot]
+        if previous == category_id:
+            return
+        if previous != NO_CATEGORY:
+            members = self._by_category.get(previous)
+            if members is not None:
+                members.discard(slot)
+                if not members:
+                    del self._by_category[previous]
+        if category_id != NO_CATEGORY:
+            self._by_category.setdefault(category_id, set()).add(slot)
+        self._categories[slot] = category_id
+
+    def _boost(self, now: float) -> float:
+        exponent = (now - self.epoch) / self.half_life
+        if exponent > REBASE_AFTER:
+            self._rebase(now)
+            exponent = 0.0
+        return 2.0 ** exponent
+
+    def _rebase(self, now: float):
+        factor = 2.0 ** (-(now - self.epoch) / self.half_life)
+        scores = self._scores
+        for slot in range(len(scores)):
+            scores[slot] *= factor
+        self.epoch = now
+
+    def record(self, app_id: int, weight: float, category_id: Optional[int] = None,
+               at: Optional[float] = None):
+        """Событие по приложению; category_id – если известна (иначе остается прежняя)"""
+        at = time.time() if at is None else at
+        with self._lock:
+            slot = self._slot(app_id)
+            if category_id is not None:
+                self._move(slot, category_id)
+            # Множитель – до чтения счета: перенос epoch пересчитывает массив
+            boost = self._boost(at)
+            self._scores[slot] += weight * boost
+
+    def record_download(self, app_id: int, category_id: Optional[int] = None, at: Optional[float] = None):
+        self.record(app_id, DOWNLOAD_WEIGHT, category_id, at)
+
+    def record_report(self, app_id: int):
+        self.record(app_id, REPORT_WEIGHT)
+
+    def upsert(self, app_id: int, category_id: Optional[int], age_restriction: int = 0):
+        """Создание или изменение приложения: категория и возрастное ограничение"""
+        with self._lock:
+            slot = self._slot(app_id)
+            self._move(slot, category_id)
+            self._ages[slot] = age_restriction or 0
+
+    def remove(self, app_id: int):
+        """Удаленное приложение выпадает из трендов (слот остается пустым до перезапуска)"""
+        with self._lock:
+            slot = self._slots.get(app_id)
+            if slot is not None:
+                self._move(slot, None)
+                self._scores[slot] = 0.0
+
+    # ---------- чтение ----------
+
+    def top(self, limit: int = DEFAULT_LIMIT, category_id: Optional[int] = None,
+            max_age: Optional[int] = None) -> List[Tuple[int, float]]:
+        """Топ приложений [(app_id, текущий счет)] по всем категориям или по одной"""
+        with self._lock:
+            if category_id is None:
+                slots: Iterable[int] = (s for s in range(len(self._scores)) if self._categories[s] != NO_CATEGORY)
+            else:
+                slots = self._by_category.get(category_id, ())
+            scores, ages = self._scores, self._ages
+            if max_age is not None:
+                slots = (s for s in slots if ages[s] <= max_age)
+            best = heapq.nlargest(limit, (s for s in slots if scores[s] > 0), key=scores.__getitem__)
+            decay = 2.0 ** (-(time.time() - self.epoch) / self.half_life)
+            return [(self._app_ids[s], scores[s] * decay) for s in best]
+
+    def memory_usage(self) -> Dict[str, int]:
+        with self._lock:
+            arrays = sum(a.buffer_info()[1] * a.itemsize for a in (self._app_ids, self._scores, self._categories, self._ages))
+            return {"apps": len(self._slots), "array_bytes": arrays}
+
+    # ---------- снимки ----------
+
+    def save(self):
+        """Атомарная запись снимка (временный файл + rename)"""
+        with self._lock:
+            state = {
+                "saved_at": time.time(),
+                "epoch": self.epoch,
+                "half_life": self.half_life,
+                "apps": [
+                    [self._app_ids[s], self._scores[s]]
+                    for s in range(len(self._scores)) if self._scores[s] > 0
+                ],
+            }
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(temp_path, self.path)
+        self.saved_at = state["saved_at"]
+
+    def _read_snapshot(self) -> Optional[dict]:
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return state if state.get("half_life") == self.half_life else None
+
+    def load(self):
+        """Снимок с диска, категории из БД и доигрывание журнала скачиваний после снимка"""
+        now = time.time()
+        state = self._read_snapshot()
+        with SessionLocal() as session:
+            apps = session.execute(
+                select(App.id, App.category_id, App.age_restriction).where(App.deleted_at.is_(None))
+            ).all()
+            # Возраст событий считает БД: created_at хранится в UTC
+            window = min(now - state["saved_at"], REPLAY_WINDOW) if state else REPLAY_WINDOW
+            age = func.extract("epoch", func.timezone("UTC", func.now()) - DownloadEvent.created_at)
+            replay = session.execute(
+                select(DownloadEvent.app_id, age)
+                .where(age <= window)
+                .order_by(DownloadEvent.id)
+            ).all()
+
+        with self._lock:
+            self._slots, self._by_category = {}, {}
+            self._app_ids, self._scores = array("I"), array("d")
+            self._categories, self._ages = array("i"), array("i")
+            self.epoch = state["epoch"] if state else now
+            for app_id, category_id, age_restriction in apps:
+                slot = self._slot(app_id)
+                self._move(slot, category_id)
+                self._ages[slot] = age_restriction or 0
+            if state:
+                for app_id, score in state["apps"]:
+                    slot = self._slots.get(app_id)
+                    if slot is not None:
+                        self._scores[slot] = score
+            for app_id, seconds_ago in replay:
+                slot = self._slots.get(app_id)
+                if slot is not None:
+                    boost = self._boost(now - float(seconds_ago))
+                    self._scores[slot] += DOWNLOAD_WEIGHT * boost
+            self._boost(now)
+        print(f"🔥 Тренды загружены: {len(apps)} приложений, доиграно скачиваний: {len(replay)}")
+
+    # ---------- жизненный цикл ----------
+
+    def start(self):
+        """Загрузка и периодическая запись снимков в фоновом потоке"""
+        self.load()
+        self._stop.clear()
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="trending-snapshots", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread is None:
+            # Индекс не запускался (неудачный старт) – пустой индекс не должен затереть снимок
+            return
+        self._thread.join(timeout)
+        self._thread = None
+        try:
+            self.save()
+        except OSError as e:
+            print(f"❌ Ошибка записи снимка трендов: {e}")
+
+    def _run(self):
+        while not self._stop.wait(SNAPSHOT_INTERVAL):
+            try:
+                self.save()
+            except OSError as e:
+                print(f"❌ Ошибка записи снимка трендов: {e}")
+
+
+# Тренды процесса
+trending_index = TrendingIndex()